@@ -0,0 +1,229 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2024, SBNB Team
+# MIT License (see LICENSE or https://opensource.org/licenses/MIT)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: benchmark_report
+short_description: Compare two sbnb benchmark runs and report the overhead per metric
+version_added: "1.0.0"
+description:
+  - Reads two result files written by the C(sbnb.compute.benchmark) role,
+    typically one from the bare metal host and one from a VM on it
+  - Reports, for every metric found in both, how much worse the candidate is
+    than the baseline in percent (negative when the candidate is faster)
+  - Optionally flags metrics whose overhead exceeds I(max_overhead)
+
+options:
+  baseline:
+    description:
+      - Results file of the reference run (e.g. the host)
+    type: path
+    required: true
+
+  candidate:
+    description:
+      - Results file of the run to compare (e.g. the VM)
+    type: path
+    required: true
+
+  dest:
+    description:
+      - Write the report as JSON to this path
+    type: path
+
+  max_overhead:
+    description:
+      - Overhead in percent above which a metric is listed in C(regressions)
+      - The module does not fail on regressions; assert on C(regressions)
+        to gate a change
+    type: float
+
+author:
+  - SBNB Team
+'''
+
+EXAMPLES = r'''
+- name: Compare VM against bare metal
+  sbnb.compute.benchmark_report:
+    baseline: /tmp/sbnb-benchmark/host1-host.json
+    candidate: /tmp/sbnb-benchmark/host1-vm.json
+    dest: /tmp/sbnb-benchmark/host1-report.json
+    max_overhead: 10
+  delegate_to: localhost
+  register: report
+
+- name: Fail when the VM is more than 10% slower anywhere
+  ansible.builtin.assert:
+    that: report.regressions | length == 0
+    fail_msg: "{{ report.report }}"
+'''
+
+RETURN = r'''
+metrics:
+  description:
+    - One entry per metric present in both runs, sorted by name
+    - C(overhead_pct) is positive when the candidate is worse (lower
+      throughput or higher latency)
+  returned: always
+  type: list
+  elements: dict
+  sample:
+    - metric: fio_randread_4k_iops
+      unit: IOPS
+      higher_is_better: true
+      baseline: 412000.0
+      candidate: 371500.0
+      overhead_pct: 9.83
+
+regressions:
+  description: Names of metrics whose overhead exceeds I(max_overhead)
+  returned: always
+  type: list
+  sample: ["fio_randread_4k_clat_p99_us"]
+
+missing:
+  description: Metrics found in only one of the two runs
+  returned: always
+  type: list
+  sample: ["gpu_nbody_gflops"]
+
+report:
+  description: Human readable table of the comparison
+  returned: always
+  type: list
+  elements: str
+'''
+
+import json
+
+from ansible.module_utils.basic import AnsibleModule
+
+
+# =============================================================================
+# Helper Functions
+# =============================================================================
+
+def load_results(module, path):
+    """Read a benchmark role results file"""
+    try:
+        with open(path) as f:
+            results = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        module.fail_json(msg=f"Cannot read benchmark results {path}: {e}")
+    if not isinstance(results, dict) or not isinstance(results.get('metrics'), dict):
+        module.fail_json(msg=f"{path} has no metrics (not written by the benchmark role?)")
+    return results
+
+
+def overhead_pct(baseline, candidate, higher_is_better):
+    """Percent by which candidate is worse than baseline (None without a baseline)"""
+    if not baseline:
+        return None
+    if higher_is_better:
+        return round((baseline - candidate) / baseline * 100, 2)
+    return round((candidate - baseline) / baseline * 100, 2)
+
+
+def compare_metrics(baseline, candidate, max_overhead=None):
+    """Return (metrics, regressions, missing) for two metrics dicts"""
+    metrics = []
+    regressions = []
+    for name in sorted(set(baseline) & set(candidate)):
+        base = baseline[name]
+        higher_is_better = base.get('higher_is_better', True)
+        entry = {
+            'metric': name,
+            'unit': base.get('unit', ''),
+            'higher_is_better': higher_is_better,
+            'baseline': base['value'],
+            'candidate': candidate[name]['value'],
+            'overhead_pct': overhead_pct(base['value'], candidate[name]['value'], higher_is_better),
+        }
+        metrics.append(entry)
+        if max_overhead is not None and entry['overhead_pct'] is not None \
+                and entry['overhead_pct'] > max_overhead:
+            regressions.append(name)
+    missing = sorted(set(baseline) ^ set(candidate))
+    return metrics, regressions, missing
+
+
+def format_report(metrics, baseline_label, candidate_label, regressions):
+    """Render the comparison as fixed-width text lines"""
+    header = (f"{'metric':<32} {'unit':<9} {baseline_label:>14} "
+              f"{candidate_label:>14} {'overhead':>9}")
+    lines = [header, '-' * len(header)]
+    for m in metrics:
+        overhead = '-' if m['overhead_pct'] is None else f"{m['overhead_pct']:+.1f}%"
+        flag = '  !' if m['metric'] in regressions else ''
+        lines.append(
+            f"{m['metric']:<32} {m['unit']:<9} {m['baseline']:>14} "
+            f"{m['candidate']:>14} {overhead:>9}{flag}"
+        )
+    return lines
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            baseline=dict(type='path', required=True),
+            candidate=dict(type='path', required=True),
+            dest=dict(type='path'),
+            max_overhead=dict(type='float'),
+        ),
+        supports_check_mode=True,
+    )
+
+    baseline = load_results(module, module.params['baseline'])
+    candidate = load_results(module, module.params['candidate'])
+    metrics, regressions, missing = compare_metrics(
+        baseline['metrics'], candidate['metrics'], module.params['max_overhead'],
+    )
+
+    result = dict(
+        changed=False,
+        baseline=baseline.get('label', 'baseline'),
+        candidate=candidate.get('label', 'candidate'),
+        metrics=metrics,
+        regressions=regressions,
+        missing=missing,
+        report=format_report(
+            metrics, baseline.get('label', 'baseline'), candidate.get('label', 'candidate'), regressions,
+        ),
+    )
+
+    dest = module.params['dest']
+    if dest:
+        content = json.dumps({
+            'baseline': {k: baseline.get(k) for k in ('label', 'hostname', 'collected_at', 'parameters')},
+            'candidate': {k: candidate.get(k) for k in ('label', 'hostname', 'collected_at', 'parameters')},
+            'max_overhead': module.params['max_overhead'],
+            'metrics': metrics,
+            'regressions': regressions,
+            'missing': missing,
+        }, indent=2)
+        try:
+            with open(dest) as f:
+                unchanged = f.read() == content
+        except (IOError, OSError):
+            unchanged = False
+        if not unchanged:
+            result['changed'] = True
+            if not module.check_mode:
+                with open(dest, 'w') as f:
+                    f.write(content)
+
+    module.exit_json(**result)
+
+
+if __name__ == '__main__':
+    main()
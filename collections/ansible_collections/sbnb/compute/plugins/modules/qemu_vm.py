@@ -23,8 +23,8 @@ options:
     description:
       - Name of the virtual machine
       - Used as container name and hostname
+      - Required for every state except C(gc)
     type: str
-    required: true
 
   state:
     description:
@@ -33,8 +33,16 @@ options:
       - C(absent) ensures VM is removed
       - C(started) same as present
       - C(stopped) ensures VM is stopped but not removed
+      - C(gc) reclaims unreferenced VM directories and cached images under
+        I(storage_path) (see I(gc_budget)); run in check mode for a dry-run report.
+        VMs last started on another host (shared I(storage_path)) and
+        everything they use are left alone
+      - C(migrated) live-migrates the running VM to I(destination)
+      - C(backed_up) takes a full or incremental backup of the running VM's
+        boot and data disks into I(backup_path)
+      - C(restored) writes a backup back onto the disks of a stopped VM
     type: str
-    choices: ['present', 'absent', 'started', 'stopped']
+    choices: ['present', 'absent', 'started', 'stopped', 'gc', 'migrated', 'backed_up', 'restored']
     default: present
 
   vcpu:
@@ -51,6 +59,34 @@ options:
     type: str
     default: "4G"
 
+  max_vcpu:
+    description:
+      - vCPU ceiling for hotplug (C(-smp maxcpus)); changing I(vcpu) on a
+        running VM between its boot count and this value happens live
+      - Without it the VM boots with C(-smp <vcpu>) and has no vCPU hotplug
+      - Not used with I(cpu_pinning), I(confidential_computing) or microvm
+    type: int
+
+  max_mem:
+    description:
+      - Memory ceiling for hotplug (e.g. C(64G)); guest RAM above I(mem) is
+        provided by a virtio-mem device, so changing I(mem) on a running VM
+        between its boot size and this value happens live
+      - When unset, memory changes need a restart
+      - Not used with I(confidential_computing) or microvm
+    type: str
+
+  resize_restart:
+    description:
+      - Restart a running VM when a change of the requested I(vcpu)/I(mem)
+        cannot be hotplugged (beyond the ceilings, below the boot size,
+        pinned vCPUs)
+      - When false such changes fail instead; a VM whose size was capped to
+        the host at boot is never resized or restarted unless the requested
+        size changes
+    type: bool
+    default: false
+
   image_url:
     description:
       - URL to download the base cloud image
@@ -63,6 +99,62 @@ options:
     type: str
     default: "10G"
 
+  disk_backend:
+    description:
+      - Where boot and data disks are stored
+      - C(qcow2) keeps them as qcow2 files under I(storage_path)
+      - C(lvm-thin) carves them from the thin pool I(thin_pool) in the volume
+        group I(vg_name) and attaches them as raw block devices; each base
+        image version is written once to a thin volume and boot disks are
+        thin snapshots of it, so clones are instant
+      - With C(lvm-thin), backups are always full (dirty bitmaps need qcow2)
+        and the VM cannot be live-migrated
+    type: str
+    choices: ['qcow2', 'lvm-thin']
+    default: qcow2
+
+  vg_name:
+    description:
+      - LVM volume group holding I(thin_pool) (C(disk_backend=lvm-thin))
+    type: str
+    default: sbnb-vg
+
+  thin_pool:
+    description:
+      - LVM thin pool VM disks are allocated from (C(disk_backend=lvm-thin)),
+        created by the storage role with C(sbnb_thin_pool_size)
+    type: str
+    default: sbnb-thin
+
+  base_image_tuning:
+    description:
+      - Convert each downloaded base image once into a tuned qcow2 under
+        I(storage_path)/images/tuned/ that boot disks are copied from
+      - Cloud images ship zlib-compressed, so guests would otherwise
+        decompress base OS clusters on every read
+      - C(uncompressed) stores clusters as-is (fastest reads, larger file),
+        C(zstd) recompresses with zstd (cheap to decompress, smaller),
+        C(off) copies the downloaded image unchanged
+      - The variant is keyed by the source image hash, so C(qemu-img convert)
+        runs once per image version
+      - Off by default; it only affects boot disks created after it is set
+        (existing persisted boot disks keep their clusters), and
+        I(state=gc) removes variants no VM uses once it is turned off again
+      - Not used with C(disk_backend=lvm-thin), where the base image is
+        stored as raw blocks in a thin volume
+    type: str
+    choices: ['off', 'uncompressed', 'zstd']
+    default: 'off'
+
+  base_image_cluster_size:
+    description:
+      - qcow2 cluster size of the tuned base image (and boot disks copied
+        from it); the image is created with C(extended_l2=on), which splits
+        each cluster into 32 subclusters for small guest writes
+    type: str
+    choices: ['16k', '32k', '64k', '128k', '256k', '512k', '1M', '2M']
+    default: 128k
+
   tskey:
     description:
       - Tailscale authentication key for VM network access
@@ -73,12 +165,23 @@ options:
   gpus:
     description:
       - GPU passthrough configuration
-      - C(auto) detects and attaches all NVIDIA/AMD GPUs
+      - C(auto) attaches every NVIDIA/AMD GPU not already used by another VM
+      - A number (e.g. C(2)) attaches that many free GPUs, preferring GPUs
+        behind one PCIe switch, then on one NUMA node
       - Provide a list of PCI addresses for specific GPUs
       - C(false) or empty to disable
+      - Allocations are recorded in I(storage_path)/state/gpu-ledger.json and
+        checked against running VM containers; other devices in a GPU's
+        IOMMU group (e.g. its audio function) are passed through with it
     type: raw
     default: false
 
+  gpu_model:
+    description:
+      - Only consider GPUs whose lspci description or C(vendor:device) ID
+        contains this string (case-insensitive), e.g. C(H100) or C(10de:2330)
+    type: str
+
   pcie_devices:
     description:
       - List of PCIe device addresses to pass through
@@ -170,6 +273,372 @@ options:
     type: bool
     default: false
 
+  console_log_size:
+    description:
+      - Maximum size of the serial console log before it is rotated
+      - The log is written to C(console.log) in the VM directory
+      - Also bounds the Docker json-file log of the VM container
+    type: str
+    default: "10M"
+
+  console_log_files:
+    description:
+      - Number of rotated console logs to keep (C(console.log.1) ... C(console.log.N))
+    type: int
+    default: 2
+
+  console_tail_lines:
+    description:
+      - Number of console lines returned in C(console_tail)
+    type: int
+    default: 50
+
+  console_startup_wait:
+    description:
+      - Seconds to watch a newly started VM container for an early exit
+      - If the container exits within this window the task fails and
+        returns the last console lines
+      - The watch ends early once QEMU accepts connections on its QMP socket
+      - Set to 0 to disable the check
+    type: int
+    default: 5
+
+  health_devices:
+    description:
+      - Give the guest a C(pvpanic-pci) device and report its failures to
+        the host VM supervisor (C(sbnb-vm-supervisor))
+      - A guest kernel panic or an expired guest watchdog ends QEMU
+        (C(-action panic=shutdown,watchdog=shutdown)); the supervisor
+        sees the cause on a second QMP socket (C(qmp-events.sock) in the VM
+        directory) and restarts the container with backoff
+      - Without the supervisor such a VM stays stopped, as a crashed VM
+        always has, where it would otherwise reboot itself or hang; so only
+        enable this on hosts running the supervisor
+    type: bool
+    default: false
+
+  guest_watchdog_timeout:
+    description:
+      - Seconds after which a hung guest is considered dead
+      - Adds an C(i6300esb) watchdog device and lets the guest's systemd
+        feed it (C(RuntimeWatchdogSec)); needs I(health_devices)
+      - 0 (default) leaves the watchdog out; 60 suits most guests
+    type: int
+    default: 0
+
+  boot_mode:
+    description:
+      - How the VM is booted
+      - C(firmware) boots through OVMF and GRUB from the boot disk
+      - C(fast) boots the kernel and initrd of the base image directly with
+        C(-kernel)/C(-initrd)/C(-append), skipping firmware and bootloader
+      - The kernel and initrd are extracted once per base image and cached in
+        C(storage_path/images/kernels/<image hash>)
+      - C(fast) is not supported with I(confidential_computing)
+    type: str
+    choices: ['firmware', 'fast']
+    default: firmware
+
+  fast_boot_machine:
+    description:
+      - QEMU machine type used when I(boot_mode=fast)
+      - C(microvm) has a minimal device model and boots fastest, but does not
+        support GPU or PCIe passthrough
+    type: str
+    choices: ['q35', 'microvm']
+    default: q35
+
+  kernel_append:
+    description:
+      - Kernel command line used when I(boot_mode=fast)
+    type: str
+    default: "root=LABEL=cloudimg-rootfs ro console=ttyS0"
+
+  wait_for_boot:
+    description:
+      - Wait until cloud-init reports it has finished on the serial console
+      - The time from container start to that point is returned as C(boot_seconds)
+    type: bool
+    default: false
+
+  boot_timeout:
+    description:
+      - Seconds to wait for cloud-init when I(wait_for_boot=true)
+    type: int
+    default: 600
+
+  offline_provisioning:
+    description:
+      - Install Tailscale and I(first_boot_packages) in the guest from a
+        host-side cache instead of downloading them inside every new VM
+      - The cache lives in C(storage_path/cache) and is versioned; it is
+        shipped to the guest on a shared read-only disk (label C(SBNBPROV))
+      - Tailscale is cached as the .deb from its apt repository; the guest
+        installs it from the disk and keeps the repository configured, so it
+        gets Tailscale updates like an online install
+      - The guest falls back to the internet if the disk or a package is missing
+    type: bool
+    default: false
+
+  tailscale_version:
+    description:
+      - Tailscale version to cache for offline provisioning
+      - C(latest) resolves the current stable release at most once a day
+        (the answer is kept in the cache), falling back to the newest cached
+        version when the host is offline
+    type: str
+    default: latest
+
+  first_boot_packages:
+    description:
+      - Ubuntu packages to install on first boot
+      - With I(offline_provisioning) the .deb files (and missing dependencies)
+        are downloaded once on the host using I(package_cache_image)
+    type: list
+    elements: str
+    default: []
+
+  package_cache_image:
+    description:
+      - Container image matching the guest distribution, used to resolve and
+        download I(first_boot_packages) into the host cache
+    type: str
+    default: "ubuntu:24.04"
+
+  cpu_pinning:
+    description:
+      - Give the VM dedicated host cores and pin QEMU threads to them
+      - Cores are allocated whole (SMT siblings together) from a host-wide
+        ledger in I(storage_path)/state/cpu-ledger.json, preferring the NUMA
+        node of attached GPUs and PCIe devices
+      - Each vCPU thread is pinned to one host CPU; emulator and I/O threads
+        (and virtiofsd) run on the host's reserved cores (I(host_reserved_cpus)),
+        off the vCPU cores
+      - VMs without I(cpu_pinning) are confined to the cores no pinned VM
+        holds; running ones are moved whenever pinned cores change hands
+      - Not supported with I(disable_kvm)
+    type: bool
+    default: false
+
+  host_reserved_cpus:
+    description:
+      - Logical CPUs never handed out by I(cpu_pinning), kept for the host
+        (Docker, tailscaled, unpinned VMs, emulator threads of pinned VMs)
+      - Taken as whole cores starting from CPU 0
+    type: int
+    default: 2
+
+  cpu_shares:
+    description:
+      - Relative CPU weight of the VM container against other containers
+        (Docker default is 1024)
+    type: int
+
+  cpu_quota:
+    description:
+      - Maximum host CPU time the VM container may use, in CPUs (e.g. C(4.5))
+    type: float
+
+  mem_limit:
+    description:
+      - Memory limit of the VM container (cgroup memory.max)
+      - C(auto) is guest RAM (I(mem)) plus I(mem_overhead)
+      - A size (e.g. C(18G)) sets the limit directly
+      - Too small a limit gets the VM OOM-killed
+    type: str
+
+  mem_overhead:
+    description:
+      - QEMU, virtiofsd and page-table overhead added to guest RAM for
+        I(mem_limit=auto)
+      - Defaults to 512M plus 2% of guest RAM
+    type: str
+
+  io_weight:
+    description:
+      - Relative block I/O weight of the VM container (10-1000, cgroup v2
+        io.weight)
+    type: int
+
+  io_max:
+    description:
+      - Block I/O limits (cgroup v2 io.max) on the device backing
+        I(storage_path), where boot and data disks live (with
+        C(disk_backend=lvm-thin), on each of the VM's thin volumes)
+      - Bandwidth values are sizes per second (e.g. C(200M))
+    type: dict
+    suboptions:
+      read_bps:
+        description: Read bandwidth limit per second
+        type: str
+      write_bps:
+        description: Write bandwidth limit per second
+        type: str
+      read_iops:
+        description: Read operations per second
+        type: int
+      write_iops:
+        description: Write operations per second
+        type: int
+
+  lock_timeout:
+    description:
+      - Seconds to wait for a lock on shared host state (cached images,
+        kernels, provisioning cache, vfio binding, data disks, the VM itself)
+        held by another qemu_vm run
+      - The task fails with the name of the contended lock when exceeded
+    type: int
+    default: 900
+
+  prepare_workers:
+    description:
+      - Threads used to prepare a new VM's assets (image download and copy,
+        kernel extraction, cloud-init, vfio binding, data disk)
+      - Independent steps run at the same time; C(1) runs them one by one
+    type: int
+    default: 4
+
+  destination:
+    description:
+      - Destination sbnb host for I(state=migrated), as reachable from this
+        host for the migration stream
+      - The destination must have every disk of the VM at the same path
+        (shared storage or disks synced beforehand) and the same bridge
+    type: str
+
+  destination_docker_host:
+    description:
+      - Docker daemon on the destination host
+      - Defaults to C(ssh://root@<destination>); use
+        C(unix:///var/run/docker.sock) to migrate between two containers on
+        this host
+    type: str
+
+  migration_port:
+    description: TCP port the incoming QEMU listens on
+    type: int
+    default: 4444
+
+  migration_multifd_channels:
+    description:
+      - Parallel migration streams (multifd)
+      - Ignored with I(migration_postcopy)
+    type: int
+    default: 4
+
+  migration_compression:
+    description:
+      - Compression of multifd streams
+      - Ignored with I(migration_postcopy)
+    type: str
+    choices: ['none', 'zlib', 'zstd']
+    default: zstd
+
+  migration_postcopy:
+    description:
+      - Switch to postcopy after the first RAM pass, so VMs dirtying memory
+        faster than the link can copy still converge
+      - If the network fails during postcopy the VM is lost
+    type: bool
+    default: false
+
+  migration_downtime_limit:
+    description: Maximum downtime allowed at switchover, in milliseconds
+    type: int
+    default: 300
+
+  migration_timeout:
+    description: Seconds to wait for the migration to complete
+    type: int
+    default: 3600
+
+  dirty_bitmaps:
+    description:
+      - Track changed blocks of the boot and data disks in persistent dirty
+        bitmaps (stored in the qcow2 files) from VM start, so I(state=backed_up)
+        can copy only what changed since the previous backup
+      - Off by default, since every guest write then also updates the bitmap;
+        without it every I(state=backed_up) is a full backup. On a running VM,
+        a full I(state=backed_up) with this set starts the tracking
+    type: bool
+    default: false
+
+  backup_path:
+    description:
+      - Directory holding the backup chain and its C(manifest.json)
+      - Must be under I(storage_path), which the QEMU container can write
+      - Defaults to I(storage_path)/backups/<name>
+    type: str
+
+  backup_mode:
+    description:
+      - C(auto) takes an incremental backup when the chain in I(backup_path)
+        continues from the VM's current disks, a full one otherwise
+      - C(full) starts a new chain, C(incremental) fails if it cannot continue one
+    type: str
+    choices: ['auto', 'full', 'incremental']
+    default: auto
+
+  backup_id:
+    description:
+      - Backup to restore with I(state=restored) (C(id) from the manifest,
+        the UTC start time with milliseconds, e.g. C(20261019T021500.123))
+      - Defaults to the latest backup
+    type: str
+
+  backup_timeout:
+    description: Seconds to wait for a backup to finish
+    type: int
+    default: 21600
+
+  gc_budget:
+    description:
+      - Disk budget for I(state=gc), e.g. C(500G)
+      - Unreferenced artifacts are reclaimed least recently used first until
+        the total size of VM directories, cached images and data disks is
+        within the budget
+      - When unset, every unreferenced artifact is reclaimed
+    type: str
+
+  gc_data_disks:
+    description:
+      - Allow I(state=gc) to delete data disks not attached to any container
+      - Data disks hold user data and are only reported when false
+    type: bool
+    default: false
+
+  shared_dirs:
+    description:
+      - Host directories shared into the guest over virtiofs
+      - A C(virtiofsd) sidecar process is started per directory inside the VM
+        container, and guest RAM is backed by shared memory (memfd)
+      - The guest mounts each share at I(mount_point) (added to C(/etc/fstab)
+        on first boot)
+      - Not supported with I(confidential_computing)
+    type: list
+    elements: dict
+    default: []
+    suboptions:
+      source:
+        description:
+          - Host directory to share (created if missing)
+        type: path
+        required: true
+      tag:
+        description:
+          - virtiofs mount tag seen by the guest
+        type: str
+        required: true
+      mount_point:
+        description:
+          - Guest mount point, defaults to C(/mnt/<tag>)
+        type: str
+      readonly:
+        description:
+          - Export the directory read-only
+        type: bool
+        default: false
+
 requirements:
   - docker (Python library)
   - Docker daemon running on target host
@@ -200,6 +669,19 @@ EXAMPLES = r'''
     data_disk_name: datasets
     data_disk_size: "500G"
 
+# Start an inference VM sharing the host-wide model store over virtiofs
+- name: Start vLLM VM with shared model cache
+  sbnb.compute.qemu_vm:
+    name: vllm-vm-01
+    vcpu: 16
+    mem: "64G"
+    tskey: "{{ tailscale_key }}"
+    gpus: auto
+    shared_dirs:
+      - source: /mnt/sbnb-data/models
+        tag: sbnb-models
+        mount_point: /mnt/sbnb-models
+
 # Start a confidential computing VM
 - name: Start confidential VM
   sbnb.compute.qemu_vm:
@@ -221,6 +703,35 @@ EXAMPLES = r'''
     name: dev-vm-01
     state: absent
 
+# Evacuate a CPU inference VM to another host (disks on shared storage)
+- name: Live-migrate VM
+  sbnb.compute.qemu_vm:
+    name: inference-vm
+    state: migrated
+    destination: sbnb-host-2
+  register: migration
+
+# Nightly backup: full the first time, then only changed blocks
+- name: Back up VM disks
+  sbnb.compute.qemu_vm:
+    name: my-vm
+    state: backed_up
+  register: backup
+
+# Restore the latest backup (VM must be stopped)
+- name: Restore VM disks
+  sbnb.compute.qemu_vm:
+    name: my-vm
+    state: restored
+
+# Preview what garbage collection would free (dry run)
+- name: Report reclaimable VM storage
+  sbnb.compute.qemu_vm:
+    state: gc
+    gc_budget: "500G"
+  check_mode: true
+  register: gc_report
+
 # Remove a VM and delete boot disk
 - name: Remove VM and disk
   sbnb.compute.qemu_vm:
@@ -269,22 +780,167 @@ gpus_attached:
   type: list
   sample: ["0000:01:00.0", "0000:41:00.0"]
 
+prepare_timings:
+  description:
+    - Seconds spent in each asset preparation step of a newly created VM
+    - Steps overlap, so the VM was ready after the longest dependency chain
+      rather than the sum
+  returned: when a VM is created
+  type: dict
+  sample: {"download_image": 0.41, "boot_image": 3.12, "cloud_init": 0.87, "data_disk": 0.52}
+
 image_path:
   description: Path to VM boot image
   returned: when state is present/started
   type: str
   sample: "/mnt/sbnb-data/images/dev-vm-01/dev-vm-01.qcow2"
 
+migration:
+  description:
+    - Live migration statistics for I(state=migrated)
+    - C(downtime_ms) is the time the VM was paused at switchover,
+      C(throughput_mbps) the average transfer rate
+  returned: when state is migrated
+  type: dict
+  sample:
+    destination: "sbnb-host-2"
+    container: "inference-vm"
+    fingerprint: "5e0d1a4c2f9b7e31"
+    status: completed
+    downtime_ms: 41
+    total_time_ms: 18342
+    setup_time_ms: 12
+    transferred_bytes: 8741234567
+    throughput_mbps: 3812.6
+    multifd_channels: 4
+    compression: zstd
+    postcopy: false
+
+backup:
+  description:
+    - Backup taken (I(state=backed_up)) or restored (I(state=restored))
+    - C(disks) maps the QEMU drive to the backup file and the bytes it holds
+  returned: when state is backed_up or restored
+  type: dict
+  sample:
+    id: "20261019T021500.482"
+    type: incremental
+    parent: "20261018T021500.917"
+    path: "/mnt/sbnb-data/backups/my-vm/20261019T021500.482"
+    chain_length: 2
+    duration_seconds: 14.2
+    disks:
+      disk0: {file: "/mnt/sbnb-data/backups/my-vm/20261019T021500.482/disk0.qcow2", bytes: 73400320}
+
+gc:
+  description:
+    - Garbage collection report for I(state=gc)
+    - C(artifacts) lists every VM directory, cached image, kernel cache,
+      provisioning cache entry and data disk with its size, last use and
+      whether a container references it
+  returned: when state is gc
+  type: dict
+  sample:
+    total_bytes: 161061273600
+    budget_bytes: 107374182400
+    budget_met: true
+    bytes_freed: 64424509440
+    reclaimed:
+      - {path: "/mnt/sbnb-data/images/sbnb-vm-old", kind: vm_dir, bytes: 21474836480}
+
+resources:
+  description:
+    - cgroup limits Docker applied to the VM container
+    - C(mem_limit) is in bytes, C(io_max) rates in bytes or operations per second
+  returned: when state is present/started and a limit is set
+  type: dict
+  sample:
+    cpu_shares: 512
+    cpu_quota: 4.0
+    mem_limit: 17716740096
+    io_weight: 100
+    io_max: {device: "/dev/dm-0", write_bps: 209715200}
+
+resized:
+  description:
+    - vCPU and memory changes applied to a running VM
+    - C(live) is true when they were hotplugged, false when the VM was restarted
+  returned: when vcpu or mem of a running VM changed
+  type: dict
+  sample:
+    live: true
+    vcpu: {from: 4, to: 8}
+    mem: {from: "8192M", to: "16384M"}
+
+cpu_pinning:
+  description:
+    - Host CPUs dedicated to the VM and the thread pin map
+    - C(vcpus) maps vCPU index to host CPU, C(emulator) and C(iothreads) are
+      host CPU lists
+  returned: when cpu_pinning is enabled
+  type: dict
+  sample:
+    cpus: "4-7"
+    vcpus: {"0": 4, "1": 5, "2": 6, "3": 7}
+    emulator: "4-7"
+    iothreads: {"iothread0": "4-7"}
+
 qemu_command:
   description: Full QEMU command used to start VM (only with increased verbosity)
   returned: when state is present/started and verbosity > 0
   type: str
+
+console_log:
+  description: Path to the VM serial console log
+  returned: when state is present/started
+  type: str
+  sample: "/mnt/sbnb-data/images/dev-vm-01/console.log"
+
+boot_seconds:
+  description: Seconds from container start until cloud-init finished
+  returned: when wait_for_boot is true
+  type: float
+  sample: 14.2
+
+provision_image:
+  description: Shared read-only provisioning disk attached to the VM
+  returned: when offline_provisioning is enabled and the cache is available
+  type: str
+  sample: "/mnt/sbnb-data/cache/provision/9c2e4b7a10f3d6e8.iso"
+
+base_image:
+  description: Tuned base image the boot disk was copied from
+  returned: when a VM is created with base_image_tuning enabled
+  type: str
+  sample: "/mnt/sbnb-data/images/tuned/3f5a9c0e1b2d4a6f-uncompressed-128k.qcow2"
+
+kernel_path:
+  description: Cached kernel used for direct kernel boot
+  returned: when boot_mode is fast
+  type: str
+  sample: "/mnt/sbnb-data/images/kernels/3f5a9c0e1b2d4a6f/vmlinuz"
+
+console_tail:
+  description:
+    - Last lines of the serial console log
+    - Returned when the VM exits during startup or a stopped VM is recreated
+  returned: when the VM exited
+  type: list
+  elements: str
+  sample: ["[    1.234567] Kernel panic - not syncing: VFS: Unable to mount root fs"]
 '''
 
 import os
+import re
 import json
+import time
+import fcntl
+import contextlib
+import concurrent.futures
 import hashlib
+import shlex
 import shutil
+import socket
 import traceback
 
 from ansible.module_utils.basic import AnsibleModule
@@ -308,6 +964,110 @@ class QemuVmError(Exception):
     pass
 
 
+class FileLock:
+    """flock()-based lock on a file, usable as a context manager.
+
+    Serializes access to state shared between qemu_vm runs on one host
+    (parallel forks or async tasks). Waits at most timeout seconds, then
+    raises QemuVmError naming the contended lock.
+    """
+
+    def __init__(self, path, timeout, shared=False):
+        self.path = path
+        self.timeout = timeout
+        self.shared = shared
+        self.fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.fd = open(self.path, 'a+')
+        mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fcntl.flock(self.fd, mode | fcntl.LOCK_NB)
+                return self
+            except (IOError, OSError):
+                if time.time() >= deadline:
+                    self.fd.close()
+                    self.fd = None
+                    raise QemuVmError(
+                        f"Timed out after {self.timeout}s waiting for lock {self.path} "
+                        f"(held by another qemu_vm run on this host)"
+                    )
+                time.sleep(0.2)
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.fd:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.fd.close()
+            self.fd = None
+        return False
+
+
+def disk_usage(path):
+    """Bytes actually allocated on disk for a file or directory tree"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    total = st.st_blocks * 512
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, files in os.walk(path):
+            for entry in dirs + files:
+                try:
+                    total += os.lstat(os.path.join(root, entry)).st_blocks * 512
+                except OSError:
+                    pass
+    return total
+
+
+def last_used(path):
+    """Most recent access or modification time of a file or directory tree"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return 0
+    latest = max(st.st_atime, st.st_mtime)
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            for entry in files:
+                try:
+                    est = os.stat(os.path.join(root, entry))
+                    latest = max(latest, est.st_atime, est.st_mtime)
+                except OSError:
+                    pass
+    return latest
+
+
+def qcow2_backing_file(path):
+    """Return the absolute backing file path from a qcow2 header, or None"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(20)
+            if len(header) < 20 or header[:4] != b'QFI\xfb':
+                return None
+            offset = int.from_bytes(header[8:16], 'big')
+            size = int.from_bytes(header[16:20], 'big')
+            if not offset or not size:
+                return None
+            f.seek(offset)
+            backing = f.read(size).decode('utf-8', errors='replace')
+    except (IOError, OSError):
+        return None
+    if not os.path.isabs(backing):
+        backing = os.path.join(os.path.dirname(path), backing)
+    return os.path.normpath(backing)
+
+
+def atomic_write(path, data):
+    """Write a file via a temporary file and rename, so readers never see partial data"""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
 def normalize_size(value, param_name):
     """Normalize size values by adding 'G' suffix if missing.
 
@@ -414,126 +1174,816 @@ def resolve_max_resources(vcpu, mem):
     return resolved_vcpu, resolved_mem
 
 
-class QemuVm:
-    """Manages QEMU virtual machines running in Docker containers"""
+# Strip ANSI escape sequences (colors, cursor movement) from console output
+ANSI_ESCAPE_RE = re.compile(r'\x1b(\[[0-9;?]*[ -/]*[@-~]|[@-Z\\-_])')
 
-    # GPU vendor IDs
-    NVIDIA_VENDOR = "10de"
-    AMD_VENDOR = "1002"
-    VGA_CLASS = "0300"
 
-    def __init__(self, module):
-        self.module = module
-        self.params = module.params
-        self.check_mode = module.check_mode
+def rotate_console_log(path, keep):
+    """Rotate a console log: path -> path.1 -> ... -> path.<keep>.
 
-        # Resolve "max" values for vcpu and mem
-        self.params['vcpu'], self.params['mem'] = resolve_max_resources(
-            self.params['vcpu'], self.params['mem']
-        )
+    The oldest log beyond keep is discarded. Called before every VM start
+    so each boot begins with an empty console log.
+    """
+    if keep < 1:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    oldest = f"{path}.{keep}"
+    if os.path.exists(oldest):
+        os.remove(oldest)
+    for i in range(keep - 1, 0, -1):
+        src = f"{path}.{i}"
+        if os.path.exists(src):
+            os.rename(src, f"{path}.{i + 1}")
+    if os.path.exists(path):
+        os.rename(path, f"{path}.1")
+
+
+def read_console_tail(path, lines):
+    """Return the last lines of a console log without reading the whole file.
+
+    Falls back to the most recent rotated log (path.1) when the current log
+    holds fewer lines than requested. Returns a list of strings.
+    """
+    def tail(file_path, count):
+        try:
+            with open(file_path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                end = f.tell()
+                block = 8192
+                data = b''
+                # Read backwards until enough newlines are buffered
+                while end > 0 and data.count(b'\n') <= count:
+                    start = max(end - block, 0)
+                    f.seek(start)
+                    data = f.read(end - start) + data
+                    end = start
+        except (IOError, OSError):
+            return []
+        text = ANSI_ESCAPE_RE.sub('', data.decode('utf-8', errors='replace'))
+        result = [line.rstrip('\r') for line in text.splitlines()]
+        return result[-count:] if count > 0 else []
 
-        # Ensure vcpu is an integer
-        self.params['vcpu'] = int(self.params['vcpu'])
+    if lines <= 0:
+        return []
 
-        # Normalize size parameters (auto-append 'G' if bare number)
-        self.params['mem'] = normalize_size(self.params['mem'], 'mem')
-        self.params['image_size'] = normalize_size(self.params['image_size'], 'image_size')
-        if self.params.get('data_disk_size'):
-            self.params['data_disk_size'] = normalize_size(self.params['data_disk_size'], 'data_disk_size')
+    result = tail(path, lines)
+    if len(result) < lines:
+        result = tail(f"{path}.1", lines - len(result)) + result
+    return result
 
-        # Initialize Docker client
-        self.docker = None
-        if HAS_DOCKER:
-            try:
-                self.docker = docker.from_env()
-            except DockerException as e:
-                module.fail_json(msg=f"Failed to connect to Docker: {e}")
 
-        # Set up paths
-        self.name = self.params['name']
-        self.storage_path = self.params['storage_path']
-        self.vm_dir = os.path.join(self.storage_path, 'images', self.name)
-        self.boot_image = os.path.join(self.vm_dir, f"{self.name}.qcow2")
-        self.seed_iso = os.path.join(self.vm_dir, f"seed-{self.name}.iso")
-        self.data_dir = os.path.join(self.storage_path, 'data')
+# Final line written by cloud-init to the console once first boot is done
+CLOUD_INIT_FINISHED_RE = re.compile(r'Cloud-init v\. \S+ finished at')
 
-        # Result tracking
-        self.result = {
-            'changed': False,
-            'name': self.name,
-            'state': 'absent',
-            'gpus_attached': [],
-        }
 
-    def run(self):
-        """Main entry point"""
-        state = self.params['state']
+def file_digest(path):
+    """Return the SHA-256 hex digest of a file.
 
-        if state in ('present', 'started'):
-            return self.ensure_present()
-        elif state == 'stopped':
-            return self.ensure_stopped()
-        elif state == 'absent':
-            return self.ensure_absent()
+    The digest is cached in a <path>.sha256 sidecar together with the file
+    size and mtime, so multi-GB images are hashed only when they change.
+    """
+    st = os.stat(path)
+    sidecar = f"{path}.sha256"
+    try:
+        with open(sidecar, 'r') as f:
+            cached = json.load(f)
+        if cached.get('size') == st.st_size and cached.get('mtime') == st.st_mtime:
+            return cached['sha256']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
 
-    # =========================================================================
-    # State Management
-    # =========================================================================
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    digest = sha.hexdigest()
 
-    def ensure_present(self):
-        """Ensure VM exists and is running"""
-        # Validate tskey is provided
-        if not self.params.get('tskey'):
-            self.module.fail_json(msg="tskey is required when state is present/started")
+    try:
+        atomic_write(sidecar, json.dumps({'size': st.st_size, 'mtime': st.st_mtime, 'sha256': digest}))
+    except (IOError, OSError):
+        pass
+    return digest
+
+
+# How long a resolved tailscale_version=latest is reused before asking again
+TAILSCALE_LATEST_TTL = 24 * 3600
+
+# Tailscale's apt repository. The same key signs the packages of every
+# distribution, and the pool holds the same .deb for all of them.
+TAILSCALE_APT_URL = 'https://pkgs.tailscale.com/stable'
+TAILSCALE_KEYRING = 'tailscale-archive-keyring.gpg'
+
+
+def tailscale_deb(version):
+    """Return the file name of a Tailscale release's .deb in the apt pool"""
+    return f"tailscale_{version}_amd64.deb"
+
+
+# Scripts shipped on the provisioning disk; each exits non-zero so the
+# cloud-init runcmd can fall back to installing from the internet
+PROVISION_TAILSCALE_SCRIPT = """#!/bin/sh
+# Install Tailscale from the cached .deb on the sbnb provisioning disk and
+# add its apt repository, as install.sh does, so the guest gets updates
+set -e
+D=$(dirname "$0")
+. /etc/os-release
+install -m 0644 "$D/tailscale/%(keyring)s" /usr/share/keyrings/%(keyring)s
+echo "deb [signed-by=/usr/share/keyrings/%(keyring)s] %(url)s/$ID $VERSION_CODENAME main" \\
+    > /etc/apt/sources.list.d/tailscale.list
+apt-get install -y --no-download "$D"/tailscale/tailscale_*.deb
+systemctl enable --now tailscaled
+""" % {'keyring': TAILSCALE_KEYRING, 'url': TAILSCALE_APT_URL}
+
+PROVISION_PACKAGES_SCRIPT = """#!/bin/sh
+# Install cached first-boot packages from the sbnb provisioning disk
+set -e
+D=$(dirname "$0")
+ls "$D"/debs/*.deb >/dev/null 2>&1
+apt-get install -y --no-download "$D"/debs/*.deb
+"""
 
-        existing = self.get_container()
 
-        if existing:
-            if existing.status == 'running':
-                self.result['state'] = 'running'
-                self.result['container_id'] = existing.id
-                self.result['container_short_id'] = existing.short_id
-                self.result['image_path'] = self.boot_image
-                return self.result
-            else:
-                # Container exists but not running - remove it and recreate
-                if not self.check_mode:
-                    existing.remove(force=True)
-                # Fall through to create new container
+# A migrated VM's container runs its normal command; the -incoming options
+# come from the container environment and are only used on the first start,
+# so a later 'docker start' (VM supervisor, host reboot) boots the VM normally.
+# The marker lives in the container's own filesystem.
+INCOMING_MARKER = '/.sbnb-incoming-done'
 
-        # VM doesn't exist (or was just removed), create it
-        self.result['changed'] = True
 
-        if self.check_mode:
-            self.result['state'] = 'would_create'
-            return self.result
+def with_incoming_guard(cmd):
+    """Wrap a QEMU command so $SBNB_INCOMING is appended on the first start only"""
+    return (f"[ -e {INCOMING_MARKER} ] && SBNB_INCOMING=; touch {INCOMING_MARKER}; "
+            f"{cmd} $SBNB_INCOMING")
 
-        # Prepare VM assets
-        self.prepare_vm_directory()
-        self.download_image()
-        self.prepare_boot_image()
-        self.create_cloud_init()
 
-        # Handle GPU passthrough
-        gpus = self.setup_gpu_passthrough()
-        self.result['gpus_attached'] = gpus
+def strip_incoming_guard(cmd):
+    """Return the QEMU command inside with_incoming_guard() (other commands unchanged)"""
+    match = re.match(
+        re.escape(f"[ -e {INCOMING_MARKER} ] && SBNB_INCOMING=; touch {INCOMING_MARKER}; ")
+        + r'(.*) \$SBNB_INCOMING$', cmd, re.S,
+    )
+    return match.group(1) if match else cmd
 
-        # Handle PCIe passthrough
-        self.setup_pcie_passthrough()
 
-        # Prepare optional data disk
-        data_disk_path = self.prepare_data_disk()
+def docker_log_size(size):
+    """Convert a size string (e.g. '10M') to Docker log-opt format ('10m')."""
+    mb = parse_mem_mb(size)
+    if mb is None or mb < 1:
+        mb = 1
+    return f"{mb}m"
 
-        # Build and execute QEMU command
-        qemu_cmd = self.build_qemu_command(gpus, data_disk_path)
-        self.result['qemu_command'] = qemu_cmd
 
-        # Start container
+class QmpClient:
+    """Minimal QMP client on a UNIX socket, usable as a context manager.
+
+    Negotiates capabilities on connect, runs commands with execute() and
+    keeps asynchronous events that arrive in between for wait_event().
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.sock = None
+        self.buffer = b''
+        self.events = []
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def connect(self):
+        # QEMU creates the socket shortly after the container starts
+        deadline = time.time() + self.timeout
+        while True:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(self.timeout)
+            try:
+                self.sock.connect(self.path)
+                break
+            except (IOError, OSError) as e:
+                self.sock.close()
+                self.sock = None
+                if time.time() >= deadline:
+                    raise QemuVmError(f"Cannot connect to QMP socket {self.path}: {e}")
+                time.sleep(0.2)
+
+        greeting = self.read_message()
+        if 'QMP' not in greeting:
+            raise QemuVmError(f"Unexpected QMP greeting on {self.path}: {greeting}")
+        self.execute('qmp_capabilities')
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def read_message(self):
+        while True:
+            while b'\n' not in self.buffer:
+                try:
+                    chunk = self.sock.recv(65536)
+                except socket.timeout:
+                    raise QemuVmError(f"Timed out waiting for QMP on {self.path}")
+                if not chunk:
+                    raise QemuVmError(f"QMP connection closed: {self.path}")
+                self.buffer += chunk
+            line, self.buffer = self.buffer.split(b'\n', 1)
+            if line.strip():
+                return json.loads(line)
+
+    def execute(self, command, arguments=None):
+        """Run a QMP command and return its 'return' value"""
+        message = {'execute': command}
+        if arguments:
+            message['arguments'] = arguments
+        self.sock.sendall(json.dumps(message).encode() + b'\n')
+        while True:
+            reply = self.read_message()
+            if 'event' in reply:
+                self.events.append(reply)
+                continue
+            if 'error' in reply:
+                raise QemuVmError(f"QMP {command} failed: {reply['error'].get('desc')}")
+            return reply.get('return')
+
+    def wait_event(self, names, timeout):
+        """Return the first event named in names, waiting at most timeout seconds"""
+        names = {names} if isinstance(names, str) else set(names)
+        deadline = time.time() + timeout
+        while True:
+            for i, event in enumerate(self.events):
+                if event.get('event') in names:
+                    return self.events.pop(i)
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise QemuVmError(f"Timed out waiting for QMP event {'/'.join(sorted(names))}")
+            self.sock.settimeout(remaining)
+            try:
+                self.events.append(self.read_message())
+            finally:
+                self.sock.settimeout(self.timeout)
+
+
+def parse_cpu_list(text):
+    """Parse a kernel CPU list ('0-3,8,10-11') into a list of ints"""
+    cpus = []
+    for part in str(text).strip().split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            cpus.extend(range(int(start), int(end) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus):
+    """Format CPUs as a kernel CPU list ('0-3,8'), the inverse of parse_cpu_list"""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def read_cpu_topology(sysfs_root='/sys'):
+    """Return the host's physical cores from sysfs.
+
+    Each core is {'cpus': [...], 'node': n} with its online SMT siblings,
+    sorted by lowest CPU number. sysfs_root lets the topology be read from
+    a captured copy of /sys.
+    """
+    cpu_dir = os.path.join(sysfs_root, 'devices', 'system', 'cpu')
+    with open(os.path.join(cpu_dir, 'online')) as f:
+        online = set(parse_cpu_list(f.read()))
+
+    cores = {}
+    for cpu in sorted(online):
+        base = os.path.join(cpu_dir, f"cpu{cpu}")
+        try:
+            with open(os.path.join(base, 'topology', 'thread_siblings_list')) as f:
+                siblings = tuple(c for c in parse_cpu_list(f.read()) if c in online)
+        except (IOError, OSError, ValueError):
+            siblings = (cpu,)
+        node = 0
+        for entry in os.listdir(base):
+            if entry.startswith('node') and entry[4:].isdigit():
+                node = int(entry[4:])
+        cores.setdefault(siblings or (cpu,), node)
+
+    return sorted(
+        ({'cpus': list(cpus), 'node': node} for cpus, node in cores.items()),
+        key=lambda core: core['cpus'][0],
+    )
+
+
+def pci_numa_node(pci_address, sysfs_root='/sys'):
+    """Return the NUMA node of a PCI device, or None if unknown"""
+    address = pci_address if pci_address.count(':') == 2 else f"0000:{pci_address}"
+    try:
+        with open(os.path.join(sysfs_root, 'bus', 'pci', 'devices', address, 'numa_node')) as f:
+            node = int(f.read().strip())
+    except (IOError, OSError, ValueError):
+        return None
+    return node if node >= 0 else None
+
+
+def housekeeping_cpus(cores, reserved):
+    """Return the host's reserved CPUs: whole cores from CPU 0 covering reserved CPUs.
+
+    They are never given to a pinned VM; pinned VMs run their emulator and
+    I/O threads there instead of on their vCPU cores.
+    """
+    cpus = []
+    for core in cores:
+        if len(cpus) >= reserved:
+            break
+        cpus.extend(core['cpus'])
+    return cpus
+
+
+def allocate_host_cpus(cores, allocated, count, reserved=2, preferred_nodes=()):
+    """Pick whole free cores for a VM with count vCPUs.
+
+    Args:
+        cores: Host cores as returned by read_cpu_topology()
+        allocated: Host CPUs already held by other VMs
+        count: Number of vCPUs to place
+        reserved: Logical CPUs kept for the host, as whole cores from CPU 0
+        preferred_nodes: NUMA nodes to try first (e.g. where GPUs sit)
+
+    Returns the host CPUs ordered core by core, so consecutive vCPUs land on
+    SMT siblings. The list is longer than count when a core is only partly
+    used; the spare sibling stays with the VM instead of a neighbour.
+    """
+    allocated = set(allocated) | set(housekeeping_cpus(cores, reserved))
+    free = [core for core in cores if not allocated.intersection(core['cpus'])]
+
+    by_node = {}
+    for core in free:
+        by_node.setdefault(core['node'], []).append(core)
+    free_count = {node: sum(len(c['cpus']) for c in node_cores) for node, node_cores in by_node.items()}
+
+    # Preferred nodes first, then the emptiest; a single node that fits wins
+    order = [n for n in preferred_nodes if n in by_node]
+    order += sorted((n for n in by_node if n not in order), key=lambda n: (-free_count[n], n))
+    fitting = [n for n in order if free_count[n] >= count]
+    if fitting:
+        order = [fitting[0]]
+
+    cpus = []
+    for node in order:
+        for core in by_node[node]:
+            if len(cpus) >= count:
+                break
+            cpus.extend(core['cpus'])
+
+    if len(cpus) < count:
+        raise QemuVmError(
+            f"Not enough free host cores for cpu_pinning: need {count} CPUs, "
+            f"{sum(free_count.values())} free after {reserved} reserved for the host"
+        )
+    return cpus
+
+
+def block_device_for_path(path, sysfs_root='/sys'):
+    """Return the /dev node of the whole block device holding path.
+
+    cgroup v2 io.max only accepts whole disks and device-mapper devices,
+    so a partition resolves to its parent disk.
+    """
+    st = os.stat(path)
+    dev_dir = os.path.realpath(
+        os.path.join(sysfs_root, 'dev', 'block', f"{os.major(st.st_dev)}:{os.minor(st.st_dev)}")
+    )
+    if os.path.exists(os.path.join(dev_dir, 'partition')):
+        dev_dir = os.path.dirname(dev_dir)
+    return os.path.join('/dev', os.path.basename(dev_dir))
+
+
+def normalize_pci_address(address):
+    """Return a PCI address with its domain ('01:00.0' -> '0000:01:00.0')"""
+    address = str(address).strip().lower()
+    return address if address.count(':') == 2 else f"0000:{address}"
+
+
+GPU_VENDORS = ('0x10de', '0x1002')  # NVIDIA, AMD
+
+
+def discover_gpus(sysfs_root='/sys', names=None):
+    """Return the host's NVIDIA/AMD GPUs from sysfs.
+
+    Each GPU is {'address', 'id' (vendor:device), 'name', 'node', 'switch',
+    'group', 'devices'}, where devices are the endpoints of its IOMMU group
+    (bridges excluded) that must be passed through together. switch is the
+    sysfs path of the upstream port the GPU hangs off. names maps PCI
+    addresses to lspci descriptions. sysfs_root lets discovery run against
+    a captured copy of /sys.
+    """
+    pci_dir = os.path.join(sysfs_root, 'bus', 'pci', 'devices')
+
+    def read(address, attr):
+        try:
+            with open(os.path.join(pci_dir, address, attr)) as f:
+                return f.read().strip()
+        except (IOError, OSError):
+            return ''
+
+    gpus = []
+    for address in sorted(os.listdir(pci_dir)) if os.path.isdir(pci_dir) else []:
+        vendor = read(address, 'vendor')
+        if vendor not in GPU_VENDORS or not read(address, 'class').startswith('0x03'):
+            continue
+
+        group_link = os.path.join(pci_dir, address, 'iommu_group')
+        group = os.path.basename(os.path.realpath(group_link)) if os.path.exists(group_link) else None
+        devices = [address]
+        if group is not None:
+            group_devices = os.path.join(os.path.realpath(group_link), 'devices')
+            devices = sorted(
+                d for d in os.listdir(group_devices)
+                if not read(d, 'class').startswith('0x0604')  # PCI bridges stay with the host
+            )
+
+        node = read(address, 'numa_node')
+        gpus.append({
+            'address': address,
+            'id': f"{vendor[2:]}:{read(address, 'device')[2:]}",
+            'name': (names or {}).get(address, ''),
+            'node': int(node) if node.lstrip('-').isdigit() and int(node) >= 0 else None,
+            'switch': os.path.dirname(os.path.dirname(os.path.realpath(os.path.join(pci_dir, address)))),
+            'group': group,
+            'devices': devices,
+        })
+    return gpus
+
+
+def allocate_gpus(gpus, allocated, request, model=None):
+    """Pick GPUs for a VM.
+
+    Args:
+        gpus: Host GPUs as returned by discover_gpus()
+        allocated: PCI addresses already used by other VMs
+        request: 'auto' (every free GPU), a GPU count, or a list of addresses
+        model: Optional filter on the lspci name or vendor:device ID
+
+    GPUs sharing an IOMMU group are allocated together. For a count, the
+    smallest PCIe switch, then NUMA node, that can hold all of them wins,
+    which keeps peer-to-peer traffic local and larger blocks free.
+    Returns the selected GPUs; raises QemuVmError if the request cannot be met.
+    """
+    allocated = {normalize_pci_address(a) for a in allocated}
+    if model:
+        gpus = [g for g in gpus if model.lower() in g['name'].lower() or model.lower() in g['id']]
+
+    units = {}
+    for gpu in gpus:
+        units.setdefault(gpu['group'] or gpu['address'], []).append(gpu)
+    free = [u for u in units.values() if not allocated.intersection(u[0]['devices'])]
+
+    if request == 'auto':
+        return [g for unit in free for g in unit]
+
+    if isinstance(request, list):
+        by_address = {g['address']: g for g in gpus}
+        selected = []
+        for address in (normalize_pci_address(a) for a in request):
+            gpu = by_address.get(address, {'address': address, 'devices': [address]})
+            if allocated.intersection(gpu['devices']):
+                raise QemuVmError(f"GPU {address} is already attached to another VM")
+            if gpu not in selected:
+                selected.append(gpu)
+        return selected
+
+    count = int(request)
+
+    def pick(candidates):
+        chosen = []
+        for unit in sorted(candidates, key=lambda u: (len(u), u[0]['address'])):
+            if sum(len(u) for u in chosen) >= count:
+                break
+            chosen.append(unit)
+        return [g for unit in chosen for g in unit] if sum(len(u) for u in chosen) >= count else None
+
+    for key in ('switch', 'node'):
+        domains = {}
+        for unit in free:
+            domains.setdefault(unit[0].get(key), []).append(unit)
+        fitting = sorted(
+            (sum(len(u) for u in units_), str(domain)) for domain, units_ in domains.items()
+            if domain is not None and sum(len(u) for u in units_) >= count
+        )
+        if fitting:
+            best = next(d for d in domains if str(d) == fitting[0][1])
+            return pick(domains[best])
+
+    selected = pick(free)
+    if selected is None:
+        what = f" matching '{model}'" if model else ''
+        raise QemuVmError(
+            f"Not enough free GPUs{what}: need {count}, {sum(len(u) for u in free)} free"
+        )
+    return selected
+
+
+def load_ledger(path):
+    """Read a host allocation ledger ({vm name: {...}}) from storage_path/state"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def run_step_graph(steps, max_workers=4):
+    """Run {name: (dependencies, fn)} steps on a thread pool.
+
+    A step starts as soon as all of its dependencies have succeeded, so
+    independent steps overlap and the total time is that of the longest
+    chain. Steps whose dependencies failed are not run.
+
+    Returns (results, timings, errors): step return values, seconds spent
+    in each step that ran, and {name: message} for failed or skipped steps.
+    """
+    for name, (deps, _fn) in steps.items():
+        unknown = [d for d in deps if d not in steps]
+        if unknown:
+            raise ValueError(f"step {name} depends on unknown steps: {', '.join(unknown)}")
+
+    def timed(fn):
+        start = time.time()
+        try:
+            return fn(), time.time() - start
+        except Exception as e:
+            e.step_seconds = time.time() - start
+            raise
+
+    results, timings, errors = {}, {}, {}
+    pending = dict(steps)
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            for name, (deps, fn) in list(pending.items()):
+                failed = [d for d in deps if d in errors]
+                if failed:
+                    errors[name] = f"skipped, {', '.join(failed)} failed"
+                    del pending[name]
+                elif all(d in results for d in deps):
+                    running[pool.submit(timed, fn)] = name
+                    del pending[name]
+            if not running:
+                # Only reachable with a dependency cycle
+                for name in pending:
+                    errors[name] = 'skipped, dependency cycle'
+                break
+
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name], timings[name] = future.result()
+                except Exception as e:
+                    timings[name] = getattr(e, 'step_seconds', 0.0)
+                    errors[name] = str(e) or type(e).__name__
+    return results, timings, errors
+
+
+class QemuVm:
+    """Manages QEMU virtual machines running in Docker containers"""
+
+    def __init__(self, module):
+        self.module = module
+        self.params = module.params
+        self.check_mode = module.check_mode
+
+        # What was asked for, before "max" and capping; recorded in vm-config.json
+        # so a running VM is only resized when this changes
+        self.requested = {
+            'vcpu': str(self.params['vcpu']).lower(),
+            'mem': normalize_size(self.params['mem'], 'mem'),
+        }
+
+        # Resolve "max" values for vcpu and mem
+        self.params['vcpu'], self.params['mem'] = resolve_max_resources(
+            self.params['vcpu'], self.params['mem']
+        )
+
+        # Ensure vcpu is an integer
+        self.params['vcpu'] = int(self.params['vcpu'])
+
+        # Normalize size parameters (auto-append 'G' if bare number)
+        self.params['mem'] = normalize_size(self.params['mem'], 'mem')
+        self.params['image_size'] = normalize_size(self.params['image_size'], 'image_size')
+        if self.params.get('data_disk_size'):
+            self.params['data_disk_size'] = normalize_size(self.params['data_disk_size'], 'data_disk_size')
+
+        # Initialize Docker client
+        self.docker = None
+        if HAS_DOCKER:
+            try:
+                self.docker = docker.from_env()
+            except DockerException as e:
+                module.fail_json(msg=f"Failed to connect to Docker: {e}")
+
+        # Set up paths (state=gc runs without a VM name)
+        self.name = self.params['name']
+        self.storage_path = self.params['storage_path']
+        self.vm_dir = self.boot_image = self.seed_iso = self.console_log = None
+        if self.name:
+            self.vm_dir = os.path.join(self.storage_path, 'images', self.name)
+            self.boot_image = os.path.join(self.vm_dir, f"{self.name}.qcow2")
+            if self.params['disk_backend'] == 'lvm-thin':
+                self.boot_image = self.lv_path(f"sbnb-vm-{self.name}")
+            self.seed_iso = os.path.join(self.vm_dir, f"seed-{self.name}.iso")
+            self.console_log = os.path.join(self.vm_dir, 'console.log')
+        self.images_dir = os.path.join(self.storage_path, 'images')
+        self.data_dir = os.path.join(self.storage_path, 'data')
+        self.kernels_dir = os.path.join(self.storage_path, 'images', 'kernels')
+        self.tuned_dir = os.path.join(self.storage_path, 'images', 'tuned')
+        self.cache_dir = os.path.join(self.storage_path, 'cache')
+        self.locks_dir = os.path.join(self.storage_path, 'locks')
+        self.state_dir = os.path.join(self.storage_path, 'state')
+        self.cpu_ledger = os.path.join(self.state_dir, 'cpu-ledger.json')
+        self.gpu_ledger = os.path.join(self.state_dir, 'gpu-ledger.json')
+        self.qmp_socket = os.path.join(self.vm_dir, 'qmp.sock') if self.vm_dir else None
+        # Second QMP monitor for the host VM supervisor (one client per socket)
+        self.qmp_event_socket = os.path.join(self.vm_dir, 'qmp-events.sock') if self.vm_dir else None
+        self.vm_config = os.path.join(self.vm_dir, 'vm-config.json') if self.vm_dir else None
+        self.backup_path = self.params.get('backup_path') or (
+            os.path.join(self.storage_path, 'backups', self.name) if self.name else None
+        )
+        self.pinned_cpus = []
+        self.emulator_cpus = []
+        self.provision_iso = None
+        self.provision_has_tailscale = False
+        self.provision_has_packages = False
+        self.kernel_path = None
+        self.initrd_path = None
+        # Shared locks on the cached files a new VM boots from, held until
+        # its container runs (gc then sees them in the QEMU command)
+        self.held_locks = contextlib.ExitStack()
+
+        # Result tracking
+        self.result = {
+            'changed': False,
+            'name': self.name,
+            'state': 'absent',
+            'gpus_attached': [],
+        }
+
+    def run(self):
+        """Main entry point"""
+        state = self.params['state']
+
+        if state == 'gc':
+            return self.ensure_gc()
+
+        # Only one run at a time may change a given VM (check mode only reads)
+        vm_lock = contextlib.nullcontext() if self.check_mode else self.lock(f"vm-{self.name}")
+        with vm_lock, self.held_locks:
+            if state in ('present', 'started'):
+                return self.ensure_present()
+            elif state == 'stopped':
+                return self.ensure_stopped()
+            elif state == 'absent':
+                return self.ensure_absent()
+            elif state == 'migrated':
+                return self.ensure_migrated()
+            elif state == 'backed_up':
+                return self.ensure_backed_up()
+            elif state == 'restored':
+                return self.ensure_restored()
+
+    def lock(self, name, shared=False, timeout=None):
+        """Return a FileLock for shared host state under storage_path/locks"""
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        return FileLock(
+            os.path.join(self.locks_dir, f"{safe_name}.lock"),
+            self.params['lock_timeout'] if timeout is None else timeout,
+            shared=shared,
+        )
+
+    def hold_shared(self, name, path, create):
+        """Make path with create(), then keep a shared lock on it until the VM runs.
+
+        create() takes the exclusive lock itself. gc may remove path after
+        that lock is released and before the shared one is taken; path is
+        then made again.
+        """
+        while True:
+            create()
+            lock = self.held_locks.enter_context(self.lock(name, shared=True))
+            if os.path.exists(path):
+                return
+            lock.__exit__(None, None, None)
+
+    # =========================================================================
+    # State Management
+    # =========================================================================
+
+    def ensure_present(self):
+        """Ensure VM exists and is running"""
+        # Validate tskey is provided
+        if not self.params.get('tskey'):
+            self.module.fail_json(msg="tskey is required when state is present/started")
+
+        self.validate_boot_mode()
+        self.validate_shared_dirs()
+        if self.params.get('cpu_pinning') and self.params.get('disable_kvm'):
+            self.module.fail_json(msg="cpu_pinning requires KVM (disable_kvm must be false)")
+        if self.params['disk_backend'] == 'lvm-thin' and self.params['thin_pool'] not in self.list_lvs():
+            self.module.fail_json(
+                msg=f"Thin pool {self.params['vg_name']}/{self.params['thin_pool']} not found "
+                    f"(create it with the storage role's sbnb_thin_pool_size)"
+            )
+        if self.params.get('max_mem'):
+            self.params['max_mem'] = normalize_size(self.params['max_mem'], 'max_mem')
+            max_mb = parse_mem_mb(self.params['max_mem'])
+            if not max_mb or max_mb <= parse_mem_mb(self.params['mem']):
+                self.module.fail_json(msg=f"max_mem ({self.params['max_mem']}) must be larger than mem ({self.params['mem']})")
+
+        existing = self.get_container()
+
+        if existing:
+            if existing.status == 'running':
+                self.result['state'] = 'running'
+                self.result['container_id'] = existing.id
+                self.result['container_short_id'] = existing.short_id
+                self.result['image_path'] = self.boot_image
+                resources = self.container_resources(existing)
+                if resources:
+                    self.result['resources'] = resources
+                entry = load_ledger(self.cpu_ledger).get(self.name)
+                if entry:
+                    self.result['cpu_pinning'] = {'cpus': format_cpu_list(entry['cpus'])}
+                if not self.apply_live_resize(existing, pinned=bool(entry)):
+                    return self.result
+                # The new size cannot be hotplugged: restart the VM with it
+                if not self.check_mode:
+                    self.shutdown_container(existing)
+            else:
+                # Container exists but not running - keep its last console
+                # output for the caller, then remove it and recreate
+                self.result['console_tail'] = self.get_console_tail()
+                if not self.check_mode:
+                    existing.remove(force=True)
+                # Fall through to create new container
+
+        # VM doesn't exist (or was just removed), create it
+        self.result['changed'] = True
+
+        if self.check_mode:
+            self.result['state'] = 'would_create'
+            return self.result
+
+        # Prepare VM assets, overlapping independent steps
+        assets = self.prepare_assets()
+        gpus = assets['gpu_passthrough']
+        self.result['gpus_attached'] = gpus
+        data_disk_path = assets['data_disk']
+
+        # Dedicated host cores (before the command: -smp follows the cores)
+        self.allocate_cpu_pinning(gpus)
+
+        # Build and execute QEMU command
+        qemu_cmd = self.build_qemu_command(gpus, data_disk_path)
+        self.result['qemu_command'] = qemu_cmd
+        self.save_vm_config(qemu_cmd)
+
+        # Start container
+        start_time = time.time()
         container = self.start_container(qemu_cmd)
+        self.held_locks.close()
+        resources = self.container_resources(container)
+        if resources:
+            self.result['resources'] = resources
         self.result['container_id'] = container.id
         self.result['container_short_id'] = container.short_id
         self.result['state'] = 'running'
         self.result['image_path'] = self.boot_image
+        self.result['console_log'] = self.console_log
+
+        # Catch VMs that die right away (bad image, missing device, QEMU error)
+        self.check_early_exit(container)
+
+        if self.pinned_cpus:
+            self.pin_qemu_threads(container)
+
+        if self.params.get('dirty_bitmaps'):
+            self.add_dirty_bitmaps()
+
+        if self.params.get('wait_for_boot'):
+            self.wait_for_cloud_init(container, start_time)
 
         return self.result
 
@@ -555,6 +2005,7 @@ class QemuVm:
 
         if not self.check_mode:
             existing.stop(timeout=30)
+            self.release_host_resources()
 
         self.result['state'] = 'stopped'
         self.result['container_id'] = existing.id
@@ -573,14 +2024,633 @@ class QemuVm:
 
         if not self.check_mode:
             existing.remove(force=True)
+            self.release_host_resources()
 
             # Clean up VM directory if persist_boot_image is disabled
             if not self.params.get('persist_boot_image') and os.path.exists(self.vm_dir):
                 shutil.rmtree(self.vm_dir)
+            if not self.params.get('persist_boot_image') and self.params['disk_backend'] == 'lvm-thin' \
+                    and os.path.basename(self.boot_image) in self.list_lvs():
+                self.run_lvm(['lvremove', '--yes', f"{self.params['vg_name']}/{os.path.basename(self.boot_image)}"])
 
         self.result['state'] = 'absent'
         return self.result
 
+    def ensure_migrated(self):
+        """Live-migrate the running VM to the destination host.
+
+        The incoming QEMU runs the exact command of the source container
+        (checked against the fingerprint saved at start), with -incoming and
+        the migration capabilities given as -global options, so only the
+        source QMP socket has to be reachable from here. Those options are
+        passed for the first start only (see with_incoming_guard): afterwards
+        the destination container is an ordinary VM container.
+        """
+        existing = self.get_container()
+        if not existing or existing.status != 'running':
+            self.module.fail_json(msg=f"VM {self.name} is not running, nothing to migrate")
+
+        qemu_cmd = strip_incoming_guard(existing.attrs['Config']['Cmd'][-1])
+        fingerprint = hashlib.sha256(qemu_cmd.encode()).hexdigest()[:16]
+        self.validate_migration(qemu_cmd, fingerprint)
+
+        destination = self.params['destination']
+        self.result['changed'] = True
+        if self.check_mode:
+            self.result['state'] = 'would_migrate'
+            return self.result
+
+        dest_client = self.destination_docker()
+        self.check_destination_disks(dest_client, existing, qemu_cmd)
+
+        incoming_name = f"{self.name}-migrate-in"
+        try:
+            dest_client.containers.get(incoming_name).remove(force=True)
+        except DockerNotFound:
+            pass
+
+        # Source resource limits carry over; io_max names a host-local device
+        host_config = existing.attrs.get('HostConfig') or {}
+        limits = {}
+        for key, attr in (('cpu_shares', 'CpuShares'), ('nano_cpus', 'NanoCpus'),
+                          ('mem_limit', 'Memory'), ('memswap_limit', 'MemorySwap'),
+                          ('blkio_weight', 'BlkioWeight')):
+            if host_config.get(attr):
+                limits[key] = host_config[attr]
+
+        dest_cmd = self.build_incoming_command(qemu_cmd, self.hotplug_options(existing))
+        incoming = self.start_container(
+            with_incoming_guard(dest_cmd),
+            client=dest_client,
+            name=incoming_name,
+            image=existing.attrs['Config']['Image'],
+            limits=limits,
+            environment={'SBNB_INCOMING': self.incoming_options()},
+        )
+
+        try:
+            stats = self.run_migration(existing, incoming)
+        except QemuVmError as e:
+            incoming.remove(force=True)
+            self.module.fail_json(msg=f"Migration to {destination} failed: {e}", **self.result)
+
+        # Source QEMU is paused in 'postmigrate'; the destination owns the VM now
+        existing.remove(force=True)
+        self.release_host_resources()
+        incoming.rename(self.name)
+        try:
+            dest_host = dest_client.info().get('Name')
+        except DockerException:
+            dest_host = None
+        # The migrate run's vcpu/mem are defaults, not the VM's spec
+        self.save_vm_config(dest_cmd, host=dest_host or destination,
+                            requested=self.load_vm_config().get('requested') or {})
+
+        stats.update({'destination': destination, 'container': self.name, 'fingerprint': fingerprint})
+        self.result['migration'] = stats
+        self.result['state'] = 'migrated'
+        self.result['container_id'] = incoming.id
+        self.result['container_short_id'] = incoming.short_id
+        return self.result
+
+    def load_vm_config(self):
+        """Return the saved VM config, {} when there is none"""
+        try:
+            with open(self.vm_config) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_vm_config(self, qemu_cmd, host=None, requested=None):
+        """Record the QEMU command and its fingerprint in the VM directory"""
+        config = {
+            'qemu_command': qemu_cmd,
+            'fingerprint': hashlib.sha256(qemu_cmd.encode()).hexdigest()[:16],
+            'saved_at': int(time.time()),
+            # vcpu/mem as requested, before "max" and capping (see apply_live_resize)
+            'requested': self.requested if requested is None else requested,
+            # Dedicated cores (empty: the VM shares the cores no pinned VM holds)
+            'pinned_cpus': self.pinned_cpus,
+            # Owner marker: gc on other hosts sharing storage_path leaves this VM alone
+            'host': host or socket.gethostname(),
+        }
+        atomic_write(self.vm_config, json.dumps(config, indent=2))
+
+    def validate_migration(self, qemu_cmd, fingerprint):
+        """Refuse VMs whose state cannot be moved and commands that drifted"""
+        if 'vfio-pci' in qemu_cmd:
+            self.module.fail_json(msg="VMs with GPU/PCIe passthrough (vfio) cannot be live-migrated")
+        if 'vhost-user-fs-pci' in qemu_cmd:
+            self.module.fail_json(msg="VMs with shared_dirs (virtiofs) cannot be live-migrated")
+        if 'sev-snp-guest' in qemu_cmd:
+            self.module.fail_json(msg="Confidential computing VMs cannot be live-migrated")
+        if 'file=/dev/' in qemu_cmd:
+            self.module.fail_json(msg="VMs on lvm-thin disks cannot be live-migrated (the disks are local block devices)")
+        if '-qmp unix:' not in qemu_cmd:
+            self.module.fail_json(msg="VM was started without a QMP socket; restart it once before migrating")
+
+        saved = self.load_vm_config().get('fingerprint')
+        if saved and saved != fingerprint:
+            self.module.fail_json(
+                msg=f"Running container command (fingerprint {fingerprint}) differs from the saved "
+                    f"VM config ({saved}) in {self.vm_config}"
+            )
+
+    def destination_docker(self):
+        """Return a Docker client for the destination host"""
+        url = self.params.get('destination_docker_host') or f"ssh://root@{self.params['destination']}"
+        try:
+            if url.startswith('ssh://'):
+                return docker.DockerClient(base_url=url, use_ssh_client=True)
+            return docker.DockerClient(base_url=url)
+        except DockerException as e:
+            self.module.fail_json(msg=f"Failed to connect to Docker on {url}: {e}")
+
+    def check_destination_disks(self, dest_client, source, qemu_cmd):
+        """Fail unless every disk and image file of the VM exists on the destination"""
+        path_re = re.compile(re.escape(self.storage_path.rstrip('/')) + r'/[^\s,\'";]+')
+        files = sorted({p for p in path_re.findall(qemu_cmd) if os.path.isfile(p) and not p.endswith('.log')})
+        if not files:
+            return
+        check = (
+            f"rc=0; for f in {' '.join(shlex.quote(p) for p in files)}; do "
+            f'test -f "$f" || {{ echo "$f" >&2; rc=1; }}; done; exit $rc'
+        )
+        try:
+            dest_client.containers.run(
+                image=source.attrs['Config']['Image'],
+                command=['sh', '-c', check],
+                volumes={self.storage_path: {'bind': self.storage_path, 'mode': 'ro'}},
+                remove=True,
+            )
+        except DockerException as e:
+            stderr = getattr(e, 'stderr', None)
+            missing = ', '.join(stderr.decode(errors='replace').split()) if stderr else str(e)
+            self.module.fail_json(
+                msg=f"VM disks are not available on {self.params['destination']} at the same paths "
+                    f"(shared or pre-synced storage is required): {missing}"
+            )
+
+    def hotplug_options(self, container):
+        """Return -device options for hotplugged vCPUs and the virtio-mem size.
+
+        Both sides of a migration need the same devices, so the incoming
+        command starts with whatever was hotplugged into the source.
+        """
+        devices = []
+        with QmpClient(self.container_qmp_socket(container)) as qmp:
+            for slot in qmp.execute('query-hotpluggable-cpus'):
+                path = slot.get('qom-path', '')
+                if path.startswith('/machine/peripheral/'):
+                    props = ','.join(f"{k}={v}" for k, v in sorted(slot['props'].items()))
+                    devices.append(f"-device {slot['type']},id={path.rsplit('/', 1)[1]},{props}")
+            requested = None
+            if 'virtio-mem-pci' in container.attrs['Config']['Cmd'][-1]:
+                requested = qmp.execute('qom-get', {
+                    'path': f"/machine/peripheral/{self.VMEM_DEVICE}", 'property': 'requested-size',
+                })
+        return devices, requested
+
+    def build_incoming_command(self, qemu_cmd, hotplug=None):
+        """Return the source command for the destination QEMU.
+
+        Swaps the QMP socket names (both QEMUs may share a VM directory) and
+        carries over hotplugged vCPUs and memory (see hotplug_options). The
+        -incoming options are kept apart (incoming_options), so this is also
+        the command the VM restarts with on the destination.
+        """
+        match = re.search(r'-qmp unix:([^,\s]+)', qemu_cmd)
+        source_sock = match.group(1)
+        name = 'qmp.sock' if os.path.basename(source_sock) != 'qmp.sock' else 'qmp-migrated.sock'
+        cmd = qemu_cmd.replace(f"unix:{source_sock}", f"unix:{os.path.join(self.vm_dir, name)}")
+        events = re.search(r'-qmp unix:(\S+/qmp-events[^,\s]*)', cmd)
+        if events:
+            name = 'qmp-events.sock' if os.path.basename(events.group(1)) != 'qmp-events.sock' \
+                else 'qmp-events-migrated.sock'
+            cmd = cmd.replace(f"unix:{events.group(1)}", f"unix:{os.path.join(self.vm_dir, name)}")
+        # A VM migrated by an older qemu_vm still carries -incoming in its
+        # command; any VM may carry hotplug options from a previous migration
+        cmd = re.sub(r' -incoming \S+| -global migration\.\S+| -device \S+,id=vcpu-\S+', '', cmd)
+        if hotplug:
+            devices, requested = hotplug
+            if requested is not None:
+                cmd = re.sub(r'requested-size=\d+', f'requested-size={requested}', cmd)
+            if devices:
+                cmd = f"{cmd} {' '.join(devices)}"
+        return cmd
+
+    def incoming_options(self):
+        """Return -incoming and the migration capabilities for the destination QEMU"""
+        opts = [f"-incoming tcp:0.0.0.0:{self.params['migration_port']}"]
+        if self.params['migration_postcopy']:
+            opts.append('-global migration.x-postcopy-ram=on')
+        else:
+            opts.append('-global migration.x-multifd=on')
+            opts.append(f"-global migration.multifd-channels={self.params['migration_multifd_channels']}")
+            opts.append(f"-global migration.multifd-compression={self.params['migration_compression']}")
+        return ' '.join(opts)
+
+    def run_migration(self, source, incoming):
+        """Drive the migration on the source QMP socket, return its statistics"""
+        postcopy = self.params['migration_postcopy']
+        with QmpClient(self.container_qmp_socket(source)) as qmp:
+            if postcopy:
+                capabilities = [{'capability': 'postcopy-ram', 'state': True}]
+                parameters = {}
+            else:
+                capabilities = [{'capability': 'multifd', 'state': True}]
+                parameters = {
+                    'multifd-channels': self.params['migration_multifd_channels'],
+                    'multifd-compression': self.params['migration_compression'],
+                }
+            parameters['downtime-limit'] = self.params['migration_downtime_limit']
+            qmp.execute('migrate-set-capabilities', {'capabilities': capabilities})
+            qmp.execute('migrate-set-parameters', parameters)
+
+            # The incoming QEMU needs a moment to open its listening socket
+            deadline = time.time() + self.params['console_startup_wait'] + 30
+            uri = f"tcp:{self.params['destination']}:{self.params['migration_port']}"
+            while True:
+                incoming.reload()
+                if incoming.status in ('exited', 'dead'):
+                    raise QemuVmError(f"incoming QEMU exited: {incoming.logs(tail=20).decode(errors='replace')}")
+                qmp.execute('migrate', {'uri': uri})
+                time.sleep(0.5)
+                info = qmp.execute('query-migrate')
+                if info.get('status') != 'failed':
+                    break
+                if time.time() >= deadline:
+                    raise QemuVmError(info.get('error-desc', 'could not connect to the incoming QEMU'))
+                time.sleep(1)
+
+            deadline = time.time() + self.params['migration_timeout']
+            switched = False
+            while True:
+                info = qmp.execute('query-migrate')
+                status = info.get('status')
+                if status == 'completed':
+                    break
+                if status in ('failed', 'cancelled'):
+                    raise QemuVmError(info.get('error-desc', status))
+                if time.time() >= deadline:
+                    qmp.execute('migrate_cancel')
+                    raise QemuVmError(f"not completed within {self.params['migration_timeout']}s")
+                # Switch to postcopy once the first full RAM pass is done
+                ram = info.get('ram') or {}
+                if postcopy and not switched and status == 'active' and ram.get('dirty-sync-count', 0) >= 2:
+                    qmp.execute('migrate-start-postcopy')
+                    switched = True
+                time.sleep(0.5)
+
+        ram = info.get('ram') or {}
+        total_ms = info.get('total-time') or 0
+        transferred = ram.get('transferred', 0)
+        return {
+            'status': status,
+            'downtime_ms': info.get('downtime'),
+            'total_time_ms': total_ms,
+            'setup_time_ms': info.get('setup-time'),
+            'transferred_bytes': transferred,
+            'throughput_mbps': round(transferred * 8 / 1e6 / (total_ms / 1000.0), 1) if total_ms else None,
+            'multifd_channels': None if postcopy else self.params['migration_multifd_channels'],
+            'compression': None if postcopy else self.params['migration_compression'],
+            'postcopy': postcopy,
+        }
+
+    def ensure_backed_up(self):
+        """Back up the running VM's disks, copying only changed blocks when possible"""
+        existing = self.get_container()
+        if not existing or existing.status != 'running':
+            self.module.fail_json(msg=f"VM {self.name} is not running; backups are taken from a running VM")
+        self.validate_backup_path()
+
+        manifest = self.load_backup_manifest()
+        with QmpClient(self.container_qmp_socket(existing)) as qmp:
+            disks = self.backup_disks(qmp)
+            backup_type, reason = self.choose_backup_type(manifest, disks)
+            self.result['changed'] = True
+            if self.check_mode:
+                self.result['state'] = 'would_back_up'
+                self.result['backup'] = {'type': backup_type, 'reason': reason}
+                return self.result
+
+            parent = manifest['chain'][-1] if backup_type == 'incremental' else None
+            # Milliseconds keep back-to-back backups apart; a backup never
+            # writes into an existing directory
+            now = time.time()
+            backup_id = time.strftime('%Y%m%dT%H%M%S', time.gmtime(now)) + f".{int(now * 1000) % 1000:03d}"
+            backup_dir = os.path.join(self.backup_path, backup_id)
+            try:
+                os.makedirs(backup_dir)
+            except FileExistsError:
+                self.module.fail_json(msg=f"Backup directory {backup_dir} already exists")
+
+            start = time.time()
+            entry_disks = self.run_backup(qmp, disks, backup_type, backup_dir, parent)
+
+        entry = {
+            'id': backup_id,
+            'type': backup_type,
+            'parent': parent['id'] if parent else None,
+            'created': int(start),
+            'disks': entry_disks,
+        }
+        if backup_type == 'full':
+            manifest['chain'] = []
+        manifest['chain'].append(entry)
+        atomic_write(os.path.join(self.backup_path, 'manifest.json'), json.dumps(manifest, indent=2))
+
+        self.result['state'] = 'backed_up'
+        self.result['backup'] = {
+            'id': backup_id,
+            'type': backup_type,
+            'parent': entry['parent'],
+            'reason': reason,
+            'path': backup_dir,
+            'chain_length': len(manifest['chain']),
+            'duration_seconds': round(time.time() - start, 1),
+            'disks': {d: {'file': info['file'], 'bytes': disk_usage(info['file'])}
+                      for d, info in entry_disks.items()},
+        }
+        return self.result
+
+    def ensure_restored(self):
+        """Write a backup (full chain up to backup_id) back onto the VM's disks"""
+        existing = self.get_container()
+        if existing and existing.status == 'running':
+            self.module.fail_json(msg=f"VM {self.name} is running; stop it before restoring")
+        if not self.params.get('persist_boot_image'):
+            self.module.fail_json(msg="Restoring needs persist_boot_image: true, or the next start replaces the boot disk")
+        self.validate_backup_path()
+
+        chain = self.load_backup_manifest()['chain']
+        if not chain:
+            self.module.fail_json(msg=f"No backups found in {self.backup_path}")
+        wanted = self.params.get('backup_id') or chain[-1]['id']
+        entry = next((e for e in chain if e['id'] == wanted), None)
+        if not entry:
+            self.module.fail_json(msg=f"Backup {wanted} not found in {self.backup_path}/manifest.json")
+
+        self.result['changed'] = True
+        self.result['backup'] = {'id': entry['id'], 'type': entry['type'], 'disks': {}}
+        if self.check_mode:
+            self.result['state'] = 'would_restore'
+            return self.result
+
+        start = time.time()
+        for drive, info in entry['disks'].items():
+            # The incremental file is the top of a qcow2 chain down to the full
+            # backup; convert flattens it into a standalone image
+            target = info['source']
+            if target.startswith('/dev/'):
+                # lvm-thin volume: write the blocks in place
+                self.run_in_container(
+                    f"qemu-img convert -n -O raw {shlex.quote(info['file'])} {shlex.quote(target)}",
+                    devices=True,
+                )
+            else:
+                tmp = f"{target}.restore-{os.getpid()}"
+                self.run_in_container(
+                    f"qemu-img convert -O qcow2 {shlex.quote(info['file'])} {shlex.quote(tmp)}"
+                )
+                os.replace(tmp, target)
+            self.result['backup']['disks'][drive] = {'file': info['file'], 'restored_to': target}
+
+        self.result['backup']['duration_seconds'] = round(time.time() - start, 1)
+        self.result['state'] = 'restored'
+        return self.result
+
+    def ensure_gc(self):
+        """Reclaim unreferenced VM artifacts until the disk budget is met.
+
+        Reference graph: containers -> VM directories -> boot images ->
+        backing base images, plus any storage path named in a container's
+        QEMU command (data disks, kernels, provisioning disks). Candidates
+        are removed least recently used first, each under the same lock the
+        creating code path takes, and re-checked after locking.
+        """
+        artifacts = self.collect_gc_artifacts()
+        total = sum(a['bytes'] for a in artifacts)
+
+        budget = None
+        if self.params.get('gc_budget'):
+            budget_mb = parse_mem_mb(normalize_size(self.params['gc_budget'], 'gc_budget'))
+            if budget_mb is None:
+                self.module.fail_json(msg=f"Invalid gc_budget: {self.params['gc_budget']}")
+            budget = budget_mb * 1024 * 1024
+
+        candidates = sorted(
+            (a for a in artifacts if not a['referenced'] and a['reclaimable']),
+            key=lambda a: a['last_used'],
+        )
+
+        remaining = total
+        reclaimed = []
+        for artifact in candidates:
+            if budget is not None and remaining <= budget:
+                break
+            if not self.check_mode and not self.reclaim_artifact(artifact):
+                continue
+            reclaimed.append(artifact)
+            remaining -= artifact['bytes']
+
+        freed = sum(a['bytes'] for a in reclaimed)
+        # In check mode 'changed' means "would reclaim", like other modules' dry runs
+        self.result['changed'] = bool(reclaimed)
+        self.result['state'] = 'gc'
+        self.result['gc'] = {
+            'total_bytes': total,
+            'budget_bytes': budget,
+            'budget_met': budget is None or remaining <= budget,
+            'bytes_would_free' if self.check_mode else 'bytes_freed': freed,
+            'reclaimed': [
+                {'path': a['path'], 'kind': a['kind'], 'bytes': a['bytes']} for a in reclaimed
+            ],
+            'artifacts': [
+                {k: a[k] for k in ('path', 'kind', 'bytes', 'last_used', 'referenced')}
+                for a in artifacts
+            ],
+        }
+        return self.result
+
+    def container_references(self):
+        """Return (VM names, storage paths) that may be in use.
+
+        Covers every local container, and VMs whose saved config names another
+        host: with storage_path on shared storage those may be running there,
+        so their directories and every path in their QEMU command count as
+        referenced.
+        """
+        names = set()
+        paths = set()
+        path_re = re.compile(
+            '(?:' + re.escape(self.storage_path.rstrip('/')) + '|' + re.escape(self.lv_path('').rstrip('/')) + ')'
+            + r'/[^\s,\'";]+'
+        )
+        for container in self.docker.containers.list(all=True):
+            names.add(container.name)
+            args = ' '.join(container.attrs.get('Args') or [])
+            for match in path_re.findall(args):
+                paths.add(os.path.normpath(match))
+
+        for name, config in self.remote_vm_configs().items():
+            names.add(name)
+            for match in path_re.findall(config.get('qemu_command') or ''):
+                paths.add(os.path.normpath(match))
+        return names, paths
+
+    def remote_vm_configs(self):
+        """Return {VM name: saved config} for VMs last started on another host"""
+        hostname = socket.gethostname()
+        configs = {}
+        if not os.path.isdir(self.images_dir):
+            return configs
+        for entry in os.listdir(self.images_dir):
+            try:
+                with open(os.path.join(self.images_dir, entry, 'vm-config.json')) as f:
+                    config = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue
+            if config.get('host') and config['host'] != hostname:
+                configs[entry] = config
+        return configs
+
+    def collect_gc_artifacts(self):
+        """Build the list of GC artifacts with size, last use and reference state"""
+        names, paths = self.container_references()
+
+        def referenced_by_path(path):
+            prefix = path.rstrip('/') + '/'
+            return any(p == path or p.startswith(prefix) for p in paths)
+
+        artifacts = []
+
+        def add(path, kind, referenced, reclaimable=True, lock=None):
+            artifacts.append({
+                'path': path,
+                'kind': kind,
+                'bytes': disk_usage(path),
+                'last_used': last_used(path),
+                'referenced': referenced,
+                'reclaimable': reclaimable,
+                'lock': lock,
+            })
+
+        # VM directories, and the base images their boot disks are backed by
+        cache_dirs = {'kernels', 'tuned'}
+        backing = set()
+        image_files = []
+        if os.path.isdir(self.images_dir):
+            for entry in sorted(os.listdir(self.images_dir)):
+                path = os.path.join(self.images_dir, entry)
+                if entry in cache_dirs:
+                    continue
+                if os.path.isdir(path):
+                    referenced = entry in names or referenced_by_path(path)
+                    if referenced:
+                        for root, dirs, files in os.walk(path):
+                            for f in files:
+                                base = qcow2_backing_file(os.path.join(root, f))
+                                if base:
+                                    backing.add(base)
+                    add(path, 'vm_dir', referenced, lock=f"vm-{entry}")
+                elif not entry.endswith('.sha256'):
+                    image_files.append((entry, path))
+
+        # Cached base images (and leftovers of interrupted downloads)
+        for entry, path in image_files:
+            base_name = entry.split('.tmp-')[0]
+            referenced = path in backing or referenced_by_path(path)
+            add(path, 'base_image', referenced, lock=f"image-{base_name}")
+
+        # Extracted kernels (boot_mode=fast)
+        if os.path.isdir(self.kernels_dir):
+            for entry in sorted(os.listdir(self.kernels_dir)):
+                path = os.path.join(self.kernels_dir, entry)
+                add(path, 'kernel_cache', referenced_by_path(path),
+                    lock=f"kernels-{entry.split('.tmp-')[0]}")
+
+        # Tuned base image variants (base_image_tuning)
+        if os.path.isdir(self.tuned_dir):
+            for entry in sorted(os.listdir(self.tuned_dir)):
+                path = os.path.join(self.tuned_dir, entry)
+                add(path, 'tuned_image', path in backing or referenced_by_path(path),
+                    lock=f"tuned-{entry.split('.tmp-')[0]}")
+
+        # Provisioning cache (Tailscale releases, packages, shared ISOs)
+        for sub in ('provision', 'tailscale', 'debs'):
+            sub_dir = os.path.join(self.cache_dir, sub)
+            if os.path.isdir(sub_dir):
+                for entry in sorted(os.listdir(sub_dir)):
+                    path = os.path.join(sub_dir, entry)
+                    key = entry.split('.tmp-')[0].split('.staging-')[0].split('.iso')[0]
+                    add(path, 'provision_cache', referenced_by_path(path), lock=f"{sub}-{key}")
+
+        # lvm-thin volumes: base image volumes, boot disks and data disks
+        for lv_name, lv in sorted(self.list_lvs().items()):
+            path = self.lv_path(lv_name)
+            kind = lock = None
+            reclaimable = True
+            if 'sbnb-base' in lv['tags']:
+                kind, lock = 'lvm_base_image', f"lvm-base-{lv_name.split('-')[2]}"
+            elif 'sbnb-boot' in lv['tags']:
+                vm_name = lv_name[len('sbnb-vm-'):]
+                kind, lock = 'lvm_boot_disk', f"vm-{vm_name}"
+            elif 'sbnb-data' in lv['tags']:
+                kind, lock = 'lvm_data_disk', f"data-{lv_name[len('sbnb-data-'):]}"
+                reclaimable = self.params.get('gc_data_disks', False)
+            if not kind:
+                continue
+            referenced = referenced_by_path(path) or (kind == 'lvm_boot_disk' and vm_name in names)
+            artifacts.append({
+                'path': path,
+                'kind': kind,
+                'bytes': lv['used_bytes'],
+                'last_used': lv['created'],
+                'referenced': referenced,
+                'reclaimable': reclaimable,
+                'lock': lock,
+            })
+
+        # Data disks: reported always, reclaimed only when explicitly allowed
+        if os.path.isdir(self.data_dir):
+            for entry in sorted(os.listdir(self.data_dir)):
+                path = os.path.join(self.data_dir, entry)
+                disk_name = entry.split('.qcow2')[0]
+                add(path, 'data_disk', referenced_by_path(path),
+                    reclaimable=self.params.get('gc_data_disks', False),
+                    lock=f"data-{disk_name}")
+
+        return artifacts
+
+    def reclaim_artifact(self, artifact):
+        """Delete one artifact under its lock; return False if it is in use again"""
+        with self.lock(artifact['lock']):
+            # A VM may have been created (or started) while we were scanning
+            names, paths = self.container_references()
+            path = artifact['path']
+            prefix = path.rstrip('/') + '/'
+            if any(p == path or p.startswith(prefix) for p in paths):
+                return False
+            if artifact['kind'] == 'vm_dir' and os.path.basename(path) in names:
+                return False
+            if artifact['kind'] == 'lvm_boot_disk' and artifact['lock'][len('vm-'):] in names:
+                return False
+
+            if artifact['kind'].startswith('lvm_'):
+                lv_name = os.path.basename(path)
+                if lv_name in self.list_lvs():
+                    self.run_lvm(['lvremove', '--yes', f"{self.params['vg_name']}/{lv_name}"])
+                return True
+
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+                if artifact['kind'] == 'base_image' and os.path.exists(f"{path}.sha256"):
+                    os.remove(f"{path}.sha256")
+        return True
+
     # =========================================================================
     # Container Management
     # =========================================================================
@@ -595,12 +2665,88 @@ class QemuVm:
         except DockerNotFound:
             return None
 
-    def start_container(self, qemu_cmd):
-        """Start the QEMU container"""
+    def get_console_tail(self):
+        """Return the last console lines of this VM"""
+        return read_console_tail(self.console_log, self.params['console_tail_lines'])
+
+    def qmp_listening(self):
+        """Return True once QEMU accepts connections on its QMP socket"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.qmp_socket)
+            return True
+        except (IOError, OSError):
+            return False
+        finally:
+            sock.close()
+
+    def check_early_exit(self, container):
+        """Fail with the console tail if the container exits during startup
+
+        QEMU opens its QMP socket only after parsing its arguments and
+        setting up devices, where startup errors happen, so the watch ends
+        as soon as the socket accepts a connection.
+        """
+        deadline = time.time() + self.params['console_startup_wait']
+        while time.time() < deadline:
+            container.reload()
+            if container.status == 'running' and self.qmp_listening():
+                return
+            if container.status in ('exited', 'dead'):
+                exit_code = container.attrs.get('State', {}).get('ExitCode')
+                self.result['state'] = container.status
+                self.result['console_tail'] = self.get_console_tail()
+                self.module.fail_json(
+                    msg=f"VM container exited during startup (exit code {exit_code}). "
+                        f"See console_tail or {self.console_log}",
+                    **self.result
+                )
+            time.sleep(0.2)
+
+    def wait_for_cloud_init(self, container, start_time):
+        """Wait for cloud-init's final message on the console, record boot time"""
+        deadline = start_time + self.params['boot_timeout']
+        offset = 0
+        while time.time() < deadline:
+            try:
+                with open(self.console_log, 'rb') as f:
+                    f.seek(offset)
+                    data = f.read()
+            except (IOError, OSError):
+                data = b''
+            # Keep a small overlap so a line split across reads still matches
+            offset += max(len(data) - 256, 0)
+            if CLOUD_INIT_FINISHED_RE.search(data.decode('utf-8', errors='replace')):
+                self.result['boot_seconds'] = round(time.time() - start_time, 1)
+                return
+
+            container.reload()
+            if container.status in ('exited', 'dead'):
+                break
+            time.sleep(0.5)
+
+        self.result['console_tail'] = self.get_console_tail()
+        self.module.fail_json(
+            msg=f"VM did not finish cloud-init within {self.params['boot_timeout']}s "
+                f"(container status: {container.status})",
+            **self.result
+        )
+
+    def start_container(self, qemu_cmd, client=None, name=None, image=None, limits=None,
+                        environment=None):
+        """Start the QEMU container
+
+        client, name, image and limits replace the local Docker daemon, the
+        VM name, the configured image and the resource policy; migration
+        uses them (and environment) to start the incoming side.
+        """
         use_standard = self.params.get('use_standard_qemu', False)
 
         # Determine container image
-        if use_standard:
+        if image:
+            container_image = image
+            full_cmd = qemu_cmd
+        elif use_standard:
             # Use pre-built standard QEMU image (no on-the-fly installation)
             container_image = 'sbnb/qemu-standard'
             full_cmd = qemu_cmd
@@ -615,12 +2761,40 @@ class QemuVm:
         if os.path.exists('/dev/sev'):
             devices.append('/dev/sev:/dev/sev')
 
+        volumes = {
+            '/sys': {'bind': '/sys', 'mode': 'rw'},
+            '/dev': {'bind': '/dev', 'mode': 'rw'},
+            self.storage_path: {'bind': self.storage_path, 'mode': 'rw'},
+        }
+
+        # virtiofs shares outside storage_path must be visible to virtiofsd
+        for share in self.params.get('shared_dirs') or []:
+            source = share['source']
+            if os.path.commonpath([source, self.storage_path]) != self.storage_path:
+                volumes[source] = {'bind': source, 'mode': 'rw'}
+
+        # Start each boot with a fresh console log (an incoming migration
+        # continues the running VM's log)
+        if name is None:
+            rotate_console_log(self.console_log, self.params['console_log_files'])
+
+        # Bound the Docker json-file log as well: with tty=True it receives
+        # the same console stream and would otherwise grow without limit
+        log_config = docker.types.LogConfig(
+            type=docker.types.LogConfig.types.JSON,
+            config={
+                'max-size': docker_log_size(self.params['console_log_size']),
+                'max-file': str(max(self.params['console_log_files'], 1)),
+            },
+        )
+
         # Container configuration
         # Use sh -c to run the command string (includes mkdir/echo for bridge.conf)
+        # Resource limits keep one VM from starving others on the host
         # tty and stdin_open enable interactive serial console via 'docker attach'
-        container = self.docker.containers.run(
+        container = (client or self.docker).containers.run(
             image=container_image,
-            name=self.name,
+            name=name or self.name,
             command=['sh', '-c', full_cmd],
             detach=True,
             tty=True,
@@ -628,29 +2802,154 @@ class QemuVm:
             privileged=True,
             network_mode='host',
             devices=devices,
-            volumes={
-                '/sys': {'bind': '/sys', 'mode': 'rw'},
-                '/dev': {'bind': '/dev', 'mode': 'rw'},
-                self.storage_path: {'bind': self.storage_path, 'mode': 'rw'},
-            },
+            log_config=log_config,
+            volumes=volumes,
+            environment=environment,
+            # Pinned VMs: their cores plus the host's reserved cores for emulator
+            # threads; others: every core no pinned VM holds
+            cpuset_cpus=self.container_cpuset() if client is None else None,
+            **(self.build_resource_limits() if limits is None else limits)
         )
 
+        # A pinned VM may have taken cores while this container was starting
+        if client is None and not self.pinned_cpus and os.path.exists(self.cpu_ledger):
+            try:
+                cores = read_cpu_topology()
+            except (IOError, OSError):
+                cores = None
+            if cores:
+                with self.lock('cpu-ledger'):
+                    self.refresh_shared_cpusets(cores, self.prune_ledger(load_ledger(self.cpu_ledger)))
+
         return container
 
+    def build_resource_limits(self):
+        """Translate the resource policy parameters into Docker run kwargs"""
+        limits = {}
+
+        if self.params.get('cpu_shares'):
+            limits['cpu_shares'] = self.params['cpu_shares']
+        if self.params.get('cpu_quota'):
+            limits['nano_cpus'] = int(self.params['cpu_quota'] * 1e9)
+
+        mem_limit = self.params.get('mem_limit')
+        if mem_limit:
+            if mem_limit == 'auto':
+                guest_mb = parse_mem_mb(self.params['mem'])
+                if self.params.get('mem_overhead'):
+                    overhead_mb = parse_mem_mb(self.params['mem_overhead'])
+                else:
+                    overhead_mb = 512 + guest_mb // 50
+                limit_mb = guest_mb + overhead_mb if guest_mb and overhead_mb else None
+            else:
+                limit_mb = parse_mem_mb(mem_limit)
+            if not limit_mb:
+                self.module.fail_json(msg=f"Invalid mem_limit/mem_overhead: {mem_limit}")
+            limits['mem_limit'] = limit_mb * 1024 * 1024
+            # No swap on top of the limit: a swapping VM is as bad as a noisy one
+            limits['memswap_limit'] = limits['mem_limit']
+
+        if self.params.get('io_weight'):
+            limits['blkio_weight'] = self.params['io_weight']
+
+        io_max = {k: v for k, v in (self.params.get('io_max') or {}).items() if v}
+        if io_max:
+            if self.params['disk_backend'] == 'lvm-thin':
+                # Each thin volume is its own device-mapper device
+                devices = [os.path.realpath(self.boot_image)]
+                if self.params.get('data_disk_name'):
+                    devices.append(os.path.realpath(self.lv_path(f"sbnb-data-{self.params['data_disk_name']}")))
+            else:
+                try:
+                    devices = [block_device_for_path(self.storage_path)]
+                except (IOError, OSError) as e:
+                    self.module.fail_json(msg=f"Cannot find block device of {self.storage_path}: {e}")
+            for key in ('read_bps', 'write_bps'):
+                if key in io_max:
+                    rate_mb = parse_mem_mb(io_max[key])
+                    if not rate_mb:
+                        self.module.fail_json(msg=f"Invalid io_max.{key}: {io_max[key]}")
+                    limits[f"device_{key}"] = [{'Path': d, 'Rate': rate_mb * 1024 * 1024} for d in devices]
+            for key in ('read_iops', 'write_iops'):
+                if key in io_max:
+                    limits[f"device_{key}"] = [{'Path': d, 'Rate': io_max[key]} for d in devices]
+
+        return limits
+
+    def container_resources(self, container):
+        """Return the cgroup limits Docker applied to a container"""
+        host_config = container.attrs.get('HostConfig') or {}
+        resources = {}
+        if host_config.get('CpuShares'):
+            resources['cpu_shares'] = host_config['CpuShares']
+        if host_config.get('NanoCpus'):
+            resources['cpu_quota'] = host_config['NanoCpus'] / 1e9
+        if host_config.get('Memory'):
+            resources['mem_limit'] = host_config['Memory']
+        if host_config.get('BlkioWeight'):
+            resources['io_weight'] = host_config['BlkioWeight']
+
+        io_max = {}
+        for key, attr in (('read_bps', 'BlkioDeviceReadBps'), ('write_bps', 'BlkioDeviceWriteBps'),
+                          ('read_iops', 'BlkioDeviceReadIOps'), ('write_iops', 'BlkioDeviceWriteIOps')):
+            for entry in host_config.get(attr) or []:
+                io_max['device'] = entry['Path']
+                io_max[key] = entry['Rate']
+        if io_max:
+            resources['io_max'] = io_max
+        return resources
+
     # =========================================================================
     # VM Preparation
     # =========================================================================
 
-    def run_in_container(self, cmd, check_rc=True):
+    def prepare_assets(self):
+        """Prepare boot image, cloud-init, passthrough and disks for a new VM.
+
+        The steps run as a dependency graph on prepare_workers threads: the
+        boot image waits for the download and base image tuning, while cloud-init, vfio binding and
+        the data disk are created alongside it. Step durations are returned
+        as prepare_timings; all step errors are reported together.
+        """
+        steps = {
+            'vm_directory': ((), self.prepare_vm_directory),
+            'download_image': ((), self.download_image),
+            'boot_image': (('vm_directory', 'tune_image'), self.prepare_boot_image),
+            'tune_image': (('download_image',), self.tune_base_image),
+            'fast_boot': (('download_image',), self.prepare_fast_boot),
+            'provisioning': ((), self.prepare_provisioning),
+            'cloud_init': (('vm_directory', 'provisioning'), self.create_cloud_init),
+            'gpu_passthrough': ((), self.setup_gpu_passthrough),
+            'pcie_passthrough': ((), self.setup_pcie_passthrough),
+            'shared_dirs': ((), self.prepare_shared_dirs),
+            'data_disk': (('vm_directory',), self.prepare_data_disk),
+        }
+        results, timings, errors = run_step_graph(steps, self.params['prepare_workers'])
+        self.result['prepare_timings'] = {name: round(seconds, 2) for name, seconds in timings.items()}
+
+        if errors:
+            # GPUs may already be in the ledger for a VM that will not start
+            self.release_host_resources()
+            self.module.fail_json(
+                msg="VM preparation failed: " + '; '.join(f"{name}: {errors[name]}" for name in steps if name in errors),
+                **self.result
+            )
+        return results
+
+    def run_in_container(self, cmd, check_rc=True, image=None, devices=False):
         """Run a command inside a container for VM preparation
 
         Args:
             cmd: Command to run
-            check_rc: Whether to fail on non-zero return code
+            check_rc: Whether to raise QemuVmError on non-zero return code
+            image: Container image to use instead of the QEMU image
+            devices: Give the container the host's block devices (LVM volumes)
         """
         use_standard = self.params.get('use_standard_qemu', False)
 
-        if use_standard:
+        if image:
+            container_image = image
+        elif use_standard:
             # Use pre-built standard QEMU image (has qemu-utils, wget, curl)
             container_image = 'sbnb/qemu-standard'
         else:
@@ -661,11 +2960,16 @@ class QemuVm:
         full_cmd = [
             'docker', 'run', '--rm',
             '-v', f'{self.storage_path}:{self.storage_path}',
-            container_image,
-            'sh', '-c', prep_cmd
         ]
-
-        rc, stdout, stderr = self.module.run_command(full_cmd, check_rc=check_rc)
+        if devices:
+            full_cmd += ['--privileged', '-v', '/dev:/dev']
+        full_cmd += [container_image, 'sh', '-c', prep_cmd]
+
+        # Raise instead of failing the module: preparation steps run on worker
+        # threads and their errors are reported together
+        rc, stdout, stderr = self.module.run_command(full_cmd)
+        if check_rc and rc != 0:
+            raise QemuVmError(f"'{cmd}' failed in {container_image} (rc={rc}): {stderr.strip() or stdout.strip()}")
         return rc, stdout, stderr
 
     def prepare_vm_directory(self):
@@ -680,19 +2984,89 @@ class QemuVm:
         images_dir = os.path.join(self.storage_path, 'images')
         cached_image = os.path.join(images_dir, image_filename)
 
+        tmp_image = f"{cached_image}.tmp-{os.getpid()}"
+
         # Use curl -z to only download if remote file is newer than local
         # -z uses the file's modification time to check against server
-        # -L follows redirects, -O writes to filename from URL
-        cmd = f'cd {images_dir} && curl -L -z {image_filename} -O {image_url}'
-        rc, stdout, stderr = self.run_in_container(cmd, check_rc=False)
-        # curl returns 0 even if file wasn't downloaded (not modified)
-        if rc != 0:
-            self.module.fail_json(msg=f"Failed to download image: {stderr}")
+        # -L follows redirects, -o writes to a temporary file that replaces
+        # the cached image only once complete, -w reports the HTTP status
+        cmd = (f'cd {images_dir} && curl -fL -z {image_filename} -o {tmp_image} '
+               f'-w "%{{http_code}}" {image_url}')
+
+        def download():
+            # Exclusive: other VMs copying or hashing the cached image must wait
+            with self.lock(f"image-{image_filename}"):
+                rc, stdout, stderr = self.run_in_container(cmd, check_rc=False)
+                # curl returns 0 even if file wasn't downloaded (not modified)
+                if rc != 0:
+                    if os.path.exists(tmp_image):
+                        os.remove(tmp_image)
+                    raise QemuVmError(f"Failed to download image: {stderr}")
+
+                if stdout.strip().endswith('200') and os.path.exists(tmp_image):
+                    os.replace(tmp_image, cached_image)
+                elif os.path.exists(tmp_image):
+                    os.remove(tmp_image)
+
+        # Shared until the boot image is copied and kernels are extracted
+        self.hold_shared(f"image-{image_filename}", cached_image, download)
 
         self.cached_image = cached_image
+        self.base_image = cached_image
+        self.base_image_lock = f"image-{image_filename}"
+
+    def tune_base_image(self):
+        """Convert the cached base image once into a tuned qcow2 variant.
+
+        The variant lives in images/tuned/<sha256 prefix>-<tuning>-<cluster>.qcow2,
+        so a new image version gets a new variant and every VM booted from the
+        same version copies the same file.
+        """
+        tuning = self.params['base_image_tuning']
+        # Thin volumes hold the base image as raw blocks already
+        if tuning == 'off' or self.params['disk_backend'] == 'lvm-thin':
+            return
+
+        cluster_size = self.params['base_image_cluster_size']
+        image_lock = self.lock(self.base_image_lock, shared=True)
+        with image_lock:
+            digest = file_digest(self.cached_image)
+        tuned = os.path.join(self.tuned_dir, f"{digest[:16]}-{tuning}-{cluster_size}.qcow2")
+        tuned_lock = f"tuned-{os.path.basename(tuned)}"
+
+        def convert():
+            if os.path.exists(tuned):
+                return
+            with self.lock(tuned_lock), image_lock:
+                # Another run may have finished the conversion while we waited
+                if not os.path.exists(tuned):
+                    os.makedirs(self.tuned_dir, exist_ok=True)
+                    tmp = f"{tuned}.tmp-{os.getpid()}"
+                    options = f"cluster_size={cluster_size},extended_l2=on"
+                    if tuning == 'zstd':
+                        options = f"-c -o {options},compression_type=zstd"
+                    else:
+                        options = f"-o {options}"
+                    cmd = f'qemu-img convert -O qcow2 {options} {self.cached_image} {tmp}'
+                    try:
+                        self.run_in_container(cmd, check_rc=True)
+                    except QemuVmError:
+                        if os.path.exists(tmp):
+                            os.remove(tmp)
+                        raise
+                    os.replace(tmp, tuned)
+
+        self.hold_shared(tuned_lock, tuned, convert)
+
+        self.base_image = tuned
+        self.base_image_lock = tuned_lock
+        self.result['base_image'] = tuned
 
     def prepare_boot_image(self):
         """Copy and resize boot image"""
+        if self.params['disk_backend'] == 'lvm-thin':
+            return self.prepare_lvm_boot_disk()
+
         # If persist_boot_image is enabled and image exists, skip recreation
         if self.params.get('persist_boot_image') and os.path.exists(self.boot_image):
             return
@@ -701,14 +3075,358 @@ class QemuVm:
         if os.path.exists(self.boot_image):
             os.remove(self.boot_image)
 
-        # Copy from cache using container
-        cmd = f'cp {self.cached_image} {self.boot_image}'
-        self.run_in_container(cmd, check_rc=True)
+        # Build the boot image under a temporary name so an interrupted copy
+        # is never reused as a persisted boot disk
+        tmp_image = f"{self.boot_image}.tmp-{os.getpid()}"
+
+        # Copy from cache using container (shared lock: no download or gc
+        # may replace the base image mid-copy)
+        with self.lock(self.base_image_lock, shared=True):
+            cmd = f'cp {self.base_image} {tmp_image}'
+            self.run_in_container(cmd, check_rc=True)
 
         # Resize image using qemu-img in container
-        cmd = f'qemu-img resize {self.boot_image} {self.params["image_size"]}'
+        cmd = f'qemu-img resize {tmp_image} {self.params["image_size"]}'
         self.run_in_container(cmd, check_rc=True)
 
+        os.replace(tmp_image, self.boot_image)
+
+    def validate_boot_mode(self):
+        """Reject boot_mode combinations QEMU cannot run"""
+        if self.params['boot_mode'] != 'fast':
+            return
+
+        if self.params['confidential_computing']:
+            self.module.fail_json(
+                msg="boot_mode=fast is not supported with confidential_computing "
+                    "(SEV-SNP guests boot through IGVM firmware)"
+            )
+
+        if self.params['fast_boot_machine'] == 'microvm' and (
+                self.params['gpus'] or self.params.get('pcie_devices')):
+            self.module.fail_json(
+                msg="fast_boot_machine=microvm does not support GPU or PCIe passthrough, "
+                    "use fast_boot_machine=q35"
+            )
+
+    def validate_shared_dirs(self):
+        """Reject virtiofs shares that cannot work"""
+        shared_dirs = self.params.get('shared_dirs') or []
+        if not shared_dirs:
+            return
+
+        if self.params['confidential_computing']:
+            self.module.fail_json(
+                msg="shared_dirs (virtiofs) is not supported with confidential_computing: "
+                    "vhost-user cannot access encrypted guest memory"
+            )
+
+        tags = [share['tag'] for share in shared_dirs]
+        if len(set(tags)) != len(tags):
+            self.module.fail_json(msg=f"shared_dirs tags must be unique, got: {', '.join(tags)}")
+
+    def virtiofs_socket(self, tag):
+        """Path of the vhost-user socket for a virtiofs share"""
+        return os.path.join(self.vm_dir, f"virtiofs-{tag}.sock")
+
+    def prepare_fast_boot(self):
+        """Extract kernel and initrd from the cached base image for direct boot.
+
+        Extraction runs once per base image version: results are stored in
+        kernels/<sha256 prefix>/ and reused by every VM booted from that image.
+        """
+        if self.params['boot_mode'] != 'fast':
+            return
+
+        image_lock = self.lock(f"image-{os.path.basename(self.cached_image)}", shared=True)
+        with image_lock:
+            digest = file_digest(self.cached_image)
+        cache_dir = os.path.join(self.kernels_dir, digest[:16])
+        self.kernel_path = os.path.join(cache_dir, 'vmlinuz')
+        self.initrd_path = os.path.join(cache_dir, 'initrd.img')
+        self.result['kernel_path'] = self.kernel_path
+
+        kernels_lock = f"kernels-{digest[:16]}"
+
+        def extract():
+            if os.path.exists(self.kernel_path) and os.path.exists(self.initrd_path):
+                return
+            with self.lock(kernels_lock), image_lock:
+                # Another run may have finished the extraction while we waited
+                if not os.path.exists(cache_dir):
+                    self.extract_kernel(cache_dir)
+
+        # QEMU reads the kernel only when the container starts
+        self.hold_shared(kernels_lock, self.kernel_path, extract)
+
+    def extract_kernel(self, cache_dir):
+        """Extract vmlinuz and initrd.img from the cached image into cache_dir"""
+        # Extract into a private work directory, then rename into place so a
+        # partially extracted kernel is never picked up
+        work_dir = f"{cache_dir}.tmp-{os.getpid()}"
+        os.makedirs(self.kernels_dir, exist_ok=True)
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+
+        # Convert the image to raw, then look through each partition (smallest
+        # first, so a separate /boot partition is found before the rootfs) for
+        # the newest vmlinuz-<version> and read it out with debugfs
+        script = (
+            'set -e; '
+            'W={work}; mkdir -p $W; '
+            'qemu-img convert -O raw {image} $W/disk.raw; '
+            "sfdisk -d $W/disk.raw | sed -n 's/.*start= *\\([0-9]*\\), *size= *\\([0-9]*\\).*/\\1 \\2/p' "
+            '| sort -n -k2 > $W/parts; '
+            'while read start size; do '
+            'dd if=$W/disk.raw of=$W/part bs=1M iflag=skip_bytes,count_bytes '
+            'skip=$((start * 512)) count=$((size * 512)) conv=sparse status=none; '
+            'for dir in /boot /; do '
+            'ver=$(debugfs -R "ls -p $dir" $W/part 2>/dev/null '
+            "| awk -F/ '{{print $6}}' | sed -n 's/^vmlinuz-//p' | sort -V | tail -n 1); "
+            'if [ -n "$ver" ]; then '
+            'debugfs -R "dump $dir/vmlinuz-$ver $W/vmlinuz" $W/part; '
+            'debugfs -R "dump $dir/initrd.img-$ver $W/initrd.img" $W/part; '
+            'echo $ver > $W/version; '
+            'rm -f $W/disk.raw $W/part $W/parts; exit 0; '
+            'fi; done; '
+            'done < $W/parts; '
+            'rm -f $W/disk.raw $W/part $W/parts; exit 1'
+        ).format(work=work_dir, image=self.cached_image)
+
+        rc, stdout, stderr = self.run_in_container(script, check_rc=False)
+        if rc != 0 or not os.path.exists(os.path.join(work_dir, 'vmlinuz')) \
+                or not os.path.exists(os.path.join(work_dir, 'initrd.img')):
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise QemuVmError(
+                f"Failed to extract kernel/initrd from {self.cached_image} for boot_mode=fast: {stderr}"
+            )
+
+        os.rename(work_dir, cache_dir)
+
+    def resolve_tailscale_version(self, tailscale_cache):
+        """Resolve tailscale_version to a concrete release, or None if unknown.
+
+        C(latest) is looked up at most once per TAILSCALE_LATEST_TTL; the
+        answer is remembered in the cache, so most creates need no network
+        round-trip. No lock is held here.
+        """
+        version = self.params['tailscale_version']
+        if version != 'latest':
+            return version
+
+        marker = os.path.join(self.cache_dir, 'tailscale-latest')
+        try:
+            if time.time() - os.stat(marker).st_mtime < TAILSCALE_LATEST_TTL:
+                with open(marker) as f:
+                    resolved = f.read().strip()
+                if resolved:
+                    return resolved
+        except OSError:
+            pass
+
+        cmd = f"curl -fsSL --max-time 20 '{TAILSCALE_APT_URL}/?mode=json'"
+        rc, stdout, stderr = self.run_in_container(cmd, check_rc=False)
+        if rc == 0:
+            try:
+                resolved = json.loads(stdout)['TarballsVersion']
+            except (ValueError, KeyError, TypeError):
+                resolved = None
+            if resolved:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                atomic_write(marker, resolved + '\n')
+                return resolved
+
+        # Offline: use the newest version already in the cache
+        cached = []
+        if os.path.isdir(tailscale_cache):
+            for entry in os.listdir(tailscale_cache):
+                if os.path.exists(os.path.join(tailscale_cache, entry, tailscale_deb(entry))):
+                    cached.append(entry)
+        if not cached:
+            return None
+        return max(cached, key=lambda v: [int(x) if x.isdigit() else 0 for x in v.split('.')])
+
+    def cache_tailscale(self):
+        """Ensure a Tailscale release is cached, return its directory or None.
+
+        The directory holds the release's .deb from the apt repository and
+        the repository's signing key; it appears complete or not at all.
+        """
+        tailscale_cache = os.path.join(self.cache_dir, 'tailscale')
+        version = self.resolve_tailscale_version(tailscale_cache)
+        if not version:
+            return None
+
+        release_dir = os.path.join(tailscale_cache, version)
+        deb = tailscale_deb(version)
+        if os.path.exists(os.path.join(release_dir, deb)):
+            return release_dir
+
+        # Only runs fetching this same release wait for each other
+        with self.lock(f"tailscale-{version}"):
+            if os.path.exists(os.path.join(release_dir, deb)):
+                return release_dir
+            tmp = f"{release_dir}.tmp-{os.getpid()}"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            cmd = (
+                f'curl -fsSL -o {tmp}/{deb} {TAILSCALE_APT_URL}/ubuntu/pool/{deb} && '
+                f'curl -fsSL -o {tmp}/{TAILSCALE_KEYRING} {TAILSCALE_APT_URL}/ubuntu/noble.noarmor.gpg'
+            )
+            rc, stdout, stderr = self.run_in_container(cmd, check_rc=False)
+            if rc != 0 or sorted(os.listdir(tmp)) != sorted([deb, TAILSCALE_KEYRING]):
+                shutil.rmtree(tmp, ignore_errors=True)
+                return None
+            # Entries of older releases of this module held a static tarball
+            shutil.rmtree(release_dir, ignore_errors=True)
+            os.rename(tmp, release_dir)
+        return release_dir
+
+    def cache_packages(self):
+        """Download first_boot_packages (.deb) into the cache, return the directory or None"""
+        packages = sorted(self.params.get('first_boot_packages') or [])
+        if not packages:
+            return None
+
+        image = self.params['package_cache_image']
+        key = hashlib.sha256(json.dumps([image, packages]).encode()).hexdigest()[:16]
+        debs_dir = os.path.join(self.cache_dir, 'debs', key)
+        if os.path.isdir(debs_dir):
+            return debs_dir
+
+        with self.lock(f"debs-{key}"):
+            if os.path.isdir(debs_dir):
+                return debs_dir
+            tmp = f"{debs_dir}.tmp-{os.getpid()}"
+            cmd = (
+                f'mkdir -p {tmp}/partial && apt-get update -q && '
+                f'apt-get install -y -q --download-only --no-install-recommends '
+                f'-o Dir::Cache::archives={tmp} {" ".join(packages)} && '
+                f'rm -rf {tmp}/partial {tmp}/lock'
+            )
+            rc, stdout, stderr = self.run_in_container(cmd, check_rc=False, image=image)
+            if rc != 0:
+                shutil.rmtree(tmp, ignore_errors=True)
+                self.module.warn(f"Could not cache first_boot_packages, guests will download them: {stderr}")
+                return None
+            os.rename(tmp, debs_dir)
+        return debs_dir
+
+    def prepare_provisioning(self):
+        """Build (or reuse) the shared read-only provisioning disk.
+
+        The ISO is keyed by its contents, so every VM using the same Tailscale
+        version and package set attaches the same file. Each cache entry has
+        its own lock: runs needing different artifacts never wait for each
+        other, and a run whose artifacts are cached takes no lock at all.
+        """
+        if not self.params.get('offline_provisioning'):
+            return
+
+        self.build_provisioning_disk()
+
+    def build_provisioning_disk(self):
+        """Fill the Tailscale/package cache and build the provisioning ISO"""
+        tailscale_dir = self.cache_tailscale()
+        debs_dir = self.cache_packages()
+        if not tailscale_dir and not debs_dir:
+            self.module.warn("Tailscale is not cached and could not be fetched, "
+                             "guest will install it from the internet")
+            return
+
+        key = hashlib.sha256(json.dumps([
+            tailscale_dir, debs_dir, PROVISION_TAILSCALE_SCRIPT, PROVISION_PACKAGES_SCRIPT,
+        ]).encode()).hexdigest()[:16]
+        provision_dir = os.path.join(self.cache_dir, 'provision')
+        iso = os.path.join(provision_dir, f"{key}.iso")
+
+        if not os.path.exists(iso):
+            with self.lock(f"provision-{key}"):
+                if not os.path.exists(iso) and not self.build_provisioning_iso(
+                        iso, provision_dir, key, tailscale_dir, debs_dir):
+                    return
+
+        self.provision_iso = iso
+        self.provision_has_tailscale = bool(tailscale_dir)
+        self.provision_has_packages = bool(debs_dir)
+        self.result['provision_image'] = iso
+
+    def build_provisioning_iso(self, iso, provision_dir, key, tailscale_dir, debs_dir):
+        """Write the provisioning ISO for one cache key, return False on failure"""
+        # Stage with hard links (same filesystem) to avoid copying packages
+        staging = os.path.join(provision_dir, f"{key}.staging-{os.getpid()}")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        if tailscale_dir:
+            os.makedirs(os.path.join(staging, 'tailscale'))
+            for name in os.listdir(tailscale_dir):
+                os.link(os.path.join(tailscale_dir, name), os.path.join(staging, 'tailscale', name))
+            with open(os.path.join(staging, 'install-tailscale.sh'), 'w') as f:
+                f.write(PROVISION_TAILSCALE_SCRIPT)
+        if debs_dir:
+            os.makedirs(os.path.join(staging, 'debs'))
+            for deb in os.listdir(debs_dir):
+                if deb.endswith('.deb'):
+                    os.link(os.path.join(debs_dir, deb), os.path.join(staging, 'debs', deb))
+            with open(os.path.join(staging, 'install-packages.sh'), 'w') as f:
+                f.write(PROVISION_PACKAGES_SCRIPT)
+
+        tmp = f"{iso}.tmp-{os.getpid()}"
+        cmd = f'genisoimage -quiet -output {tmp} -volid SBNBPROV -joliet -rock {staging}'
+        rc, stdout, stderr = self.run_in_container(cmd, check_rc=False)
+        shutil.rmtree(staging, ignore_errors=True)
+        if rc != 0:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            self.module.warn(f"Failed to build provisioning disk, guest will use the internet: {stderr}")
+            return False
+        os.rename(tmp, iso)
+        return True
+
+    def build_provision_runcmd(self):
+        """Build runcmd entries installing Tailscale and first-boot packages.
+
+        Cached copies on the provisioning disk are tried first, the internet
+        is only used as a fallback.
+        """
+        online_tailscale = 'curl -fsSL https://tailscale.com/install.sh | sh'
+        packages = ' '.join(self.params.get('first_boot_packages') or [])
+        online_packages = f'(apt-get update && apt-get install -y {packages})'
+
+        if not self.provision_iso:
+            entries = [online_tailscale]
+            if packages:
+                entries.append(online_packages)
+            return entries
+
+        mnt = '/mnt/sbnb-provision'
+        entries = [f'mkdir -p {mnt} && mount -o ro LABEL=SBNBPROV {mnt}']
+        if self.provision_has_tailscale:
+            entries.append(f'sh {mnt}/install-tailscale.sh || {online_tailscale}')
+        else:
+            entries.append(online_tailscale)
+        if packages:
+            if self.provision_has_packages:
+                entries.append(f'sh {mnt}/install-packages.sh || {online_packages}')
+            else:
+                entries.append(online_packages)
+        entries.append(f'umount {mnt}')
+        return entries
+
+    def build_shared_dirs_runcmd(self):
+        """Build runcmd entries adding virtiofs shares to fstab and mounting them"""
+        entries = []
+        for share in self.params.get('shared_dirs') or []:
+            tag = share['tag']
+            mount_point = share.get('mount_point') or f"/mnt/{tag}"
+            opts = 'ro,nofail' if share.get('readonly') else 'defaults,nofail'
+            entries.append(f'mkdir -p {mount_point}')
+            entries.append(
+                f'grep -q "^{tag} " /etc/fstab || echo "{tag} {mount_point} virtiofs {opts} 0 0" >> /etc/fstab'
+            )
+            entries.append(f'mount {mount_point} || true')
+        return entries
+
     def create_cloud_init(self):
         """Create cloud-init ISO"""
         user_data_path = os.path.join(self.vm_dir, 'user-data')
@@ -726,6 +3444,25 @@ chpasswd:
 ssh_pwauth: true
 """
 
+        # Tailscale / first-boot package installation (offline-first)
+        provision_runcmd = ''.join(f'  - {cmd}\n' for cmd in self.build_provision_runcmd())
+
+        # virtiofs shares
+        provision_runcmd += ''.join(f'  - {cmd}\n' for cmd in self.build_shared_dirs_runcmd())
+
+        # Guest systemd feeds the i6300esb watchdog; a hung guest stops
+        # feeding it and QEMU exits (see health_devices)
+        watchdog_files = ''
+        watchdog_runcmd = ''
+        watchdog_timeout = self.params['guest_watchdog_timeout']
+        if self.params['health_devices'] and watchdog_timeout > 0:
+            watchdog_files = f"""  - path: /etc/systemd/system.conf.d/sbnb-watchdog.conf
+    content: |
+      [Manager]
+      RuntimeWatchdogSec={watchdog_timeout}s
+"""
+            watchdog_runcmd = '  - systemctl daemon-reexec\n'
+
         # Build extra runcmd entries from user-provided commands
         extra_runcmd = ''
         for cmd in self.params.get('runcmd') or []:
@@ -770,12 +3507,11 @@ ssh_pwauth: true
 
       [Install]
       WantedBy=multi-user.target
-
+{watchdog_files}
 runcmd:
   - hostname {self.name}
   - echo {self.name} > /etc/hostname
-  - curl -fsSL https://tailscale.com/install.sh | sh
-  - systemctl daemon-reload
+{provision_runcmd}{watchdog_runcmd}  - systemctl daemon-reload
   - systemctl enable tailscale-up.service
   - tailscale up --ssh --advertise-tags={self.params['tailscale_tags']} --auth-key={self.params['tskey']}
 {extra_runcmd}"""
@@ -790,68 +3526,225 @@ runcmd:
         cmd = f'genisoimage -output {self.seed_iso} -volid cidata -joliet -rock {user_data_path} {meta_data_path}'
         self.run_in_container(cmd, check_rc=True)
 
+    def prepare_shared_dirs(self):
+        """Create host directories for virtiofs shares"""
+        for share in self.params.get('shared_dirs') or []:
+            os.makedirs(share['source'], exist_ok=True)
+
     def prepare_data_disk(self):
         """Prepare optional data disk"""
         data_disk_name = self.params.get('data_disk_name')
         if not data_disk_name:
             return None
+        if self.params['disk_backend'] == 'lvm-thin':
+            return self.prepare_lvm_data_disk(data_disk_name)
 
         data_disk_path = os.path.join(self.data_dir, f"{data_disk_name}.qcow2")
 
-        if not os.path.exists(data_disk_path):
-            size = self.params.get('data_disk_size', '100G')
-            # Create disk using qemu-img in container
-            cmd = f'qemu-img create -f qcow2 {data_disk_path} {size}'
-            self.run_in_container(cmd, check_rc=True)
+        with self.lock(f"data-{data_disk_name}"):
+            if not os.path.exists(data_disk_path):
+                size = self.params.get('data_disk_size') or '100G'
+                tmp_disk = f"{data_disk_path}.tmp-{os.getpid()}"
+                # Create disk using qemu-img in container
+                cmd = f'qemu-img create -f qcow2 {tmp_disk} {size}'
+                self.run_in_container(cmd, check_rc=True)
+                os.replace(tmp_disk, data_disk_path)
 
         return data_disk_path
 
+    # =========================================================================
+    # LVM Thin Disks
+    # =========================================================================
+
+    def lv_path(self, lv_name):
+        """Device path of a logical volume in vg_name"""
+        return f"/dev/{self.params['vg_name']}/{lv_name}"
+
+    def run_lvm(self, args):
+        """Run an LVM command on the host, raising QemuVmError on failure"""
+        rc, stdout, stderr = self.module.run_command(args)
+        if rc != 0:
+            raise QemuVmError(f"{' '.join(args)} failed: {stderr.strip() or stdout.strip()}")
+        return stdout
+
+    def list_lvs(self):
+        """Return {lv name: {size, used_bytes, tags, created}} for vg_name ({} if it is missing)"""
+        if not shutil.which('lvs'):
+            return {}
+        rc, stdout, stderr = self.module.run_command([
+            'lvs', '--reportformat', 'json', '--units', 'b', '--nosuffix',
+            '--config', 'report/time_format="%s"',
+            '-o', 'lv_name,lv_size,data_percent,lv_tags,lv_time', self.params['vg_name'],
+        ])
+        if rc != 0:
+            return {}
+        lvs = {}
+        try:
+            for report in json.loads(stdout).get('report', []):
+                for lv in report.get('lv', []):
+                    size = int(lv['lv_size'])
+                    lvs[lv['lv_name']] = {
+                        'size': size,
+                        'used_bytes': int(size * float(lv.get('data_percent') or 100) / 100),
+                        'tags': [t for t in lv.get('lv_tags', '').split(',') if t],
+                        'created': int(lv.get('lv_time') or 0),
+                    }
+        except (ValueError, KeyError, TypeError):
+            return {}
+        return lvs
+
+    def create_thin_volume(self, lv_name, size, tag):
+        """Create a thin volume of size (lvcreate units, e.g. 100G or 1234b) in thin_pool"""
+        self.run_lvm([
+            'lvcreate', '--yes', '-V', size, '-T', f"{self.params['vg_name']}/{self.params['thin_pool']}",
+            '-n', lv_name, '--addtag', tag,
+        ])
+
+    def prepare_lvm_base_volume(self):
+        """Write the cached base image once into a read-only thin volume.
+
+        The volume is named after the image's sha256 prefix, so a new image
+        version gets a new volume and every boot disk of one version is a
+        snapshot of the same volume.
+        """
+        with self.lock(self.base_image_lock, shared=True):
+            digest = file_digest(self.cached_image)[:16]
+        base_lv = f"sbnb-base-{digest}"
+
+        with self.lock(f"lvm-base-{digest}"), self.lock(self.base_image_lock, shared=True):
+            if base_lv in self.list_lvs():
+                return base_lv
+
+            rc, stdout, stderr = self.run_in_container(
+                f"qemu-img info --output=json {shlex.quote(self.cached_image)}"
+            )
+            virtual_size = json.loads(stdout)['virtual-size']
+
+            # Unprovisioned thin blocks read as zeros, so only data is written
+            tmp_lv = f"{base_lv}-tmp"
+            if tmp_lv in self.list_lvs():
+                self.run_lvm(['lvremove', '--yes', f"{self.params['vg_name']}/{tmp_lv}"])
+            self.create_thin_volume(tmp_lv, f"{virtual_size}b", 'sbnb-base')
+            try:
+                self.run_in_container(
+                    f"qemu-img convert -n --target-is-zero -O raw "
+                    f"{shlex.quote(self.cached_image)} {self.lv_path(tmp_lv)}",
+                    devices=True,
+                )
+            except QemuVmError:
+                self.run_lvm(['lvremove', '--yes', f"{self.params['vg_name']}/{tmp_lv}"])
+                raise
+            self.run_lvm(['lvrename', self.params['vg_name'], tmp_lv, base_lv])
+            self.run_lvm(['lvchange', '--permission', 'r', f"{self.params['vg_name']}/{base_lv}"])
+        return base_lv
+
+    def prepare_lvm_boot_disk(self):
+        """Snapshot the base volume as this VM's boot disk and grow it to image_size"""
+        vg = self.params['vg_name']
+        boot_lv = os.path.basename(self.boot_image)
+        lvs = self.list_lvs()
+        if boot_lv in lvs:
+            if self.params.get('persist_boot_image'):
+                return
+            self.run_lvm(['lvremove', '--yes', f"{vg}/{boot_lv}"])
+
+        base_lv = self.prepare_lvm_base_volume()
+        # Thin snapshots get the activation-skip flag by default; -kn (--setactivationskip n)
+        # clears it so the snapshot activates normally (lvchange -ay, boot-time autoactivation)
+        self.run_lvm([
+            'lvcreate', '--yes', '-s', '-kn', '--permission', 'rw',
+            '-n', boot_lv, '--addtag', 'sbnb-boot', f"{vg}/{base_lv}",
+        ])
+
+        size_mb = parse_mem_mb(self.params['image_size'])
+        if size_mb and size_mb * 1024 * 1024 > self.list_lvs()[boot_lv]['size']:
+            self.run_lvm(['lvextend', '-L', f"{size_mb}m", f"{vg}/{boot_lv}"])
+
+    def prepare_lvm_data_disk(self, data_disk_name):
+        """Create the data disk as a thin volume (kept across VM restarts)"""
+        data_lv = f"sbnb-data-{data_disk_name}"
+        with self.lock(f"data-{data_disk_name}"):
+            if data_lv not in self.list_lvs():
+                size = self.params.get('data_disk_size') or '100G'
+                self.create_thin_volume(data_lv, size, 'sbnb-data')
+        return self.lv_path(data_lv)
+
     # =========================================================================
     # GPU/PCIe Passthrough
     # =========================================================================
 
     def setup_gpu_passthrough(self):
-        """Setup GPU passthrough and return list of GPU addresses"""
-        gpus_param = self.params['gpus']
+        """Allocate GPUs from the host GPU ledger and bind them to vfio-pci.
 
-        if not gpus_param:
-            return []
+        Returns the PCI addresses to pass through: the GPUs plus the other
+        devices in their IOMMU groups.
+        """
+        gpus_param = self.params['gpus']
 
         # Handle string "true"/"True" from command line as well as boolean True
+        if not gpus_param or str(gpus_param).lower() == 'false':
+            return []
         if gpus_param == 'auto' or gpus_param is True or str(gpus_param).lower() == 'true':
-            gpus = self.detect_gpus()
+            request = 'auto'
         elif isinstance(gpus_param, list):
-            gpus = gpus_param
+            request = gpus_param
+        elif isinstance(gpus_param, int) or str(gpus_param).isdigit():
+            request = int(gpus_param)
+            if request == 0:
+                return []
         else:
-            return []
+            raise QemuVmError(f"Invalid gpus value: {gpus_param}")
+
+        with self.lock('gpu-ledger'):
+            ledger = self.prune_ledger(load_ledger(self.gpu_ledger))
+            ledger.pop(self.name, None)
+            allocated = {d for entry in ledger.values() for d in entry['devices']}
+            allocated |= self.container_vfio_devices()
+
+            selected = allocate_gpus(
+                discover_gpus(names=self.gpu_names()), allocated, request,
+                model=self.params.get('gpu_model'),
+            )
+            if request == 'auto' and not selected:
+                self.module.warn("gpus=auto: no free GPU on this host, starting without GPUs")
+
+            devices = []
+            for gpu in selected:
+                devices.extend(d for d in gpu['devices'] if d not in devices)
+            if devices:
+                ledger[self.name] = {
+                    'gpus': [g['address'] for g in selected],
+                    'devices': devices,
+                    'allocated_at': int(time.time()),
+                }
+                os.makedirs(self.state_dir, exist_ok=True)
+                atomic_write(self.gpu_ledger, json.dumps(ledger, indent=2, sort_keys=True))
 
         # Bind GPUs to vfio-pci
-        for gpu in gpus:
-            self.bind_to_vfio(gpu)
-
-        return gpus
-
-    def detect_gpus(self):
-        """Auto-detect NVIDIA and AMD GPUs"""
-        gpus = []
-
-        # Detect NVIDIA GPUs
-        rc, stdout, stderr = self.module.run_command(
-            f"lspci -nn | grep -i {self.NVIDIA_VENDOR} | awk '{{print $1}}'",
-            use_unsafe_shell=True
-        )
-        if rc == 0 and stdout.strip():
-            gpus.extend(stdout.strip().split('\n'))
-
-        # Detect AMD GPUs (VGA class only)
-        rc, stdout, stderr = self.module.run_command(
-            f"lspci -d {self.AMD_VENDOR}::{self.VGA_CLASS} | awk '{{print $1}}'",
-            use_unsafe_shell=True
-        )
-        if rc == 0 and stdout.strip():
-            gpus.extend(stdout.strip().split('\n'))
+        for device in devices:
+            self.bind_to_vfio(device)
 
-        return [g for g in gpus if g]  # Filter empty strings
+        return devices
+
+    def gpu_names(self):
+        """Map PCI addresses to lspci descriptions (for gpu_model)"""
+        rc, stdout, stderr = self.module.run_command(['lspci', '-D'])
+        names = {}
+        if rc == 0:
+            for line in stdout.splitlines():
+                address, _, description = line.partition(' ')
+                names[address] = description
+        return names
+
+    def container_vfio_devices(self):
+        """PCI devices passed through by other running VM containers"""
+        devices = set()
+        for container in self.docker.containers.list():
+            if container.name == self.name:
+                continue
+            cmd = ' '.join(container.attrs.get('Args') or [])
+            devices.update(normalize_pci_address(a) for a in re.findall(r'vfio-pci,host=([0-9a-fA-F:.]+)', cmd))
+        return devices
 
     def setup_pcie_passthrough(self):
         """Setup PCIe device passthrough"""
@@ -873,14 +3766,562 @@ runcmd:
 
         vendor_device = stdout.strip().replace(':', ' ')
 
-        # Write to vfio-pci new_id
+        # Write to vfio-pci new_id (serialized per vendor:device ID, since
+        # concurrent VMs with identical GPUs write the same entry)
         vfio_path = '/sys/bus/pci/drivers/vfio-pci/new_id'
+        with self.lock(f"vfio-{vendor_device.replace(' ', '-')}"):
+            try:
+                with open(vfio_path, 'w') as f:
+                    f.write(vendor_device)
+            except IOError:
+                # May already be bound, not fatal
+                pass
+
+    # =========================================================================
+    # Backups
+    # =========================================================================
+
+    BACKUP_BITMAP = 'sbnb-backup'
+    BACKUP_DRIVES = ('disk0', 'datadisk0')
+
+    def container_qmp_socket(self, container):
+        """Return the QMP socket a running VM container was started with"""
+        match = re.search(r'-qmp unix:([^,\s]+)', container.attrs['Config']['Cmd'][-1])
+        if not match:
+            self.module.fail_json(msg=f"VM {self.name} was started without a QMP socket; restart it first")
+        return match.group(1)
+
+    def add_dirty_bitmaps(self):
+        """Create the persistent backup bitmap on disks that do not have one yet"""
+        # Persistent bitmaps are stored in qcow2 metadata; raw volumes only get full backups
+        if self.params['disk_backend'] == 'lvm-thin':
+            return
+        try:
+            with QmpClient(self.qmp_socket) as qmp:
+                for drive, info in self.backup_disks(qmp).items():
+                    if not info['bitmap']:
+                        qmp.execute('block-dirty-bitmap-add', {
+                            'node': drive, 'name': self.BACKUP_BITMAP, 'persistent': True,
+                        })
+        except QemuVmError as e:
+            self.module.warn(f"Could not create dirty bitmaps, backups will be full: {e}")
+
+    def backup_disks(self, qmp):
+        """Return {drive: {source, size, bitmap}} for the VM's boot and data disks"""
+        disks = {}
+        for block in qmp.execute('query-block'):
+            inserted = block.get('inserted') or {}
+            if block.get('device') not in self.BACKUP_DRIVES or not inserted:
+                continue
+            bitmaps = inserted.get('dirty-bitmaps') or block.get('dirty-bitmaps') or []
+            bitmap = next((b for b in bitmaps if b.get('name') == self.BACKUP_BITMAP), None)
+            disks[block['device']] = {
+                'source': inserted['file'],
+                'size': inserted['image']['virtual-size'],
+                'bitmap': bitmap if bitmap and bitmap.get('persistent') and not bitmap.get('inconsistent') else None,
+            }
+        return disks
+
+    def validate_backup_path(self):
+        """The QEMU container only sees storage_path, so backups must live there"""
+        path = os.path.abspath(self.backup_path)
+        if os.path.commonpath([path, self.storage_path]) != self.storage_path:
+            self.module.fail_json(msg=f"backup_path must be under storage_path ({self.storage_path})")
+        self.backup_path = path
+
+    def load_backup_manifest(self):
+        """Read the backup chain manifest of this VM"""
+        try:
+            with open(os.path.join(self.backup_path, 'manifest.json')) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {'vm': self.name, 'chain': []}
+
+    @staticmethod
+    def disk_identity(path):
+        """Identify a disk file; a recreated boot disk gets a new inode"""
+        st = os.stat(path)
+        return f"{st.st_dev}:{st.st_ino}"
+
+    def choose_backup_type(self, manifest, disks):
+        """Return (type, reason): incremental only if the chain matches the current disks"""
+        mode = self.params['backup_mode']
+        if mode == 'full':
+            return 'full', 'requested'
+
+        last = manifest['chain'][-1] if manifest['chain'] else None
+        reason = None
+        if not last:
+            reason = 'no previous backup'
+        elif set(last['disks']) != set(disks):
+            reason = 'disks changed since the previous backup'
+        else:
+            for drive, info in disks.items():
+                if not info['bitmap']:
+                    reason = f"no dirty bitmap on {drive}"
+                elif last['disks'][drive]['identity'] != self.disk_identity(info['source']):
+                    reason = f"{drive} was recreated since the previous backup"
+                if reason:
+                    break
+
+        if reason is None:
+            return 'incremental', 'chain continues'
+        if mode == 'incremental':
+            self.module.fail_json(msg=f"Cannot take an incremental backup: {reason}")
+        return 'full', reason
+
+    def run_backup(self, qmp, disks, backup_type, backup_dir, parent):
+        """Copy each disk into backup_dir with blockdev-backup, return manifest disks"""
+        actions = []
+        entry_disks = {}
+        for drive, info in disks.items():
+            target = os.path.join(backup_dir, f"{drive}.qcow2")
+            if backup_type == 'incremental':
+                # Unchanged clusters are read through the previous backup
+                backing = parent['disks'][drive]['file']
+                self.run_in_container(
+                    f"qemu-img create -f qcow2 -b {shlex.quote(backing)} -F qcow2 "
+                    f"{shlex.quote(target)} {info['size']}"
+                )
+            else:
+                self.run_in_container(f"qemu-img create -f qcow2 {shlex.quote(target)} {info['size']}")
+
+            node = f"backup-{drive}"
+            qmp.execute('blockdev-add', {
+                'node-name': node,
+                'driver': 'qcow2',
+                'file': {'driver': 'file', 'filename': target},
+                'backing': None,
+            })
+
+            if backup_type == 'full':
+                # Reset change tracking at the exact point the full copy starts;
+                # tracking is only started here with dirty_bitmaps
+                if info['bitmap']:
+                    actions.append({'type': 'block-dirty-bitmap-clear',
+                                    'data': {'node': drive, 'name': self.BACKUP_BITMAP}})
+                elif self.params['dirty_bitmaps']:
+                    actions.append({'type': 'block-dirty-bitmap-add',
+                                    'data': {'node': drive, 'name': self.BACKUP_BITMAP, 'persistent': True}})
+                backup = {'sync': 'full'}
+            else:
+                backup = {'sync': 'incremental', 'bitmap': self.BACKUP_BITMAP}
+            backup.update({'job-id': node, 'device': drive, 'target': node})
+            actions.append({'type': 'blockdev-backup', 'data': backup})
+
+            entry_disks[drive] = {
+                'file': target,
+                'source': info['source'],
+                'identity': self.disk_identity(info['source']),
+                'size': info['size'],
+            }
+
+        try:
+            qmp.execute('transaction', {'actions': actions})
+            deadline = time.time() + self.params['backup_timeout']
+            pending = {f"backup-{drive}": drive for drive in entry_disks}
+            while pending:
+                event = qmp.wait_event(
+                    ('BLOCK_JOB_COMPLETED', 'BLOCK_JOB_CANCELLED'), max(deadline - time.time(), 0)
+                )
+                drive = pending.pop(event['data'].get('device'), None)
+                if drive and (event['event'] == 'BLOCK_JOB_CANCELLED' or event['data'].get('error')):
+                    raise QemuVmError(f"backup of {drive} failed: {event['data'].get('error', 'cancelled')}")
+        except QemuVmError as e:
+            shutil.rmtree(backup_dir, ignore_errors=True)
+            self.module.fail_json(msg=f"Backup failed: {e}", **self.result)
+        finally:
+            for drive in entry_disks:
+                try:
+                    qmp.execute('blockdev-del', {'node-name': f"backup-{drive}"})
+                except QemuVmError:
+                    pass
+
+        return entry_disks
+
+    # =========================================================================
+    # Live Resize
+    # =========================================================================
+
+    VMEM_DEVICE = 'vmem0'
+
+    def hotplug_enabled(self):
+        """vCPU/memory hotplug needs a q35 machine without SEV-SNP"""
+        microvm = self.params.get('boot_mode') == 'fast' and self.params.get('fast_boot_machine') == 'microvm'
+        return not (self.params['confidential_computing'] or microvm)
+
+    def max_vcpu(self):
+        """Return the -smp maxcpus ceiling (vcpu unless max_vcpu is set)"""
+        return max(self.params.get('max_vcpu') or 0, self.params['vcpu'])
+
+    def apply_live_resize(self, container, pinned=False):
+        """Apply vcpu/mem changes to a running VM over QMP.
+
+        Only a change of the requested vcpu/mem (as recorded in vm-config.json
+        at start) is applied: sizes capped to the host at boot, or "max",
+        never count as a difference by themselves. Returns True when the
+        change cannot be hotplugged and the VM has to be restarted with the
+        new size; False when nothing is left to do.
+        """
+        cmd = container.attrs['Config']['Cmd'][-1]
+        if '-qmp unix:' not in cmd:
+            return False
+
+        config = self.load_vm_config()
+        saved = config.get('requested')
+        if saved == self.requested:
+            return False
+        if not saved:
+            # Started by an older qemu_vm: take the running size as the spec
+            if config:
+                self.record_requested(config)
+            return False
+
+        # Boot sizes and ceilings the container was started with
+        smp = re.search(r'-smp (\d+)(\S*)', cmd)
+        boot_vcpu = int(smp.group(1)) if smp else 1
+        maxcpus = re.search(r'maxcpus=(\d+)', smp.group(2)) if smp else None
+        max_vcpu = int(maxcpus.group(1)) if maxcpus else boot_vcpu
+        mem_opt = re.search(r' -m (\S+)', cmd)
+        base_mb = parse_mem_mb(mem_opt.group(1).split(',')[0]) if mem_opt else None
+        maxmem = re.search(r'maxmem=([^,\s]+)', mem_opt.group(1)) if mem_opt else None
+        max_mb = parse_mem_mb(maxmem.group(1)) if maxmem and 'virtio-mem-pci' in cmd else base_mb
+
+        with QmpClient(self.container_qmp_socket(container)) as qmp:
+            cur_vcpu = len(qmp.execute('query-cpus-fast'))
+            summary = qmp.execute('query-memory-size-summary')
+            cur_mb = (summary['base-memory'] + summary.get('plugged-memory', 0)) // (1024 * 1024)
+
+            # "max" follows free host resources, which the running VM itself
+            # reduces; only explicit sizes are applied to a running VM, capped
+            # as at boot (vcpu: host CPUs - 2, mem: free memory - 2G on top
+            # of what the VM already has)
+            want_vcpu = cur_vcpu
+            if self.requested['vcpu'] != 'max':
+                want_vcpu = self.params['vcpu']
+            want_mb = cur_mb
+            if self.requested['mem'] != 'max':
+                want_mb = parse_mem_mb(self.requested['mem'])
+                headroom_mb = max(get_system_memory_mb() - 2048, 0)
+                if want_mb - cur_mb > headroom_mb:
+                    self.module.warn(f"Not enough free host memory for mem={self.requested['mem']}, "
+                                     f"growing by {headroom_mb}M only")
+                    want_mb = cur_mb + headroom_mb
+                if base_mb and want_mb > base_mb:
+                    want_mb += (want_mb - base_mb) % 2  # virtio-mem block size is 2M
+
+            if want_vcpu == cur_vcpu and want_mb == cur_mb:
+                self.record_requested(config)
+                return False
+
+            resized = {}
+            if want_vcpu != cur_vcpu:
+                resized['vcpu'] = {'from': cur_vcpu, 'to': want_vcpu}
+            if want_mb != cur_mb:
+                resized['mem'] = {'from': f"{cur_mb}M", 'to': f"{want_mb}M"}
+
+            reasons = []
+            if 'vcpu' in resized:
+                if pinned:
+                    reasons.append('pinned vCPUs need new host cores')
+                elif max_vcpu == boot_vcpu:
+                    reasons.append("VM has no vCPU hotplug headroom (max_vcpu)")
+                elif not boot_vcpu <= want_vcpu <= max_vcpu:
+                    reasons.append(f"vcpu must stay within {boot_vcpu}-{max_vcpu} for hotplug")
+            if 'mem' in resized and not (base_mb and max_mb and base_mb <= want_mb <= max_mb):
+                reasons.append(f"mem must stay within {base_mb}M-{max_mb}M for hotplug"
+                               if max_mb != base_mb else "VM has no virtio-mem device (max_mem)")
+
+            self.result['changed'] = True
+            self.result['resized'] = dict(resized, live=not reasons)
+            if reasons:
+                if not self.params['resize_restart']:
+                    self.module.fail_json(msg=f"Cannot resize {self.name} live: {'; '.join(reasons)} "
+                                              f"(resize_restart: true restarts the VM with the new size)",
+                                          **self.result)
+                self.module.warn(f"Restarting {self.name} to resize: {'; '.join(reasons)}")
+                return True
+            if self.check_mode:
+                return False
+
+            if 'vcpu' in resized:
+                resized['vcpu']['to'] = self.hotplug_vcpus(qmp, cur_vcpu, want_vcpu)
+            if 'mem' in resized:
+                resized['mem']['to'] = f"{self.resize_virtio_mem(qmp, (want_mb - base_mb) * 1024 * 1024) // (1024 * 1024) + base_mb}M"
+            self.result['resized'] = dict(resized, live=True)
+        self.record_requested(config)
+        return False
+
+    def record_requested(self, config):
+        """Store the requested vcpu/mem once a running VM has been resized to them"""
+        if not self.check_mode:
+            atomic_write(self.vm_config, json.dumps(dict(config, requested=self.requested), indent=2))
+
+    def hotplug_vcpus(self, qmp, current, wanted):
+        """Add or remove vCPUs, return the resulting count"""
+        slots = qmp.execute('query-hotpluggable-cpus')
+
+        def slot_key(slot):
+            props = slot['props']
+            return (props.get('socket-id', 0), props.get('core-id', 0), props.get('thread-id', 0))
+
+        if wanted > current:
+            free = sorted((s for s in slots if not s.get('qom-path')), key=slot_key)
+            for slot in free[:wanted - current]:
+                device_id = 'vcpu-' + '-'.join(str(v) for v in slot_key(slot))
+                qmp.execute('device_add', dict(slot['props'], driver=slot['type'], id=device_id))
+        else:
+            # Only hotplugged vCPUs (under /machine/peripheral) can be removed
+            plugged = sorted(
+                (s for s in slots if s.get('qom-path', '').startswith('/machine/peripheral/')),
+                key=slot_key, reverse=True,
+            )
+            for slot in plugged[:current - wanted]:
+                device_id = slot['qom-path'].rsplit('/', 1)[1]
+                qmp.execute('device_del', {'id': device_id})
+                try:
+                    while qmp.wait_event('DEVICE_DELETED', 30)['data'].get('device') != device_id:
+                        pass
+                except QemuVmError:
+                    self.module.warn(f"Guest did not release {device_id} within 30s")
+                    break
+        return len(qmp.execute('query-cpus-fast'))
+
+    def resize_virtio_mem(self, qmp, requested):
+        """Set the virtio-mem requested size, return the size the guest reached"""
+        path = f"/machine/peripheral/{self.VMEM_DEVICE}"
+        qmp.execute('qom-set', {'path': path, 'property': 'requested-size', 'value': requested})
+        # The guest plugs/unplugs memory blocks asynchronously
+        deadline = time.time() + 60
+        size = qmp.execute('qom-get', {'path': path, 'property': 'size'})
+        while size != requested and time.time() < deadline:
+            time.sleep(1)
+            size = qmp.execute('qom-get', {'path': path, 'property': 'size'})
+        if size != requested:
+            self.module.warn(f"Guest reached {size // (1024 * 1024)}M of "
+                             f"{requested // (1024 * 1024)}M hotplugged memory within 60s")
+        return size
+
+    def shutdown_container(self, container):
+        """Power the guest down cleanly, then remove its container"""
         try:
-            with open(vfio_path, 'w') as f:
-                f.write(vendor_device)
-        except IOError:
-            # May already be bound, not fatal
+            with QmpClient(self.container_qmp_socket(container), timeout=10) as qmp:
+                qmp.execute('system_powerdown')
+            container.wait(timeout=120)
+        except Exception:
             pass
+        container.remove(force=True)
+        self.release_host_resources()
+
+    # =========================================================================
+    # CPU Pinning
+    # =========================================================================
+
+    def allocate_cpu_pinning(self, gpus):
+        """Reserve dedicated host cores for this VM in the host CPU ledger"""
+        if not self.params.get('cpu_pinning'):
+            return
+
+        preferred = []
+        for address in list(gpus) + list(self.params.get('pcie_devices') or []):
+            node = pci_numa_node(address)
+            if node is not None and node not in preferred:
+                preferred.append(node)
+
+        with self.lock('cpu-ledger'):
+            ledger = self.prune_ledger(load_ledger(self.cpu_ledger))
+            ledger.pop(self.name, None)
+            allocated = {cpu for entry in ledger.values() for cpu in entry['cpus']}
+            try:
+                cores = read_cpu_topology()
+            except (IOError, OSError) as e:
+                raise QemuVmError(f"Cannot read host CPU topology for cpu_pinning: {e}")
+            cpus = allocate_host_cpus(
+                cores, allocated, self.params['vcpu'],
+                reserved=self.params['host_reserved_cpus'],
+                preferred_nodes=preferred,
+            )
+            ledger[self.name] = {'cpus': cpus, 'allocated_at': int(time.time())}
+            os.makedirs(self.state_dir, exist_ok=True)
+            atomic_write(self.cpu_ledger, json.dumps(ledger, indent=2, sort_keys=True))
+            self.refresh_shared_cpusets(cores, ledger)
+
+        self.pinned_cpus = cpus
+        # Emulator and I/O threads go to the host's cores, off the vCPUs
+        # (on the VM's own cores when nothing is reserved)
+        self.emulator_cpus = housekeeping_cpus(cores, self.params['host_reserved_cpus']) or cpus
+        self.result['cpu_pinning'] = {'cpus': format_cpu_list(cpus)}
+
+    def shared_cpus(self, cores, ledger):
+        """Host CPUs held by no pinned VM, for VMs without cpu_pinning"""
+        pinned = {cpu for entry in ledger.values() for cpu in entry['cpus']}
+        return [cpu for core in cores for cpu in core['cpus'] if cpu not in pinned]
+
+    def container_cpuset(self):
+        """Return the cpuset for this VM's container, or None for no limit"""
+        if self.pinned_cpus:
+            return format_cpu_list(set(self.pinned_cpus) | set(self.emulator_cpus))
+        if not os.path.exists(self.cpu_ledger):
+            return None
+        try:
+            cores = read_cpu_topology()
+        except (IOError, OSError):
+            return None
+        with self.lock('cpu-ledger'):
+            ledger = self.prune_ledger(load_ledger(self.cpu_ledger))
+        ledger.pop(self.name, None)
+        if not ledger:
+            return None
+        return format_cpu_list(self.shared_cpus(cores, ledger))
+
+    def refresh_shared_cpusets(self, cores, ledger):
+        """Move running unpinned VMs onto the cores the ledger leaves free.
+
+        Called with the cpu-ledger lock held whenever pinned cores are handed
+        out or returned, so no unpinned VM keeps running on a pinned VM's cores.
+        """
+        cpuset = format_cpu_list(self.shared_cpus(cores, ledger))
+        for container in self.docker.containers.list():
+            if container.name in ledger:
+                continue
+            if 'qemu-system' not in ' '.join(container.attrs.get('Args') or []):
+                continue
+            if (container.attrs.get('HostConfig') or {}).get('CpusetCpus') == cpuset:
+                continue
+            try:
+                container.update(cpuset_cpus=cpuset)
+            except DockerException as e:
+                self.module.warn(f"Could not move VM {container.name} off the pinned cores: {e}")
+
+    def prune_ledger(self, ledger):
+        """Drop ledger entries of VMs that are neither running nor being started
+
+        Shared by the CPU and GPU ledgers.
+        """
+        running = {c.name for c in self.docker.containers.list()}
+        pruned = {}
+        for name, entry in ledger.items():
+            if name == self.name or name in running:
+                pruned[name] = entry
+                continue
+            # Another run holding the VM lock may be about to start it
+            try:
+                with self.lock(f"vm-{name}", timeout=0):
+                    pass
+            except QemuVmError:
+                pruned[name] = entry
+        return pruned
+
+    def release_host_resources(self):
+        """Return this VM's cores and GPUs to the host ledgers"""
+        for path, lock in ((self.cpu_ledger, 'cpu-ledger'), (self.gpu_ledger, 'gpu-ledger')):
+            if not os.path.exists(path):
+                continue
+            with self.lock(lock):
+                ledger = load_ledger(path)
+                if ledger.pop(self.name, None) is not None:
+                    atomic_write(path, json.dumps(ledger, indent=2, sort_keys=True))
+                    if path == self.cpu_ledger and self.docker:
+                        try:
+                            self.refresh_shared_cpusets(read_cpu_topology(), ledger)
+                        except (IOError, OSError):
+                            pass
+
+    def container_processes(self, container):
+        """Return [(host PID, command)] of the processes in a container"""
+        top = container.top()
+        titles = top.get('Titles') or []
+        pid_col = titles.index('PID')
+        cmd_col = titles.index('CMD') if 'CMD' in titles else len(titles) - 1
+        return [(int(proc[pid_col]), proc[cmd_col]) for proc in top.get('Processes') or []]
+
+    def qemu_host_tids(self, container):
+        """Map QEMU thread IDs as seen in the container to host thread IDs"""
+        qemu_pids = [pid for pid, cmd in self.container_processes(container) if 'qemu-system' in cmd]
+        if not qemu_pids:
+            raise QemuVmError("QEMU process not found in the VM container")
+
+        tids = {}
+        task_dir = f"/proc/{qemu_pids[0]}/task"
+        for tid in os.listdir(task_dir):
+            try:
+                with open(os.path.join(task_dir, tid, 'status')) as f:
+                    for line in f:
+                        if line.startswith('NSpid:'):
+                            # Host TID first, innermost namespace TID last
+                            tids[int(line.split()[-1])] = int(tid)
+            except (IOError, OSError):
+                pass
+        return tids
+
+    def pin_qemu_threads(self, container):
+        """Pin vCPU threads one-to-one, everything else to the emulator CPUs.
+
+        I/O threads, QEMU's main loop and workers, and the container's other
+        processes (virtiofsd) run on the host's reserved cores so they never
+        preempt a vCPU.
+        """
+        cpus = self.pinned_cpus
+        emulator = set(self.emulator_cpus or cpus)
+        with QmpClient(self.qmp_socket) as qmp:
+            vcpus = qmp.execute('query-cpus-fast')
+            iothreads = qmp.execute('query-iothreads')
+
+        tids = self.qemu_host_tids(container)
+        pin_map = {'cpus': format_cpu_list(cpus), 'vcpus': {}, 'iothreads': {}}
+        try:
+            vcpu_tids = set()
+            for vcpu in vcpus:
+                index = vcpu['cpu-index']
+                tid = tids[vcpu['thread-id']]
+                os.sched_setaffinity(tid, {cpus[index]})
+                vcpu_tids.add(tid)
+                pin_map['vcpus'][str(index)] = cpus[index]
+
+            for iothread in iothreads:
+                tid = tids[iothread['thread-id']]
+                os.sched_setaffinity(tid, emulator)
+                pin_map['iothreads'][iothread['id']] = format_cpu_list(emulator)
+
+            # Main loop, RCU and worker threads
+            for tid in tids.values():
+                if tid not in vcpu_tids:
+                    os.sched_setaffinity(tid, emulator)
+            pin_map['emulator'] = format_cpu_list(emulator)
+
+            # virtiofsd and the shell running QEMU
+            qemu_tids = set(tids.values())
+            for pid, cmd in self.container_processes(container):
+                try:
+                    for tid in os.listdir(f"/proc/{pid}/task"):
+                        if int(tid) not in qemu_tids:
+                            os.sched_setaffinity(int(tid), emulator)
+                except OSError:
+                    pass  # exited meanwhile
+        except (KeyError, IndexError, OSError) as e:
+            self.result['cpu_pinning'] = pin_map
+            self.module.fail_json(msg=f"Failed to pin QEMU threads: {e}", **self.result)
+
+        self.result['cpu_pinning'] = pin_map
+
+    def smp_option(self):
+        """Return the -smp value.
+
+        Pinned VMs expose SMT pairs to the guest; other VMs get hotplug
+        headroom only when max_vcpu is set.
+        """
+        vcpu = self.params['vcpu']
+        if self.pinned_cpus:
+            if vcpu % 2 == 0 and len(self.pinned_cpus) == vcpu:
+                cores = read_cpu_topology()
+                siblings = {tuple(core['cpus']) for core in cores}
+                pairs = [tuple(self.pinned_cpus[i:i + 2]) for i in range(0, vcpu, 2)]
+                if all(pair in siblings for pair in pairs):
+                    return f"{vcpu},sockets=1,cores={vcpu // 2},threads=2"
+            return str(vcpu)
+        if self.hotplug_enabled() and self.max_vcpu() > vcpu:
+            return f"{vcpu},maxcpus={self.max_vcpu()}"
+        return str(vcpu)
 
     # =========================================================================
     # QEMU Command Building
@@ -893,6 +4334,9 @@ runcmd:
         use_standard = self.params.get('use_standard_qemu', False)
         disable_kvm = self.params.get('disable_kvm', False)
         mem_prealloc = self.params.get('mem_prealloc', False)
+        fast_boot = self.params.get('boot_mode') == 'fast'
+        microvm = fast_boot and self.params.get('fast_boot_machine') == 'microvm'
+        shared_dirs = self.params.get('shared_dirs') or []
 
         # KVM or TCG (software emulation)
         if disable_kvm:
@@ -905,6 +4349,8 @@ runcmd:
         if use_standard:
             # Standard QEMU from Ubuntu packages
             cmd_parts = [
+                self.build_console_rotation(),
+                *self.build_virtiofs_sidecars(),
                 'mkdir -p /etc/qemu &&',
                 'echo "allow all" > /etc/qemu/bridge.conf &&',
             ]
@@ -912,15 +4358,16 @@ runcmd:
             cmd_parts.extend(accel_opts)
             cmd_parts.extend(cpu_opts)
             cmd_parts.extend([
-                '-smp', str(self.params['vcpu']),
+                '-smp', self.smp_option(),
                 '-object', 'iothread,id=iothread0',
                 '-device', 'virtio-scsi-pci,id=scsi0,iothread=iothread0',
                 '-nographic',
-                '-serial', 'mon:stdio',
             ])
         else:
             # SVSM QEMU build with IOMMU support
             cmd_parts = [
+                self.build_console_rotation(),
+                *self.build_virtiofs_sidecars(),
                 'mkdir -p /usr/qemu-svsm/etc/qemu &&',
                 'echo "allow all" > /usr/qemu-svsm/etc/qemu/bridge.conf &&',
             ]
@@ -928,28 +4375,66 @@ runcmd:
             cmd_parts.extend(accel_opts)
             cmd_parts.extend(cpu_opts)
             cmd_parts.extend([
-                '-smp', str(self.params['vcpu']),
+                '-smp', self.smp_option(),
                 '-object', 'iothread,id=iothread0',
                 '-device', 'virtio-scsi-pci,id=scsi0,disable-legacy=on,iommu_platform=on,iothread=iothread0',
                 '-nographic',
-                '-serial', 'mon:stdio',
             ])
 
+        # Serial console and monitor multiplexed on stdio (same as mon:stdio),
+        # with a copy appended to console.log in the VM directory
+        cmd_parts.extend([
+            '-chardev', f'stdio,id=char0,mux=on,logfile={self.console_log},logappend=on',
+            '-serial', 'chardev:char0',
+            '-mon', 'chardev=char0,mode=readline',
+            '-qmp', f'unix:{self.qmp_socket},server=on,wait=off',
+        ])
+
+        # Guest failures end QEMU; sbnb-vm-supervisor reads the cause
+        # (GUEST_PANICKED/WATCHDOG) on its own QMP socket and restarts the VM
+        if self.params['health_devices']:
+            cmd_parts.extend([
+                '-qmp', f'unix:{self.qmp_event_socket},server=on,wait=off',
+                '-device', 'pvpanic-pci',
+                '-action', 'panic=shutdown,watchdog=shutdown',
+            ])
+            if self.params['guest_watchdog_timeout'] > 0:
+                cmd_parts.extend(['-device', 'i6300esb'])
+
         # Boot disk - use cache=none to bypass host page cache (matches working config)
         # Use explicit bus/lun to ensure deterministic device ordering (sda=boot, sdb=data)
+        # LVM thin volumes are raw block devices: native AIO, no format layer
+        disk_format = 'format=qcow2'
+        if self.params['disk_backend'] == 'lvm-thin':
+            disk_format = 'format=raw,aio=native'
         cmd_parts.extend([
-            '-drive', f'file={self.boot_image},if=none,id=disk0,format=qcow2,snapshot=off,cache=none',
+            '-drive', f'file={self.boot_image},if=none,id=disk0,{disk_format},snapshot=off,cache=none',
             '-device', 'scsi-hd,drive=disk0,bus=scsi0.0,lun=0,bootindex=0',
-            '-cdrom', self.seed_iso,
         ])
 
+        # Cloud-init seed - microvm has no IDE controller, attach it as SCSI CD-ROM
+        if microvm:
+            cmd_parts.extend([
+                '-drive', f'file={self.seed_iso},if=none,id=seed0,media=cdrom,readonly=on',
+                '-device', 'scsi-cd,drive=seed0,bus=scsi0.0,lun=2',
+            ])
+        else:
+            cmd_parts.extend(['-cdrom', self.seed_iso])
+
         # Optional data disk - lun=1 ensures it's always sdb
         if data_disk_path:
             cmd_parts.extend([
-                '-drive', f'file={data_disk_path},if=none,id=datadisk0,format=qcow2,snapshot=off,cache=none',
+                '-drive', f'file={data_disk_path},if=none,id=datadisk0,{disk_format},snapshot=off,cache=none',
                 '-device', 'scsi-hd,drive=datadisk0,bus=scsi0.0,lun=1,serial=sbnb-data-disk',
             ])
 
+        # Shared read-only provisioning disk (cached Tailscale and packages)
+        if self.provision_iso:
+            cmd_parts.extend([
+                '-drive', f'file={self.provision_iso},if=none,id=provision0,media=cdrom,readonly=on',
+                '-device', 'scsi-cd,drive=provision0,bus=scsi0.0,lun=3',
+            ])
+
         # Networking - always use bridge mode (br0 for wired, virbr0 for WiFi NAT)
         cmd_parts.extend([
             '-device', f'virtio-net-pci,netdev=net0,mac={mac_address}',
@@ -965,15 +4450,49 @@ runcmd:
                 '-object', 'sev-snp-guest,id=sev0,cbitpos=51,reduced-phys-bits=1',
             ])
         else:
-            cmd_parts.extend([
-                '-machine', 'q35',
-                '-m', self.params['mem'],
-                '-bios', '/usr/share/ovmf/OVMF.fd',
-            ])
+            mem = self.params['mem']
+            machine = 'microvm,pcie=on' if microvm else 'q35'
+            # virtiofs (vhost-user) needs guest RAM in shared memory
+            if shared_dirs:
+                machine += ',memory-backend=ram0'
+                cmd_parts.extend(['-object', f'memory-backend-memfd,id=ram0,size={mem},share=on'])
+
+            # Memory above the boot size comes from a virtio-mem device that
+            # starts empty and is grown/shrunk over QMP
+            max_mem = self.params.get('max_mem')
+            if max_mem and self.hotplug_enabled():
+                hot_mb = parse_mem_mb(max_mem) - parse_mem_mb(mem)
+                backend = 'memory-backend-memfd' if shared_dirs else 'memory-backend-ram'
+                share = ',share=on' if shared_dirs else ''
+                cmd_parts.extend([
+                    '-machine', machine, '-m', f'{mem},maxmem={max_mem}',
+                    '-object', f'{backend},id=mem-hot0,size={hot_mb}M{share}',
+                    '-device', f'virtio-mem-pci,id={self.VMEM_DEVICE},memdev=mem-hot0,requested-size=0,block-size=2M',
+                ])
+            else:
+                cmd_parts.extend(['-machine', machine, '-m', mem])
+
+            if fast_boot:
+                # Direct kernel boot: no firmware, no bootloader
+                cmd_parts.extend([
+                    '-kernel', self.kernel_path,
+                    '-initrd', self.initrd_path,
+                    '-append', shlex.quote(self.params['kernel_append']),
+                ])
+            else:
+                cmd_parts.extend(['-bios', '/usr/share/ovmf/OVMF.fd'])
+
             # Optional memory preallocation for debugging
             if mem_prealloc:
                 cmd_parts.append('-mem-prealloc')
 
+        # virtiofs shares, served by the virtiofsd sidecars started above
+        for i, share in enumerate(shared_dirs):
+            cmd_parts.extend([
+                '-chardev', f'socket,id=vfs{i},path={self.virtiofs_socket(share["tag"])}',
+                '-device', f'vhost-user-fs-pci,queue-size=1024,chardev=vfs{i},tag={share["tag"]}',
+            ])
+
         # GPU passthrough
         for gpu in gpus:
             cmd_parts.extend(['-device', f'vfio-pci,host={gpu}'])
@@ -984,6 +4503,47 @@ runcmd:
 
         return ' '.join(cmd_parts)
 
+    def build_console_rotation(self):
+        """Build a background shell loop that keeps console.log bounded.
+
+        QEMU opens the log with O_APPEND (logappend=on), so the file can be
+        copied and truncated in place while QEMU keeps writing to it.
+        Must come first in the command: a trailing '&' backgrounds the
+        whole preceding '&&' chain.
+        """
+        max_bytes = (parse_mem_mb(self.params['console_log_size']) or 1) * 1024 * 1024
+        keep = max(self.params['console_log_files'], 1)
+        log = self.console_log
+
+        shifts = ''.join(
+            f'mv -f {log}.{i} {log}.{i + 1} 2>/dev/null; ' for i in range(keep - 1, 0, -1)
+        )
+        return (
+            f'( while sleep 30; do '
+            f'if [ "$(stat -c %s {log} 2>/dev/null || echo 0)" -gt {max_bytes} ]; then '
+            f'{shifts}cp {log} {log}.1 && : > {log}; '
+            f'fi; done ) &'
+        )
+
+    def build_virtiofs_sidecars(self):
+        """Build shell fragments starting one virtiofsd per shared directory.
+
+        virtiofsd runs in the background inside the VM container, so it lives
+        and dies with the VM. QEMU is started only once every socket exists.
+        """
+        fragments = []
+        for share in self.params.get('shared_dirs') or []:
+            sock = self.virtiofs_socket(share['tag'])
+            readonly = ' --readonly' if share.get('readonly') else ''
+            fragments.append(
+                f'rm -f {sock}; /usr/libexec/virtiofsd --socket-path={sock} '
+                f'--shared-dir={share["source"]} --cache=auto{readonly} &'
+            )
+            fragments.append(
+                f'i=0; while [ ! -S {sock} ] && [ $i -lt 100 ]; do sleep 0.1; i=$((i + 1)); done;'
+            )
+        return fragments
+
     def generate_mac_address(self):
         """Generate a deterministic MAC address based on VM name.
 
@@ -1005,14 +4565,24 @@ runcmd:
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            name=dict(type='str', required=True),
+            name=dict(type='str'),
             state=dict(type='str', default='present',
-                      choices=['present', 'absent', 'started', 'stopped']),
+                      choices=['present', 'absent', 'started', 'stopped', 'gc', 'migrated',
+                               'backed_up', 'restored']),
             vcpu=dict(type='raw', default=2),
             mem=dict(type='str', default='4G'),
+            max_vcpu=dict(type='int'),
+            max_mem=dict(type='str'),
+            resize_restart=dict(type='bool', default=False),
             image_url=dict(type='str',
                           default='https://cloud-images.ubuntu.com/noble/current/noble-server-cloudimg-amd64.img'),
             image_size=dict(type='str', default='10G'),
+            disk_backend=dict(type='str', default='qcow2', choices=['qcow2', 'lvm-thin']),
+            vg_name=dict(type='str', default='sbnb-vg'),
+            thin_pool=dict(type='str', default='sbnb-thin'),
+            base_image_tuning=dict(type='str', default='off', choices=['off', 'uncompressed', 'zstd']),
+            base_image_cluster_size=dict(type='str', default='128k',
+                                         choices=['16k', '32k', '64k', '128k', '256k', '512k', '1M', '2M']),
             tskey=dict(type='str', no_log=True),
             gpus=dict(type='raw', default=False),
             pcie_devices=dict(type='list', elements='str', default=[]),
@@ -1029,7 +4599,70 @@ def main():
             disable_kvm=dict(type='bool', default=False),
             mem_prealloc=dict(type='bool', default=False),
             runcmd=dict(type='list', elements='str', default=[]),
+            console_log_size=dict(type='str', default='10M'),
+            console_log_files=dict(type='int', default=2),
+            console_tail_lines=dict(type='int', default=50),
+            console_startup_wait=dict(type='int', default=5),
+            health_devices=dict(type='bool', default=False),
+            guest_watchdog_timeout=dict(type='int', default=0),
+            boot_mode=dict(type='str', default='firmware', choices=['firmware', 'fast']),
+            fast_boot_machine=dict(type='str', default='q35', choices=['q35', 'microvm']),
+            kernel_append=dict(type='str', default='root=LABEL=cloudimg-rootfs ro console=ttyS0'),
+            wait_for_boot=dict(type='bool', default=False),
+            boot_timeout=dict(type='int', default=600),
+            offline_provisioning=dict(type='bool', default=False),
+            tailscale_version=dict(type='str', default='latest'),
+            first_boot_packages=dict(type='list', elements='str', default=[]),
+            package_cache_image=dict(type='str', default='ubuntu:24.04'),
+            cpu_pinning=dict(type='bool', default=False),
+            host_reserved_cpus=dict(type='int', default=2),
+            cpu_shares=dict(type='int'),
+            cpu_quota=dict(type='float'),
+            mem_limit=dict(type='str'),
+            mem_overhead=dict(type='str'),
+            io_weight=dict(type='int'),
+            io_max=dict(
+                type='dict',
+                options=dict(
+                    read_bps=dict(type='str'),
+                    write_bps=dict(type='str'),
+                    read_iops=dict(type='int'),
+                    write_iops=dict(type='int'),
+                ),
+            ),
+            lock_timeout=dict(type='int', default=900),
+            prepare_workers=dict(type='int', default=4),
+            destination=dict(type='str'),
+            destination_docker_host=dict(type='str'),
+            migration_port=dict(type='int', default=4444),
+            migration_multifd_channels=dict(type='int', default=4),
+            migration_compression=dict(type='str', default='zstd', choices=['none', 'zlib', 'zstd']),
+            migration_postcopy=dict(type='bool', default=False),
+            migration_downtime_limit=dict(type='int', default=300),
+            migration_timeout=dict(type='int', default=3600),
+            dirty_bitmaps=dict(type='bool', default=False),
+            backup_path=dict(type='str'),
+            backup_mode=dict(type='str', default='auto', choices=['auto', 'full', 'incremental']),
+            backup_id=dict(type='str'),
+            backup_timeout=dict(type='int', default=21600),
+            gc_budget=dict(type='str'),
+            gc_data_disks=dict(type='bool', default=False),
+            shared_dirs=dict(type='list', elements='dict', default=[], options=dict(
+                source=dict(type='path', required=True),
+                tag=dict(type='str', required=True),
+                mount_point=dict(type='str'),
+                readonly=dict(type='bool', default=False),
+            )),
         ),
+        required_if=[
+            ('state', 'present', ['name']),
+            ('state', 'started', ['name']),
+            ('state', 'stopped', ['name']),
+            ('state', 'absent', ['name']),
+            ('state', 'migrated', ['name', 'destination']),
+            ('state', 'backed_up', ['name']),
+            ('state', 'restored', ['name']),
+        ],
         supports_check_mode=True,
     )
 
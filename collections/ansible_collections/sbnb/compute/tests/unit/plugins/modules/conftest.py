@@ -0,0 +1,168 @@
+# Shared fixtures for the qemu_vm unit tests
+#
+# Run with ansible-test from the collection root:
+#   ansible-test units --docker -v tests/unit/plugins/modules/
+# or plain pytest with the collections directory on the path:
+#   PYTHONPATH=../../.. python -m pytest tests/unit
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import collections
+
+import pytest
+
+from ansible_collections.sbnb.compute.plugins.modules import qemu_vm as qemu_vm_module
+
+
+class FakeModule:
+    """The parts of AnsibleModule QemuVm uses outside main()"""
+
+    def __init__(self, params):
+        self.params = params
+        self.check_mode = False
+        self.warnings = []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+    def fail_json(self, **kwargs):
+        raise qemu_vm_module.QemuVmError(kwargs.get('msg'))
+
+
+class FakeContainer:
+    def __init__(self, name, args=(), cpuset=''):
+        self.name = name
+        self.attrs = {'Args': list(args), 'HostConfig': {'CpusetCpus': cpuset}}
+        self.updates = []
+
+    def update(self, **kwargs):
+        self.updates.append(kwargs)
+        if 'cpuset_cpus' in kwargs:
+            self.attrs['HostConfig']['CpusetCpus'] = kwargs['cpuset_cpus']
+
+
+class FakeContainers:
+    def __init__(self, running):
+        self.running = [c if isinstance(c, FakeContainer) else FakeContainer(c) for c in running]
+
+    def list(self, all=False):
+        return list(self.running)
+
+
+class FakeDocker:
+    """Docker client stand-in: running holds running containers (or just their names)"""
+
+    def __init__(self, running=()):
+        self.containers = FakeContainers(running)
+
+
+@pytest.fixture
+def fake_container():
+    return FakeContainer
+
+
+@pytest.fixture
+def qemu_vm():
+    return qemu_vm_module
+
+
+@pytest.fixture
+def make_vm(monkeypatch, tmp_path):
+    """Build a QemuVm on a temporary storage_path without Docker"""
+    monkeypatch.setattr(qemu_vm_module, 'HAS_DOCKER', False)
+    # A large host, so vcpu/mem are never capped by the machine running the tests
+    monkeypatch.setattr(qemu_vm_module, 'get_system_cpu_count', lambda: 64)
+    monkeypatch.setattr(qemu_vm_module, 'get_system_memory_mb', lambda: 256 * 1024)
+
+    def make(name='vm1', storage_path=None, running=(), **params):
+        values = collections.defaultdict(lambda: None)
+        values.update({
+            'name': name,
+            'state': 'present',
+            'storage_path': str(storage_path or tmp_path / 'storage'),
+            'vcpu': 2,
+            'mem': '4G',
+            'image_size': '10G',
+            'disk_backend': 'qcow2',
+            'lock_timeout': 60,
+            'host_reserved_cpus': 2,
+            'tailscale_version': 'latest',
+            'package_cache_image': 'ubuntu:24.04',
+            'container_image': 'sbnb/svsm',
+        })
+        values.update(params)
+        vm = qemu_vm_module.QemuVm(FakeModule(values))
+        vm.docker = FakeDocker(running)
+        return vm
+
+    return make
+
+
+@pytest.fixture
+def cpu_sysfs(tmp_path):
+    """Write a fake /sys CPU topology, return its root.
+
+    nodes x cores_per_node physical cores with threads SMT siblings each;
+    CPU numbering follows Linux on x86: first thread of every core, then
+    the second threads. offline lists CPUs left out of the online mask.
+    """
+    def make(nodes=1, cores_per_node=4, threads=2, offline=()):
+        root = tmp_path / 'sys'
+        cpu_dir = root / 'devices' / 'system' / 'cpu'
+        cores = nodes * cores_per_node
+        total = cores * threads
+        for cpu in range(total):
+            core = cpu % cores
+            siblings = [core + t * cores for t in range(threads)]
+            topology = cpu_dir / f"cpu{cpu}" / 'topology'
+            topology.mkdir(parents=True, exist_ok=True)
+            (topology / 'thread_siblings_list').write_text(
+                qemu_vm_module.format_cpu_list(siblings) + '\n'
+            )
+            (cpu_dir / f"cpu{cpu}" / f"node{core // cores_per_node}").mkdir(exist_ok=True)
+        online = [cpu for cpu in range(total) if cpu not in offline]
+        (cpu_dir / 'online').write_text(qemu_vm_module.format_cpu_list(online) + '\n')
+        return str(root)
+
+    return make
+
+
+@pytest.fixture
+def storage(tmp_path):
+    path = tmp_path / 'storage'
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture
+def gpu_sysfs(tmp_path):
+    """Write a fake /sys PCI tree, return its root.
+
+    devices is a list of dicts with address, switch (upstream port the
+    device hangs off), group (IOMMU group) and optionally vendor, device,
+    cls and node. Each device sits behind its own downstream port of the
+    switch, as GPUs in PCIe switches do; bus/pci/devices and the IOMMU
+    group's devices/ link to it like on a host.
+    """
+    def make(devices):
+        root = tmp_path / 'sys'
+        pci_dir = root / 'bus' / 'pci' / 'devices'
+        pci_dir.mkdir(parents=True, exist_ok=True)
+        for dev in devices:
+            address = dev['address']
+            path = root / 'devices' / 'pci0000:00' / dev['switch'] / f"port-{address}" / address
+            path.mkdir(parents=True)
+            (path / 'vendor').write_text(dev.get('vendor', '0x10de') + '\n')
+            (path / 'device').write_text(dev.get('device', '0x2330') + '\n')
+            (path / 'class').write_text(dev.get('cls', '0x030200') + '\n')
+            (path / 'numa_node').write_text(f"{dev.get('node', -1)}\n")
+            (pci_dir / address).symlink_to(path)
+            if dev.get('group') is not None:
+                group = root / 'kernel' / 'iommu_groups' / str(dev['group'])
+                (group / 'devices').mkdir(parents=True, exist_ok=True)
+                (group / 'devices' / address).symlink_to(path)
+                (path / 'iommu_group').symlink_to(group)
+        return str(root)
+
+    return make
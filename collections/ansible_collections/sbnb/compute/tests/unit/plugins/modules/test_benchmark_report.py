@@ -0,0 +1,41 @@
+# benchmark_report: reading benchmark role result files
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+
+import pytest
+
+from ansible_collections.sbnb.compute.plugins.modules import benchmark_report
+
+
+class ReportFailed(Exception):
+    pass
+
+
+class FakeModule:
+    def fail_json(self, **kwargs):
+        raise ReportFailed(kwargs.get('msg'))
+
+
+@pytest.mark.parametrize('content', [[], 'host', 42, {'metrics': []}, {}])
+def test_results_not_written_by_the_role(tmp_path, content):
+    path = tmp_path / 'results.json'
+    path.write_text(json.dumps(content))
+    with pytest.raises(ReportFailed, match=r'has no metrics \(not written by the benchmark role\?\)'):
+        benchmark_report.load_results(FakeModule(), str(path))
+
+
+def test_unreadable_results(tmp_path):
+    path = tmp_path / 'results.json'
+    path.write_text('{"metrics":')
+    with pytest.raises(ReportFailed, match='Cannot read benchmark results'):
+        benchmark_report.load_results(FakeModule(), str(path))
+
+
+def test_results(tmp_path):
+    results = {'metrics': {'cpu_events_per_sec': {'value': 1000.0, 'unit': 'events/s'}}}
+    path = tmp_path / 'results.json'
+    path.write_text(json.dumps(results))
+    assert benchmark_report.load_results(FakeModule(), str(path)) == results
@@ -0,0 +1,313 @@
+# Parallel qemu_vm runs against one storage_path.
+#
+# Each run is a separate process, as with Ansible forks or async tasks, so
+# the flock()-based locks, atomic_write and the ledgers are exercised the way
+# they are on a host. Docker and downloads are faked; everything under
+# storage_path is real.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import multiprocessing
+import os
+import queue
+import re
+import time
+
+import pytest
+
+mp = multiprocessing.get_context('fork')
+
+
+def run_processes(targets, timeout=60):
+    """Start one process per (target, args), wait for all, return exit codes"""
+    procs = [mp.Process(target=target, args=args) for target, args in targets]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(timeout)
+    for proc in procs:
+        if proc.is_alive():
+            proc.kill()
+            pytest.fail('a parallel run did not finish (deadlock?)')
+    return [proc.exitcode for proc in procs]
+
+
+def drain(results):
+    items = []
+    while True:
+        try:
+            items.append(results.get(timeout=1))
+        except queue.Empty:
+            return items
+
+
+def log_line(path, line):
+    # O_APPEND writes of one short line are atomic, so the log counts calls
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    try:
+        os.write(fd, (line + '\n').encode())
+    finally:
+        os.close(fd)
+
+
+def read_log(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+@pytest.fixture
+def pinning_vm(make_vm, cpu_sysfs, qemu_vm, monkeypatch, storage):
+    """make_vm for cpu_pinning VMs on a 16-core, 2-thread fake host"""
+    sysfs = cpu_sysfs(nodes=2, cores_per_node=8, threads=2)
+    topology = qemu_vm.read_cpu_topology
+    monkeypatch.setattr(qemu_vm, 'read_cpu_topology', lambda sysfs_root='/sys': topology(sysfs))
+
+    def make(name, **params):
+        return make_vm(name, storage_path=storage, cpu_pinning=True, **params)
+
+    return make
+
+
+class TestCpuLedger:
+
+    def test_parallel_allocations_never_share_cores(self, pinning_vm, qemu_vm, storage):
+        # 30 CPUs free after the reserved core: 15 two-vCPU VMs fit, the 16th must fail
+        count = 16
+        barrier = mp.Barrier(count)
+        results = mp.Queue()
+
+        def create(name):
+            vm = pinning_vm(name)
+            # run() holds the VM lock until QEMU is up; keep it until every
+            # run has allocated so no entry is pruned as stale
+            with vm.lock(f"vm-{name}"):
+                try:
+                    vm.allocate_cpu_pinning([])
+                    results.put((name, vm.pinned_cpus))
+                except qemu_vm.QemuVmError as e:
+                    results.put((name, str(e)))
+                barrier.wait(timeout=30)
+
+        codes = run_processes([(create, (f"vm{i}",)) for i in range(count)])
+        assert codes == [0] * count
+
+        outcome = dict(drain(results))
+        pinned = {name: cpus for name, cpus in outcome.items() if isinstance(cpus, list)}
+        failed = {name: msg for name, msg in outcome.items() if isinstance(msg, str)}
+        assert len(pinned) == 15
+        assert len(failed) == 1
+        assert 'Not enough free host cores' in list(failed.values())[0]
+
+        all_cpus = [cpu for cpus in pinned.values() for cpu in cpus]
+        assert len(all_cpus) == len(set(all_cpus))
+        assert not set(all_cpus) & {0, 16}  # the host's reserved core
+
+        ledger = qemu_vm.load_ledger(os.path.join(storage, 'state', 'cpu-ledger.json'))
+        assert {name: entry['cpus'] for name, entry in ledger.items()} == pinned
+
+    def test_parallel_create_and_remove(self, pinning_vm, qemu_vm, storage):
+        old = [f"old{i}" for i in range(6)]
+        new = [f"new{i}" for i in range(6)]
+
+        # The old VMs hold cores and are running until they are removed
+        seed = pinning_vm('seed', running=old)
+        ledger, cpus = {}, 4
+        for name in old:
+            ledger[name] = {'cpus': [cpus, cpus + 16], 'allocated_at': 0}
+            cpus += 1
+        os.makedirs(seed.state_dir)
+        qemu_vm.atomic_write(seed.cpu_ledger, json.dumps(ledger))
+
+        barrier = mp.Barrier(len(new))
+        results = mp.Queue()
+
+        def create(name):
+            vm = pinning_vm(name, running=old)
+            with vm.lock(f"vm-{name}"):
+                vm.allocate_cpu_pinning([])
+                results.put((name, vm.pinned_cpus))
+                barrier.wait(timeout=30)
+
+        def remove(name):
+            vm = pinning_vm(name, running=old)
+            with vm.lock(f"vm-{name}"):
+                vm.release_host_resources()
+
+        targets = []
+        for created, removed in zip(new, old):
+            targets += [(create, (created,)), (remove, (removed,))]
+        assert run_processes(targets) == [0] * len(targets)
+
+        pinned = dict(drain(results))
+        ledger = qemu_vm.load_ledger(seed.cpu_ledger)
+        assert sorted(ledger) == sorted(new)
+        assert {name: entry['cpus'] for name, entry in ledger.items()} == pinned
+        all_cpus = [cpu for cpus in pinned.values() for cpu in cpus]
+        assert len(all_cpus) == len(set(all_cpus))
+
+
+class TestProvisioningCache:
+
+    def fake_download(self, log, release=None):
+        """run_in_container stand-in for curl/genisoimage writing the -o/-output files"""
+        def run_in_container(cmd, check_rc=True, image=None, devices=False):
+            targets = re.findall(r'-o(?:utput)? (\S+)', cmd)
+            log_line(log, targets[0])
+            if release is not None:
+                release.wait(30)
+            else:
+                time.sleep(0.2)
+            for target in targets:
+                with open(target, 'w') as f:
+                    f.write('x' * 65536)
+            return 0, '', ''
+        return run_in_container
+
+    def test_one_download_per_artifact(self, make_vm, storage):
+        log = os.path.join(storage, 'downloads.log')
+        results = mp.Queue()
+
+        def fetch(name):
+            vm = make_vm(name, storage_path=storage, tailscale_version='1.80.2')
+            vm.run_in_container = self.fake_download(log)
+            results.put(vm.cache_tailscale())
+
+        assert run_processes([(fetch, (f"vm{i}",)) for i in range(8)]) == [0] * 8
+
+        release_dir = os.path.join(storage, 'cache', 'tailscale', '1.80.2')
+        assert drain(results) == [release_dir] * 8
+        assert len(read_log(log)) == 1
+        assert sorted(os.listdir(release_dir)) == ['tailscale-archive-keyring.gpg', 'tailscale_1.80.2_amd64.deb']
+        assert os.path.getsize(os.path.join(release_dir, 'tailscale_1.80.2_amd64.deb')) == 65536
+        assert os.listdir(os.path.dirname(release_dir)) == ['1.80.2']
+
+    def test_different_artifacts_do_not_wait_for_each_other(self, make_vm, storage):
+        log = os.path.join(storage, 'downloads.log')
+        release = mp.Event()
+        finished = mp.Queue()
+
+        def slow():
+            vm = make_vm('slow', storage_path=storage, tailscale_version='1.80.1')
+            vm.run_in_container = self.fake_download(log, release)
+            vm.cache_tailscale()
+
+        def fast():
+            vm = make_vm('fast', storage_path=storage, tailscale_version='1.80.2')
+            vm.run_in_container = self.fake_download(log)
+            # Wait until the other run is downloading (and holding its lock)
+            deadline = time.time() + 30
+            while not read_log(log) and time.time() < deadline:
+                time.sleep(0.05)
+            vm.cache_tailscale()
+            finished.put(release.is_set())
+            release.set()
+
+        assert run_processes([(slow, ()), (fast, ())]) == [0, 0]
+        assert finished.get(timeout=5) is False
+        assert len(read_log(log)) == 2
+
+    def test_cached_latest_needs_no_network(self, make_vm, storage):
+        vm = make_vm('vm1', storage_path=storage)
+        calls = []
+
+        def run_in_container(cmd, check_rc=True, image=None, devices=False):
+            calls.append(cmd)
+            return 0, json.dumps({'TarballsVersion': '1.80.2'}), ''
+
+        vm.run_in_container = run_in_container
+        tailscale_cache = os.path.join(vm.cache_dir, 'tailscale')
+        assert vm.resolve_tailscale_version(tailscale_cache) == '1.80.2'
+        assert vm.resolve_tailscale_version(tailscale_cache) == '1.80.2'
+        assert len(calls) == 1
+
+    def test_one_iso_build_per_key(self, make_vm, storage):
+        log = os.path.join(storage, 'builds.log')
+        release_dir = os.path.join(storage, 'cache', 'tailscale', '1.80.2')
+        os.makedirs(release_dir)
+        for name in ('tailscale_1.80.2_amd64.deb', 'tailscale-archive-keyring.gpg'):
+            with open(os.path.join(release_dir, name), 'w') as f:
+                f.write('tailscale')
+        results = mp.Queue()
+
+        def build(name):
+            vm = make_vm(name, storage_path=storage, tailscale_version='1.80.2',
+                         offline_provisioning=True)
+            vm.run_in_container = self.fake_download(log)
+            vm.prepare_provisioning()
+            results.put(vm.provision_iso)
+
+        assert run_processes([(build, (f"vm{i}",)) for i in range(8)]) == [0] * 8
+
+        isos = drain(results)
+        assert len(set(isos)) == 1 and isos[0].endswith('.iso')
+        assert len(read_log(log)) == 1
+        assert os.listdir(os.path.dirname(isos[0])) == [os.path.basename(isos[0])]
+
+
+class TestAtomicWrite:
+
+    def test_readers_never_see_partial_files(self, qemu_vm, storage):
+        path = os.path.join(storage, 'state.json')
+        qemu_vm.atomic_write(path, json.dumps({'writer': -1}))
+        errors = mp.Queue()
+
+        def write(writer):
+            for n in range(50):
+                qemu_vm.atomic_write(path, json.dumps({'writer': writer, 'n': n, 'pad': 'x' * 200000}))
+
+        def read():
+            for _ in range(500):
+                try:
+                    with open(path) as f:
+                        json.load(f)
+                except (IOError, OSError, ValueError) as e:
+                    errors.put(repr(e))
+
+        targets = [(write, (i,)) for i in range(4)] + [(read, ()) for _ in range(4)]
+        assert run_processes(targets) == [0] * len(targets)
+        assert drain(errors) == []
+        assert not [f for f in os.listdir(storage) if '.tmp-' in f]
+
+
+class TestStepGraph:
+
+    def test_parallel_step_graphs_share_the_ledger_and_cache(self, pinning_vm, qemu_vm, storage):
+        # Like ensure_present: every run fetches the cache and pins cores in
+        # concurrent steps, several runs at a time
+        log = os.path.join(storage, 'downloads.log')
+        runs = 6
+        barrier = mp.Barrier(runs)
+        results = mp.Queue()
+
+        def create(name):
+            vm = pinning_vm(name, tailscale_version='1.80.2')
+            vm.run_in_container = TestProvisioningCache().fake_download(log)
+
+            def pin():
+                vm.allocate_cpu_pinning([])
+                return vm.pinned_cpus
+
+            with vm.lock(f"vm-{name}"):
+                step_results, timings, step_errors = qemu_vm.run_step_graph({
+                    'tailscale': ([], vm.cache_tailscale),
+                    'cpu_pinning': ([], pin),
+                    'ready': (['tailscale', 'cpu_pinning'], lambda: True),
+                })
+                results.put((name, step_results.get('cpu_pinning'), step_errors))
+                barrier.wait(timeout=30)
+
+        assert run_processes([(create, (f"vm{i}",)) for i in range(runs)]) == [0] * runs
+
+        outcome = drain(results)
+        assert [errors for _name, _cpus, errors in outcome] == [{}] * runs
+        pinned = {name: cpus for name, cpus, _errors in outcome}
+        all_cpus = [cpu for cpus in pinned.values() for cpu in cpus]
+        assert len(all_cpus) == len(set(all_cpus))
+        assert len(read_log(log)) == 1
+
+        ledger = qemu_vm.load_ledger(os.path.join(storage, 'state', 'cpu-ledger.json'))
+        assert {name: entry['cpus'] for name, entry in ledger.items()} == pinned
@@ -0,0 +1,141 @@
+# Console log rotation, console tails and the early-exit check
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import socket
+import time
+
+import pytest
+
+
+def write_log(path, lines):
+    with open(path, 'w') as f:
+        f.write(''.join(f"{line}\n" for line in lines))
+
+
+def read_log(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestRotateConsoleLog:
+
+    def test_keeps_the_last_n_logs(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        for boot in range(5):
+            qemu_vm.rotate_console_log(log, 3)
+            write_log(log, [f"boot {boot}"])
+        assert read_log(log) == 'boot 4\n'
+        assert [read_log(f"{log}.{i}") for i in (1, 2, 3)] == ['boot 3\n', 'boot 2\n', 'boot 1\n']
+        assert not os.path.exists(f"{log}.4")
+
+    def test_fills_gaps_without_failing(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        write_log(f"{log}.2", ['old'])
+        qemu_vm.rotate_console_log(log, 3)
+        assert not os.path.exists(log)
+        assert read_log(f"{log}.3") == 'old\n'
+
+    def test_keep_zero_removes_the_log(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        write_log(log, ['boot'])
+        qemu_vm.rotate_console_log(log, 0)
+        assert os.listdir(str(tmp_path)) == []
+        # Nothing to remove is fine too
+        qemu_vm.rotate_console_log(log, 0)
+
+
+class TestReadConsoleTail:
+
+    def test_log_longer_than_requested(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        write_log(log, [f"line {i}" for i in range(100)])
+        assert qemu_vm.read_console_tail(log, 3) == ['line 97', 'line 98', 'line 99']
+
+    def test_tail_spanning_several_blocks(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        lines = [f"{i:05d} " + 'x' * 200 for i in range(1000)]
+        write_log(log, lines)
+        assert qemu_vm.read_console_tail(log, 100) == lines[-100:]
+
+    def test_log_shorter_than_requested(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        write_log(log, ['only', 'two'])
+        assert qemu_vm.read_console_tail(log, 10) == ['only', 'two']
+
+    def test_short_log_is_completed_from_the_previous_boot(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        write_log(f"{log}.1", ['a', 'b', 'c'])
+        write_log(log, ['d'])
+        assert qemu_vm.read_console_tail(log, 3) == ['b', 'c', 'd']
+        assert qemu_vm.read_console_tail(log, 10) == ['a', 'b', 'c', 'd']
+
+    def test_ansi_escapes_and_carriage_returns_are_stripped(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        with open(log, 'wb') as f:
+            f.write(b'\x1b[0;32m  OK  \x1b[0m Started\r\nlogin: \x1b[?25h\r\n')
+        assert qemu_vm.read_console_tail(log, 5) == ['  OK   Started', 'login: ']
+
+    def test_missing_log_and_no_lines(self, qemu_vm, tmp_path):
+        log = str(tmp_path / 'console.log')
+        assert qemu_vm.read_console_tail(log, 5) == []
+        write_log(log, ['line'])
+        assert qemu_vm.read_console_tail(log, 0) == []
+
+
+class StartingContainer:
+    """Container that reports status from a list, one entry per reload()"""
+
+    def __init__(self, statuses, exit_code=1):
+        self.statuses = list(statuses)
+        self.status = 'created'
+        self.attrs = {'State': {'ExitCode': exit_code}}
+        self.reloads = 0
+
+    def reload(self):
+        self.reloads += 1
+        if self.statuses:
+            self.status = self.statuses.pop(0)
+
+
+class TestCheckEarlyExit:
+
+    @pytest.fixture
+    def vm(self, make_vm):
+        vm = make_vm(console_startup_wait=5, console_tail_lines=5)
+        os.makedirs(vm.vm_dir)
+        vm.result = {'changed': True}
+        return vm
+
+    def test_returns_once_qmp_is_up(self, vm):
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(vm.qmp_socket)
+        server.listen(1)
+        try:
+            start = time.time()
+            vm.check_early_exit(StartingContainer(['running']))
+            assert time.time() - start < 1
+        finally:
+            server.close()
+
+    def test_polls_until_qemu_exits(self, vm, qemu_vm):
+        # No QMP socket yet: keep watching the running container
+        container = StartingContainer(['running'] * 3 + ['exited'])
+        with pytest.raises(qemu_vm.QemuVmError, match='exit code 1'):
+            vm.check_early_exit(container)
+        assert container.reloads == 4
+
+    def test_exit_fails_with_the_console_tail(self, vm, qemu_vm):
+        write_log(vm.console_log, ['qemu-system-x86_64: -device vfio-pci: no such host device'])
+        with pytest.raises(qemu_vm.QemuVmError, match=r'exited during startup \(exit code 1\)'):
+            vm.check_early_exit(StartingContainer(['exited']))
+        assert vm.result['state'] == 'exited'
+        assert vm.result['console_tail'] == ['qemu-system-x86_64: -device vfio-pci: no such host device']
+
+    def test_disabled(self, vm):
+        container = StartingContainer(['exited'])
+        vm.params['console_startup_wait'] = 0
+        vm.check_early_exit(container)
+        assert container.reloads == 0
@@ -0,0 +1,116 @@
+# CPU topology, core allocation and cpusets (cpu_pinning) on a fake /sys
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import os
+
+import pytest
+
+QEMU_ARGS = ['-c', 'qemu-system-x86_64 -enable-kvm']
+
+
+class TestReadCpuTopology:
+
+    def test_cores_siblings_and_nodes(self, qemu_vm, cpu_sysfs):
+        cores = qemu_vm.read_cpu_topology(cpu_sysfs(nodes=2, cores_per_node=4, threads=2))
+        assert len(cores) == 8
+        assert cores[0] == {'cpus': [0, 8], 'node': 0}
+        assert cores[3] == {'cpus': [3, 11], 'node': 0}
+        assert cores[4] == {'cpus': [4, 12], 'node': 1}
+        assert [core['cpus'][0] for core in cores] == list(range(8))
+
+    def test_offline_sibling_is_dropped(self, qemu_vm, cpu_sysfs):
+        cores = qemu_vm.read_cpu_topology(cpu_sysfs(nodes=1, cores_per_node=2, threads=2, offline=[3]))
+        assert cores == [{'cpus': [0, 2], 'node': 0}, {'cpus': [1], 'node': 0}]
+
+    def test_no_smt(self, qemu_vm, cpu_sysfs):
+        cores = qemu_vm.read_cpu_topology(cpu_sysfs(nodes=1, cores_per_node=3, threads=1))
+        assert cores == [{'cpus': [0], 'node': 0}, {'cpus': [1], 'node': 0}, {'cpus': [2], 'node': 0}]
+
+
+class TestAllocateHostCpus:
+
+    @pytest.fixture
+    def cores(self, qemu_vm, cpu_sysfs):
+        return qemu_vm.read_cpu_topology(cpu_sysfs(nodes=2, cores_per_node=4, threads=2))
+
+    def test_housekeeping_is_whole_cores_from_cpu0(self, qemu_vm, cores):
+        assert qemu_vm.housekeeping_cpus(cores, 2) == [0, 8]
+        assert qemu_vm.housekeeping_cpus(cores, 3) == [0, 8, 1, 9]
+        assert qemu_vm.housekeeping_cpus(cores, 0) == []
+
+    def test_skips_reserved_and_allocated_cores(self, qemu_vm, cores):
+        # Node 1 is full, core 0 is the host's and core 1 is taken
+        cpus = qemu_vm.allocate_host_cpus(cores, allocated={1, 4, 5, 6, 7}, count=2, reserved=2)
+        assert cpus == [2, 10]
+
+    def test_prefers_node_and_keeps_vm_on_one_node(self, qemu_vm, cores):
+        assert qemu_vm.allocate_host_cpus(cores, [], 4, reserved=2, preferred_nodes=[1]) == [4, 12, 5, 13]
+        # Node 0 has 3 free cores, node 1 four: the emptiest node that fits wins
+        assert qemu_vm.allocate_host_cpus(cores, [], 8, reserved=2) == [4, 12, 5, 13, 6, 14, 7, 15]
+
+    def test_odd_count_keeps_the_spare_sibling(self, qemu_vm, cores):
+        assert qemu_vm.allocate_host_cpus(cores, [], 3, reserved=2) == [4, 12, 5, 13]
+
+    def test_not_enough_cores(self, qemu_vm, cores):
+        with pytest.raises(qemu_vm.QemuVmError, match='need 16 CPUs, 14 free'):
+            qemu_vm.allocate_host_cpus(cores, [], 16, reserved=2)
+
+
+class TestCpusets:
+
+    @pytest.fixture
+    def host(self, qemu_vm, cpu_sysfs, monkeypatch):
+        sysfs = cpu_sysfs(nodes=2, cores_per_node=4, threads=2)
+        topology = qemu_vm.read_cpu_topology
+        monkeypatch.setattr(qemu_vm, 'read_cpu_topology', lambda sysfs_root='/sys': topology(sysfs))
+        return sysfs
+
+    def write_ledger(self, vm, ledger):
+        os.makedirs(vm.state_dir, exist_ok=True)
+        with open(vm.cpu_ledger, 'w') as f:
+            json.dump(ledger, f)
+
+    def test_pinned_vm_gets_its_cores_and_the_housekeeping_cores(self, host, make_vm):
+        vm = make_vm('pinned', cpu_pinning=True, vcpu=4)
+        vm.allocate_cpu_pinning([])
+        assert vm.pinned_cpus == [4, 12, 5, 13]
+        assert vm.emulator_cpus == [0, 8]
+        assert vm.container_cpuset() == '0,4-5,8,12-13'
+
+    def test_emulator_threads_stay_on_the_vm_cores_without_reserved_cpus(self, host, make_vm):
+        vm = make_vm('pinned', cpu_pinning=True, vcpu=2, host_reserved_cpus=0)
+        vm.allocate_cpu_pinning([])
+        assert vm.emulator_cpus == vm.pinned_cpus
+
+    def test_unpinned_vm_without_pinned_vms_is_not_limited(self, host, make_vm):
+        assert make_vm('shared').container_cpuset() is None
+
+    def test_unpinned_vm_avoids_pinned_cores(self, host, make_vm):
+        vm = make_vm('shared', running=['pinned'])
+        self.write_ledger(vm, {'pinned': {'cpus': [4, 12, 5, 13], 'allocated_at': 0}})
+        assert vm.container_cpuset() == '0-3,6-11,14-15'
+
+    def test_pinning_moves_running_unpinned_vms(self, host, make_vm, fake_container):
+        shared = fake_container('shared', QEMU_ARGS)
+        other = fake_container('not-a-vm', ['-c', 'nginx'])
+        vm = make_vm('pinned', cpu_pinning=True, vcpu=2, running=[shared, other])
+        vm.allocate_cpu_pinning([])
+        assert vm.pinned_cpus == [4, 12]
+        assert shared.updates == [{'cpuset_cpus': '0-3,5-11,13-15'}]
+        assert other.updates == []
+
+        # Releasing the cores gives them back
+        vm.release_host_resources()
+        assert shared.updates[-1] == {'cpuset_cpus': '0-15'}
+
+    def test_refresh_leaves_pinned_and_up_to_date_containers(self, host, qemu_vm, make_vm, fake_container):
+        pinned = fake_container('pinned', QEMU_ARGS, cpuset='0,4,8,12')
+        current = fake_container('current', QEMU_ARGS, cpuset='0-3,5-11,13-15')
+        stale = fake_container('stale', QEMU_ARGS, cpuset='0-15')
+        vm = make_vm('vm1', running=[pinned, current, stale])
+        vm.refresh_shared_cpusets(qemu_vm.read_cpu_topology(), {'pinned': {'cpus': [4, 12]}})
+        assert pinned.updates == [] and current.updates == []
+        assert stale.updates == [{'cpuset_cpus': '0-3,5-11,13-15'}]
@@ -0,0 +1,154 @@
+# state=gc on a storage_path shared between hosts, and racing VM creation
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import time
+
+import pytest
+
+mp = multiprocessing.get_context('fork')
+
+
+def write_qcow2(path, backing):
+    """Write just enough of a qcow2 header for qcow2_backing_file()"""
+    name = backing.encode()
+    header = b'QFI\xfb' + (3).to_bytes(4, 'big') + (72).to_bytes(8, 'big') + len(name).to_bytes(4, 'big')
+    with open(path, 'wb') as f:
+        f.write(header.ljust(72, b'\0') + name)
+
+
+def add_vm(storage, name, host, data_disk=None):
+    images = os.path.join(storage, 'images')
+    vm_dir = os.path.join(images, name)
+    os.makedirs(vm_dir)
+    write_qcow2(os.path.join(vm_dir, f"{name}.qcow2"), os.path.join(images, 'ubuntu-24.04.img'))
+    cmd = f"qemu-system-x86_64 -drive file={vm_dir}/{name}.qcow2,if=virtio"
+    if data_disk:
+        cmd += f" -drive file={data_disk},if=virtio"
+    with open(os.path.join(vm_dir, 'vm-config.json'), 'w') as f:
+        json.dump({'qemu_command': cmd, 'fingerprint': 'x', 'saved_at': 0, 'host': host}, f)
+    return vm_dir
+
+
+@pytest.fixture
+def gc_vm(make_vm, storage, monkeypatch):
+    monkeypatch.setattr('socket.gethostname', lambda: 'host-a')
+
+    def make(**params):
+        vm = make_vm(None, storage_path=storage, state='gc', **params)
+        vm.list_lvs = lambda: {}
+        return vm
+
+    return make
+
+
+def test_vms_owned_by_other_hosts_are_kept(gc_vm, storage):
+    images = os.path.join(storage, 'images')
+    os.makedirs(images)
+    with open(os.path.join(images, 'ubuntu-24.04.img'), 'w') as f:
+        f.write('base')
+    data_disk = os.path.join(storage, 'data', 'remote-data.qcow2')
+    os.makedirs(os.path.dirname(data_disk))
+    with open(data_disk, 'w') as f:
+        f.write('data')
+
+    remote = add_vm(storage, 'remote', 'host-b', data_disk=data_disk)
+    local = add_vm(storage, 'local', 'host-a')
+
+    result = gc_vm(gc_data_disks=True).ensure_gc()
+
+    reclaimed = {a['path'] for a in result['gc']['reclaimed']}
+    assert reclaimed == {local}
+    assert os.path.isdir(remote)
+    assert os.path.exists(os.path.join(images, 'ubuntu-24.04.img'))
+    assert os.path.exists(data_disk)
+    assert not os.path.exists(local)
+
+
+def test_remote_reference_is_rechecked_under_the_lock(gc_vm, storage):
+    vm_dir = add_vm(storage, 'moved', 'host-a')
+    vm = gc_vm()
+    artifact = next(a for a in vm.collect_gc_artifacts() if a['path'] == vm_dir)
+    assert not artifact['referenced']
+
+    # Started on another host between the scan and the removal
+    with open(os.path.join(vm_dir, 'vm-config.json')) as f:
+        config = json.load(f)
+    config['host'] = 'host-b'
+    with open(os.path.join(vm_dir, 'vm-config.json'), 'w') as f:
+        json.dump(config, f)
+
+    assert vm.reclaim_artifact(artifact) is False
+    assert os.path.isdir(vm_dir)
+
+
+class TestGcDuringPreparation:
+    """gc in a parallel run between download_image and the boot image copy"""
+
+    image = b'base image'
+
+    def preparing_vm(self, make_vm, storage):
+        vm = make_vm('vm1', storage_path=storage, image_url='https://example.com/ubuntu-24.04.img',
+                     boot_mode='fast', base_image_tuning='off')
+
+        def run_in_container(cmd, check_rc=True, image=None, devices=False):
+            if cmd.startswith('cd '):
+                with open(re.search(r'-o (\S+)', cmd).group(1), 'wb') as f:
+                    f.write(self.image)
+                return 0, '200', ''
+            if cmd.startswith('cp '):
+                shutil.copy(*cmd.split()[1:])
+            return 0, '', ''
+
+        vm.run_in_container = run_in_container
+        return vm
+
+    def test_base_image_and_kernels_outlive_gc(self, make_vm, gc_vm, storage):
+        kernels = os.path.join(storage, 'images', 'kernels', hashlib.sha256(self.image).hexdigest()[:16])
+        os.makedirs(kernels)
+        for name in ('vmlinuz', 'initrd.img'):
+            with open(os.path.join(kernels, name), 'w') as f:
+                f.write(name)
+
+        downloaded, gc_started = mp.Event(), mp.Event()
+        events = mp.Queue()
+
+        def prepare():
+            vm = self.preparing_vm(make_vm, storage)
+            with vm.lock('vm-vm1'), vm.held_locks:
+                vm.download_image()
+                downloaded.set()
+                gc_started.wait(30)
+                # Give gc time to reach the locks
+                time.sleep(1)
+                vm.prepare_fast_boot()
+                vm.prepare_vm_directory()
+                vm.prepare_boot_image()
+                events.put(('copied', os.path.exists(vm.boot_image)))
+
+        def gc():
+            downloaded.wait(30)
+            vm = gc_vm()
+            gc_started.set()
+            result = vm.ensure_gc()
+            events.put(('gc', sorted(os.path.basename(a['path']) for a in result['gc']['reclaimed'])))
+
+        procs = [mp.Process(target=target) for target in (prepare, gc)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join(60)
+        assert [proc.exitcode for proc in procs] == [0, 0]
+
+        # gc waited for the copy, then reclaimed what the new VM no longer needs
+        assert [events.get(timeout=5) for _ in procs] == [
+            ('copied', True),
+            ('gc', [os.path.basename(kernels), 'ubuntu-24.04.img']),
+        ]
@@ -0,0 +1,171 @@
+# GPU discovery, placement and the GPU ledger on a fake /sys
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import os
+
+import pytest
+
+# Two PCIe switches per NUMA node, two GPUs per switch. The first GPU
+# shares its IOMMU group with its HDMI audio function and a bridge.
+HOST = [
+    {'address': '0000:17:00.0', 'switch': 'sw0', 'group': 30, 'node': 0},
+    {'address': '0000:17:00.1', 'switch': 'sw0', 'group': 30, 'node': 0, 'cls': '0x040300'},
+    {'address': '0000:16:00.0', 'switch': 'sw0', 'group': 30, 'node': 0, 'cls': '0x060400'},
+    {'address': '0000:18:00.0', 'switch': 'sw0', 'group': 31, 'node': 0},
+    {'address': '0000:2a:00.0', 'switch': 'sw1', 'group': 40, 'node': 0},
+    {'address': '0000:2b:00.0', 'switch': 'sw1', 'group': 41, 'node': 0},
+    {'address': '0000:ab:00.0', 'switch': 'sw2', 'group': 50, 'node': 1, 'vendor': '0x1002', 'device': '0x74a1'},
+    {'address': '0000:ac:00.0', 'switch': 'sw2', 'group': 51, 'node': 1, 'vendor': '0x1002', 'device': '0x74a1'},
+    # Not GPUs: an NVMe drive and an NVIDIA NIC-class function
+    {'address': '0000:c1:00.0', 'switch': 'sw3', 'group': 60, 'node': 1, 'vendor': '0x144d', 'cls': '0x010802'},
+    {'address': '0000:c2:00.0', 'switch': 'sw3', 'group': 61, 'node': 1, 'cls': '0x020000'},
+]
+
+
+@pytest.fixture
+def host_gpus(qemu_vm, gpu_sysfs):
+    return qemu_vm.discover_gpus(gpu_sysfs(HOST), names={'0000:ab:00.0': 'AMD Instinct MI300X'})
+
+
+def addresses(gpus):
+    return [gpu['address'] for gpu in gpus]
+
+
+class TestDiscoverGpus:
+
+    def test_finds_nvidia_and_amd_gpus_only(self, host_gpus):
+        assert addresses(host_gpus) == [
+            '0000:17:00.0', '0000:18:00.0', '0000:2a:00.0', '0000:2b:00.0', '0000:ab:00.0', '0000:ac:00.0',
+        ]
+
+    def test_iommu_group_devices_without_bridges(self, host_gpus):
+        gpu = host_gpus[0]
+        assert gpu['group'] == '30'
+        assert gpu['devices'] == ['0000:17:00.0', '0000:17:00.1']
+        assert host_gpus[1]['devices'] == ['0000:18:00.0']
+
+    def test_node_switch_id_and_name(self, host_gpus):
+        by_address = {gpu['address']: gpu for gpu in host_gpus}
+        assert by_address['0000:17:00.0']['node'] == 0
+        assert by_address['0000:ab:00.0']['node'] == 1
+        assert by_address['0000:ab:00.0']['id'] == '1002:74a1'
+        assert by_address['0000:ab:00.0']['name'] == 'AMD Instinct MI300X'
+        assert by_address['0000:17:00.0']['switch'] == by_address['0000:18:00.0']['switch']
+        assert by_address['0000:17:00.0']['switch'] != by_address['0000:2a:00.0']['switch']
+        assert by_address['0000:17:00.0']['switch'].endswith('/sw0')
+
+    def test_unknown_node_and_no_iommu(self, qemu_vm, gpu_sysfs):
+        gpus = qemu_vm.discover_gpus(gpu_sysfs([{'address': '0000:01:00.0', 'switch': 'sw0', 'group': None}]))
+        assert gpus[0]['node'] is None
+        assert gpus[0]['group'] is None
+        assert gpus[0]['devices'] == ['0000:01:00.0']
+
+    def test_no_pci_tree(self, qemu_vm, tmp_path):
+        assert qemu_vm.discover_gpus(str(tmp_path)) == []
+
+
+class TestAllocateGpus:
+
+    def test_count_fits_one_switch(self, qemu_vm, host_gpus):
+        assert addresses(qemu_vm.allocate_gpus(host_gpus, [], 2)) == ['0000:17:00.0', '0000:18:00.0']
+
+    def test_count_prefers_switch_with_room(self, qemu_vm, host_gpus):
+        # sw0 has only one GPU left: both GPUs come from sw1
+        selected = qemu_vm.allocate_gpus(host_gpus, ['0000:17:00.0', '0000:17:00.1'], 2)
+        assert addresses(selected) == ['0000:2a:00.0', '0000:2b:00.0']
+
+    def test_count_falls_back_to_the_numa_node(self, qemu_vm, host_gpus):
+        selected = qemu_vm.allocate_gpus(host_gpus, [], 3)
+        assert {gpu['node'] for gpu in selected} == {0}
+        assert len(selected) == 3
+
+    def test_allocated_group_member_blocks_the_gpu(self, qemu_vm, host_gpus):
+        # Another VM holds the audio function, so the whole group is taken
+        selected = qemu_vm.allocate_gpus(host_gpus, ['0000:17:00.1'], 'auto')
+        assert '0000:17:00.0' not in addresses(selected)
+        assert len(selected) == 5
+
+    def test_explicit_addresses(self, qemu_vm, host_gpus):
+        assert addresses(qemu_vm.allocate_gpus(host_gpus, [], ['ab:00.0'])) == ['0000:ab:00.0']
+        with pytest.raises(qemu_vm.QemuVmError, match='already attached'):
+            qemu_vm.allocate_gpus(host_gpus, ['0000:17:00.1'], ['0000:17:00.0'])
+
+    def test_model_filter(self, qemu_vm, host_gpus):
+        assert addresses(qemu_vm.allocate_gpus(host_gpus, [], 'auto', model='1002:')) == [
+            '0000:ab:00.0', '0000:ac:00.0',
+        ]
+        assert addresses(qemu_vm.allocate_gpus(host_gpus, [], 1, model='MI300X')) == ['0000:ab:00.0']
+
+    def test_not_enough_gpus(self, qemu_vm, host_gpus):
+        with pytest.raises(qemu_vm.QemuVmError, match='need 7, 6 free'):
+            qemu_vm.allocate_gpus(host_gpus, [], 7)
+
+
+class TestGpuLedger:
+
+    @pytest.fixture
+    def gpu_vm(self, make_vm, qemu_vm, gpu_sysfs, monkeypatch, storage):
+        sysfs = gpu_sysfs(HOST)
+        discover = qemu_vm.discover_gpus
+        monkeypatch.setattr(qemu_vm, 'discover_gpus', lambda sysfs_root='/sys', names=None: discover(sysfs, names))
+
+        def make(name, gpus, running=()):
+            vm = make_vm(name, storage_path=storage, gpus=gpus, running=running)
+            vm.gpu_names = lambda: {}
+            vm.bound = []
+            vm.bind_to_vfio = vm.bound.append
+            return vm
+
+        return make
+
+    def ledger(self, vm):
+        with open(vm.gpu_ledger) as f:
+            return json.load(f)
+
+    def test_running_vms_get_disjoint_gpus(self, gpu_vm):
+        first = gpu_vm('vm1', 2)
+        assert first.setup_gpu_passthrough() == ['0000:17:00.0', '0000:17:00.1', '0000:18:00.0']
+        assert first.bound == ['0000:17:00.0', '0000:17:00.1', '0000:18:00.0']
+
+        second = gpu_vm('vm2', 2, running=['vm1'])
+        assert second.setup_gpu_passthrough() == ['0000:2a:00.0', '0000:2b:00.0']
+
+        ledger = self.ledger(second)
+        assert sorted(ledger) == ['vm1', 'vm2']
+        assert ledger['vm1']['gpus'] == ['0000:17:00.0', '0000:18:00.0']
+
+    def test_restart_keeps_its_own_entry_reusable(self, gpu_vm):
+        gpu_vm('vm1', 2).setup_gpu_passthrough()
+        # Recreating vm1 (its old entry is dropped first) gets the same GPUs
+        assert gpu_vm('vm1', 2).setup_gpu_passthrough() == ['0000:17:00.0', '0000:17:00.1', '0000:18:00.0']
+        assert list(self.ledger(gpu_vm('vm1', 2))) == ['vm1']
+
+    def test_stopped_vm_gpus_are_reused(self, gpu_vm):
+        gpu_vm('vm1', 2).setup_gpu_passthrough()
+        # vm1 is not running and nobody holds its lock: the entry is stale
+        second = gpu_vm('vm2', 2)
+        assert second.setup_gpu_passthrough() == ['0000:17:00.0', '0000:17:00.1', '0000:18:00.0']
+        assert list(self.ledger(second)) == ['vm2']
+
+    def test_vm_being_started_keeps_its_gpus(self, gpu_vm):
+        first = gpu_vm('vm1', 2)
+        first.setup_gpu_passthrough()
+        with first.lock('vm-vm1'):
+            second = gpu_vm('vm2', 2)
+            assert second.setup_gpu_passthrough() == ['0000:2a:00.0', '0000:2b:00.0']
+
+    def test_release_returns_the_gpus(self, gpu_vm):
+        first = gpu_vm('vm1', 'auto')
+        assert len(first.setup_gpu_passthrough()) == 7
+        first.release_host_resources()
+        assert self.ledger(first) == {}
+        assert not os.path.exists(first.cpu_ledger)
+
+    def test_gpus_of_unledgered_containers_are_respected(self, gpu_vm, fake_container):
+        other = fake_container('legacy', ['-c', 'qemu-system-x86_64 -device vfio-pci,host=0000:17:00.0'])
+        vm = gpu_vm('vm1', 1, running=[other])
+        # The whole group of 17:00.0 stays out; the smallest free unit wins
+        assert vm.setup_gpu_passthrough() == ['0000:18:00.0']
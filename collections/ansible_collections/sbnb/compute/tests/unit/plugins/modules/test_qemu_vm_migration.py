@@ -0,0 +1,73 @@
+# Live migration commands (state=migrated)
+#
+# The two-container migration itself runs in the integration suite
+# (tests/integration/tasks/test-vm-migration.yml, TCG, no second host needed).
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import subprocess
+
+import pytest
+
+
+@pytest.fixture
+def migrating_vm(make_vm, storage):
+    return make_vm(
+        'mig', storage_path=storage, migration_port=4444, migration_postcopy=False,
+        migration_multifd_channels=4, migration_compression='zstd',
+    )
+
+
+def source_command(vm):
+    return (
+        f"mkdir -p /etc/qemu && /usr/bin/qemu-system-x86_64 -name mig -smp 2 "
+        f"-qmp unix:{vm.vm_dir}/qmp.sock,server=on,wait=off "
+        f"-qmp unix:{vm.vm_dir}/qmp-events.sock,server=on,wait=off "
+        f"-drive file={vm.vm_dir}/mig.qcow2,if=virtio"
+    )
+
+
+def test_destination_command_has_no_incoming(migrating_vm):
+    cmd = migrating_vm.build_incoming_command(source_command(migrating_vm))
+    assert '-incoming' not in cmd and 'migration.' not in cmd
+    assert f"unix:{migrating_vm.vm_dir}/qmp-migrated.sock," in cmd
+    assert f"unix:{migrating_vm.vm_dir}/qmp-events-migrated.sock," in cmd
+
+    # Migrating back swaps the sockets again
+    back = migrating_vm.build_incoming_command(cmd)
+    assert back == source_command(migrating_vm)
+
+
+def test_incoming_options(migrating_vm):
+    assert migrating_vm.incoming_options() == (
+        '-incoming tcp:0.0.0.0:4444 -global migration.x-multifd=on '
+        '-global migration.multifd-channels=4 -global migration.multifd-compression=zstd'
+    )
+
+
+def test_older_migrated_commands_lose_incoming(migrating_vm):
+    old = f"{source_command(migrating_vm)} -incoming tcp:0.0.0.0:4444 -global migration.x-multifd=on"
+    assert '-incoming' not in migrating_vm.build_incoming_command(old)
+
+
+def test_guard_round_trip(qemu_vm, migrating_vm):
+    cmd = source_command(migrating_vm)
+    guarded = qemu_vm.with_incoming_guard(cmd)
+    assert '-incoming tcp:' not in guarded
+    assert qemu_vm.strip_incoming_guard(guarded) == cmd
+    assert qemu_vm.strip_incoming_guard(cmd) == cmd
+
+
+def test_incoming_options_are_used_on_the_first_start_only(qemu_vm, tmp_path, monkeypatch):
+    monkeypatch.setattr(qemu_vm, 'INCOMING_MARKER', str(tmp_path / 'incoming-done'))
+    guarded = qemu_vm.with_incoming_guard('echo qemu -name mig')
+    env = dict(os.environ, SBNB_INCOMING='-incoming tcp:0.0.0.0:4444')
+
+    def start():
+        return subprocess.run(['sh', '-c', guarded], env=env, capture_output=True, text=True, check=True).stdout
+
+    assert start() == 'qemu -name mig -incoming tcp:0.0.0.0:4444\n'
+    # docker start / supervisor restart: same container, same environment
+    assert start() == 'qemu -name mig\n'
@@ -0,0 +1,229 @@
+# Offline provisioning: Tailscale/package cache and the first-boot runcmd
+#
+# Parallel runs sharing the cache are covered in test_qemu_vm_concurrency.py.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import os
+import re
+import time
+
+import pytest
+
+
+class FakeRun:
+    """run_in_container stand-in recording commands and writing curl/apt downloads"""
+
+    def __init__(self, rc=0, stdout='', skip=()):
+        self.rc = rc
+        self.stdout = stdout
+        self.skip = skip
+        self.calls = []
+
+    def __call__(self, cmd, check_rc=True, image=None, devices=False):
+        self.calls.append((cmd, image))
+        if self.rc == 0:
+            for target in re.findall(r'curl -fsSL -o (\S+)', cmd):
+                if not target.endswith(self.skip):
+                    with open(target, 'w') as f:
+                        f.write('deb')
+            archives = re.search(r'Dir::Cache::archives=(\S+)', cmd)
+            if archives:
+                os.makedirs(archives.group(1))
+                with open(os.path.join(archives.group(1), 'htop_3.3.0_amd64.deb'), 'w') as f:
+                    f.write('deb')
+        return self.rc, self.stdout, 'failed' if self.rc else ''
+
+
+@pytest.fixture
+def prov_vm(make_vm, storage):
+    def make(run=None, **params):
+        vm = make_vm('vm1', storage_path=storage, **params)
+        vm.run_in_container = run or FakeRun()
+        return vm
+    return make
+
+
+def cache_release(vm, version, deb=True):
+    release_dir = os.path.join(vm.cache_dir, 'tailscale', version)
+    os.makedirs(release_dir)
+    names = ['tailscale-archive-keyring.gpg'] + ([f"tailscale_{version}_amd64.deb"] if deb else [])
+    for name in names:
+        with open(os.path.join(release_dir, name), 'w') as f:
+            f.write('cached')
+    return release_dir
+
+
+class TestResolveTailscaleVersion:
+
+    def test_pinned_version_needs_no_lookup(self, prov_vm):
+        vm = prov_vm(tailscale_version='1.80.2')
+        assert vm.resolve_tailscale_version(os.path.join(vm.cache_dir, 'tailscale')) == '1.80.2'
+        assert vm.run_in_container.calls == []
+
+    def test_latest_is_looked_up_and_remembered(self, prov_vm):
+        vm = prov_vm(run=FakeRun(stdout=json.dumps({'TarballsVersion': '1.82.0'})))
+        tailscale_cache = os.path.join(vm.cache_dir, 'tailscale')
+        assert vm.resolve_tailscale_version(tailscale_cache) == '1.82.0'
+        assert 'pkgs.tailscale.com/stable/?mode=json' in vm.run_in_container.calls[0][0]
+        with open(os.path.join(vm.cache_dir, 'tailscale-latest')) as f:
+            assert f.read() == '1.82.0\n'
+
+    def test_expired_answer_is_looked_up_again(self, prov_vm, qemu_vm):
+        vm = prov_vm(run=FakeRun(stdout=json.dumps({'TarballsVersion': '1.82.0'})))
+        marker = os.path.join(vm.cache_dir, 'tailscale-latest')
+        os.makedirs(vm.cache_dir)
+        qemu_vm.atomic_write(marker, '1.80.2\n')
+        stale = time.time() - qemu_vm.TAILSCALE_LATEST_TTL - 60
+        os.utime(marker, (stale, stale))
+        assert vm.resolve_tailscale_version(os.path.join(vm.cache_dir, 'tailscale')) == '1.82.0'
+        assert len(vm.run_in_container.calls) == 1
+
+    def test_offline_host_uses_the_newest_cached_release(self, prov_vm):
+        vm = prov_vm(run=FakeRun(rc=6))
+        for version in ('1.9.0', '1.80.2', '1.10.4'):
+            cache_release(vm, version)
+        # A tarball entry of an older module version or an interrupted download
+        cache_release(vm, '1.90.0', deb=False)
+        os.makedirs(os.path.join(vm.cache_dir, 'tailscale', '1.91.0.tmp-123'))
+        assert vm.resolve_tailscale_version(os.path.join(vm.cache_dir, 'tailscale')) == '1.80.2'
+
+    def test_offline_host_without_a_cache(self, prov_vm):
+        vm = prov_vm(run=FakeRun(rc=0, stdout='<html>'))
+        assert vm.resolve_tailscale_version(os.path.join(vm.cache_dir, 'tailscale')) is None
+
+
+class TestCacheTailscale:
+
+    def test_downloads_the_deb_and_signing_key(self, prov_vm):
+        vm = prov_vm(tailscale_version='1.80.2')
+        release_dir = vm.cache_tailscale()
+        assert release_dir == os.path.join(vm.cache_dir, 'tailscale', '1.80.2')
+        assert sorted(os.listdir(release_dir)) == ['tailscale-archive-keyring.gpg', 'tailscale_1.80.2_amd64.deb']
+        cmd = vm.run_in_container.calls[0][0]
+        assert 'https://pkgs.tailscale.com/stable/ubuntu/pool/tailscale_1.80.2_amd64.deb' in cmd
+        assert '.noarmor.gpg' in cmd
+
+    def test_cached_release_is_reused(self, prov_vm):
+        vm = prov_vm(tailscale_version='1.80.2')
+        release_dir = cache_release(vm, '1.80.2')
+        assert vm.cache_tailscale() == release_dir
+        assert vm.run_in_container.calls == []
+
+    def test_tarball_entry_is_replaced(self, prov_vm):
+        vm = prov_vm(tailscale_version='1.80.2')
+        release_dir = cache_release(vm, '1.80.2', deb=False)
+        with open(os.path.join(release_dir, 'tailscale.tgz'), 'w') as f:
+            f.write('old')
+        assert vm.cache_tailscale() == release_dir
+        assert 'tailscale.tgz' not in os.listdir(release_dir)
+
+    @pytest.mark.parametrize('run', [FakeRun(rc=22), FakeRun(skip='.gpg')])
+    def test_failed_download_leaves_nothing_behind(self, prov_vm, run):
+        vm = prov_vm(run=run, tailscale_version='1.80.2')
+        assert vm.cache_tailscale() is None
+        assert os.listdir(os.path.join(vm.cache_dir, 'tailscale')) == []
+
+
+class TestCachePackages:
+
+    def test_no_packages(self, prov_vm):
+        vm = prov_vm()
+        assert vm.cache_packages() is None
+        assert vm.run_in_container.calls == []
+
+    def test_key_ignores_package_order(self, prov_vm):
+        first = prov_vm(first_boot_packages=['htop', 'nfs-common'])
+        debs_dir = first.cache_packages()
+        assert os.listdir(debs_dir) == ['htop_3.3.0_amd64.deb']
+        cmd, image = first.run_in_container.calls[0]
+        assert image == 'ubuntu:24.04'
+        assert cmd.endswith('htop nfs-common && rm -rf ' + f"{debs_dir}.tmp-{os.getpid()}/partial "
+                            f"{debs_dir}.tmp-{os.getpid()}/lock")
+
+        second = prov_vm(first_boot_packages=['nfs-common', 'htop'])
+        assert second.cache_packages() == debs_dir
+        assert second.run_in_container.calls == []
+
+    def test_key_covers_packages_and_image(self, prov_vm):
+        debs_dir = prov_vm(first_boot_packages=['htop']).cache_packages()
+        assert prov_vm(first_boot_packages=['htop', 'jq']).cache_packages() != debs_dir
+        assert prov_vm(first_boot_packages=['htop'], package_cache_image='ubuntu:22.04').cache_packages() != debs_dir
+
+    def test_failure_warns_and_leaves_nothing_behind(self, prov_vm):
+        vm = prov_vm(run=FakeRun(rc=100), first_boot_packages=['htop'])
+        assert vm.cache_packages() is None
+        assert 'first_boot_packages' in vm.module.warnings[0]
+        assert not os.path.exists(os.path.join(vm.cache_dir, 'debs'))
+
+
+class TestBuildProvisionRuncmd:
+
+    online_tailscale = 'curl -fsSL https://tailscale.com/install.sh | sh'
+
+    def test_without_provisioning_disk(self, prov_vm):
+        vm = prov_vm(first_boot_packages=['htop', 'jq'])
+        assert vm.build_provision_runcmd() == [
+            self.online_tailscale,
+            '(apt-get update && apt-get install -y htop jq)',
+        ]
+
+    def test_without_packages(self, prov_vm):
+        assert prov_vm().build_provision_runcmd() == [self.online_tailscale]
+
+    def test_cached_copies_first_internet_as_fallback(self, prov_vm):
+        vm = prov_vm(first_boot_packages=['htop'])
+        vm.provision_iso = '/cache/provision/x.iso'
+        vm.provision_has_tailscale = True
+        vm.provision_has_packages = True
+        assert vm.build_provision_runcmd() == [
+            'mkdir -p /mnt/sbnb-provision && mount -o ro LABEL=SBNBPROV /mnt/sbnb-provision',
+            f'sh /mnt/sbnb-provision/install-tailscale.sh || {self.online_tailscale}',
+            'sh /mnt/sbnb-provision/install-packages.sh || (apt-get update && apt-get install -y htop)',
+            'umount /mnt/sbnb-provision',
+        ]
+
+    def test_disk_without_tailscale(self, prov_vm):
+        vm = prov_vm(first_boot_packages=['htop'])
+        vm.provision_iso = '/cache/provision/x.iso'
+        vm.provision_has_packages = True
+        entries = vm.build_provision_runcmd()
+        assert entries[1] == self.online_tailscale
+        assert entries[2].startswith('sh /mnt/sbnb-provision/install-packages.sh')
+
+
+class TestProvisioningDisk:
+
+    def test_disabled(self, prov_vm):
+        vm = prov_vm(tailscale_version='1.80.2')
+        vm.prepare_provisioning()
+        assert vm.provision_iso is None
+        assert vm.run_in_container.calls == []
+
+    def test_disk_holds_the_deb_key_and_scripts(self, prov_vm, qemu_vm, monkeypatch):
+        staged = {}
+
+        def run(cmd, check_rc=True, image=None, devices=False):
+            staging = cmd.split()[-1]
+            for root, _dirs, files in os.walk(staging):
+                for name in files:
+                    staged[os.path.relpath(os.path.join(root, name), staging)] = True
+            with open(re.search(r'-output (\S+)', cmd).group(1), 'w') as f:
+                f.write('iso')
+            return 0, '', ''
+
+        vm = prov_vm(run=run, tailscale_version='1.80.2', offline_provisioning=True)
+        cache_release(vm, '1.80.2')
+        vm.prepare_provisioning()
+        assert vm.provision_iso.startswith(os.path.join(vm.cache_dir, 'provision'))
+        assert vm.provision_has_tailscale and not vm.provision_has_packages
+        assert sorted(staged) == [
+            'install-tailscale.sh',
+            'tailscale/tailscale-archive-keyring.gpg',
+            'tailscale/tailscale_1.80.2_amd64.deb',
+        ]
+        script = qemu_vm.PROVISION_TAILSCALE_SCRIPT
+        assert '/etc/apt/sources.list.d/tailscale.list' in script
+        assert 'apt-get install -y --no-download "$D"/tailscale/tailscale_*.deb' in script
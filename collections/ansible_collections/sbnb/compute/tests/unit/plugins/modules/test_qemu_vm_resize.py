@@ -0,0 +1,129 @@
+# Live resize of a running VM (vcpu/mem on state=present)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import json
+import os
+
+import pytest
+
+MB = 1024 * 1024
+
+
+class FakeQmp:
+    """QMP stand-in for a VM with vcpus CPUs and mem_mb of boot memory"""
+
+    def __init__(self, vcpus, mem_mb):
+        self.vcpus = vcpus
+        self.mem_mb = mem_mb
+        self.commands = []
+
+    def __call__(self, path, timeout=30):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, command, arguments=None):
+        self.commands.append(command)
+        if command == 'query-cpus-fast':
+            return [{}] * self.vcpus
+        if command == 'query-memory-size-summary':
+            return {'base-memory': self.mem_mb * MB}
+        if command == 'query-hotpluggable-cpus':
+            return [{'type': 'cpu', 'props': {'core-id': core}} for core in range(self.vcpus, 16)]
+        if command == 'device_add':
+            self.vcpus += 1
+        return {}
+
+
+class FakeVmContainer:
+    def __init__(self, cmd):
+        self.attrs = {'Config': {'Cmd': ['sh', '-c', cmd]}}
+
+
+@pytest.fixture
+def resize(make_vm, qemu_vm, monkeypatch):
+    """Run apply_live_resize for a VM booted with vcpu/mem and a saved request"""
+    def run(boot_vcpu, boot_mem, saved, host_free_mb=256 * 1024, maxcpus=16, **params):
+        vm = make_vm('vm1', **params)
+        monkeypatch.setattr(qemu_vm, 'get_system_memory_mb', lambda: host_free_mb)
+        qmp = FakeQmp(boot_vcpu, qemu_vm.parse_mem_mb(boot_mem))
+        monkeypatch.setattr(qemu_vm, 'QmpClient', qmp)
+        smp = f"{boot_vcpu},maxcpus={maxcpus}" if maxcpus else boot_vcpu
+        cmd = (f"qemu-system-x86_64 -smp {smp} -m {boot_mem} "
+               f"-qmp unix:{vm.vm_dir}/qmp.sock,server=on,wait=off")
+        os.makedirs(vm.vm_dir)
+        config = {'qemu_command': cmd, 'fingerprint': 'x'}
+        if saved is not None:
+            config['requested'] = saved
+        with open(vm.vm_config, 'w') as f:
+            json.dump(config, f)
+        vm.result = {'changed': False}
+        restart = vm.apply_live_resize(FakeVmContainer(cmd))
+        with open(vm.vm_config) as f:
+            return vm, qmp, restart, json.load(f)
+
+    return run
+
+
+def test_capped_vm_is_left_alone(resize):
+    # mem=512G was capped to the host at boot (an odd size); the host has
+    # little free memory now that the VM runs
+    vm, qmp, restart, config = resize(2, '260095M', {'vcpu': '2', 'mem': '512G'},
+                                      host_free_mb=1024, mem='512G')
+    assert restart is False
+    assert vm.result['changed'] is False
+    assert qmp.commands == []
+
+
+def test_max_is_left_alone(resize):
+    vm, qmp, restart, config = resize(62, '260095M', {'vcpu': 'max', 'mem': 'max'},
+                                      host_free_mb=1024, vcpu='max', mem='max')
+    assert restart is False and qmp.commands == []
+
+
+def test_vm_without_a_saved_request_records_it(resize):
+    vm, qmp, restart, config = resize(2, '4G', None, vcpu=4)
+    assert restart is False and qmp.commands == []
+    assert config['requested'] == {'vcpu': '4', 'mem': '4G'}
+
+
+def test_changed_request_is_hotplugged(resize):
+    vm, qmp, restart, config = resize(2, '4G', {'vcpu': '2', 'mem': '4G'}, vcpu=4)
+    assert restart is False
+    assert qmp.commands.count('device_add') == 2
+    assert vm.result['resized'] == {'vcpu': {'from': 2, 'to': 4}, 'live': True}
+    assert config['requested'] == {'vcpu': '4', 'mem': '4G'}
+
+
+def test_changed_request_that_cannot_be_hotplugged_fails(resize, qemu_vm):
+    with pytest.raises(qemu_vm.QemuVmError, match='no virtio-mem device'):
+        resize(2, '4G', {'vcpu': '2', 'mem': '4G'}, mem='8G')
+
+
+def test_vm_booted_without_max_vcpu_cannot_grow(resize, qemu_vm):
+    with pytest.raises(qemu_vm.QemuVmError, match=r'no vCPU hotplug headroom \(max_vcpu\)'):
+        resize(2, '4G', {'vcpu': '2', 'mem': '4G'}, maxcpus=None, vcpu=4)
+
+
+@pytest.mark.parametrize('params, expected', [
+    ({}, '2'),
+    ({'max_vcpu': 8}, '2,maxcpus=8'),
+    ({'max_vcpu': 2}, '2'),
+    ({'max_vcpu': 8, 'confidential_computing': True}, '2'),
+])
+def test_maxcpus_only_with_max_vcpu(make_vm, params, expected):
+    assert make_vm('vm1', **params).smp_option() == expected
+
+
+def test_changed_request_restarts_with_resize_restart(resize):
+    vm, qmp, restart, config = resize(2, '4G', {'vcpu': '2', 'mem': '4G'}, mem='8G', resize_restart=True)
+    assert restart is True
+    assert vm.result['resized'] == {'mem': {'from': '4096M', 'to': '8192M'}, 'live': False}
+    # Recorded by the restart (save_vm_config), not here
+    assert config['requested'] == {'vcpu': '2', 'mem': '4G'}
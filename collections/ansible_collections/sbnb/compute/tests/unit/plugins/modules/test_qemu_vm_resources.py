@@ -0,0 +1,148 @@
+# Container resource policy: Docker run limits and what a container reports back
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+
+import pytest
+
+MB = 1024 * 1024
+
+# docker-py run() keyword arguments and the HostConfig fields they set
+HOST_CONFIG_FIELDS = {
+    'cpu_shares': 'CpuShares',
+    'nano_cpus': 'NanoCpus',
+    'mem_limit': 'Memory',
+    'memswap_limit': 'MemorySwap',
+    'blkio_weight': 'BlkioWeight',
+    'device_read_bps': 'BlkioDeviceReadBps',
+    'device_write_bps': 'BlkioDeviceWriteBps',
+    'device_read_iops': 'BlkioDeviceReadIOps',
+    'device_write_iops': 'BlkioDeviceWriteIOps',
+}
+
+
+@pytest.fixture
+def limits_vm(make_vm, qemu_vm, monkeypatch):
+    monkeypatch.setattr(qemu_vm, 'block_device_for_path', lambda path, sysfs_root='/sys': '/dev/nvme0n1')
+
+    def make(**params):
+        return make_vm('vm1', vg_name='sbnb', **params)
+
+    return make
+
+
+def run_container(fake_container, limits):
+    """Container as Docker creates it from run(**limits)"""
+    container = fake_container('vm1', ['-c', 'qemu-system-x86_64'])
+    container.attrs['HostConfig'].update({HOST_CONFIG_FIELDS[key]: value for key, value in limits.items()})
+    return container
+
+
+class TestBuildResourceLimits:
+
+    def test_no_policy(self, limits_vm):
+        assert limits_vm().build_resource_limits() == {}
+
+    def test_cpu(self, limits_vm):
+        assert limits_vm(cpu_shares=512, cpu_quota=2.5).build_resource_limits() == {
+            'cpu_shares': 512, 'nano_cpus': 2500000000,
+        }
+
+    @pytest.mark.parametrize('mem_limit, expected_mb', [
+        ('18G', 18 * 1024),
+        ('1536M', 1536),
+        ('1.5G', 1536),
+        ('20', 20 * 1024),  # bare numbers are GB, as for mem
+    ])
+    def test_mem_limit_sizes(self, limits_vm, mem_limit, expected_mb):
+        limits = limits_vm(mem_limit=mem_limit).build_resource_limits()
+        assert limits['mem_limit'] == expected_mb * MB
+        assert limits['memswap_limit'] == limits['mem_limit']
+
+    def test_mem_limit_auto(self, limits_vm):
+        # 512M plus 2% of guest RAM on top of mem
+        assert limits_vm(mem='16G', mem_limit='auto').build_resource_limits()['mem_limit'] == (16384 + 512 + 327) * MB
+        assert limits_vm(mem='16G', mem_limit='auto', mem_overhead='1G').build_resource_limits()['mem_limit'] == (
+            17 * 1024 * MB
+        )
+
+    @pytest.mark.parametrize('params', [{'mem_limit': 'lots'}, {'mem_limit': 'auto', 'mem_overhead': '0'}])
+    def test_invalid_mem_limit(self, limits_vm, qemu_vm, params):
+        with pytest.raises(qemu_vm.QemuVmError, match='Invalid mem_limit'):
+            limits_vm(**params).build_resource_limits()
+
+    def test_io_max_on_the_storage_device(self, limits_vm):
+        limits = limits_vm(io_weight=200, io_max={
+            'read_bps': '200M', 'write_bps': '1G', 'read_iops': 4000, 'write_iops': None,
+        }).build_resource_limits()
+        assert limits == {
+            'blkio_weight': 200,
+            'device_read_bps': [{'Path': '/dev/nvme0n1', 'Rate': 200 * MB}],
+            'device_write_bps': [{'Path': '/dev/nvme0n1', 'Rate': 1024 * MB}],
+            'device_read_iops': [{'Path': '/dev/nvme0n1', 'Rate': 4000}],
+        }
+
+    def test_io_max_on_each_thin_volume(self, limits_vm):
+        limits = limits_vm(disk_backend='lvm-thin', data_disk_name='models',
+                           io_max={'write_iops': 1000}).build_resource_limits()
+        assert limits == {'device_write_iops': [
+            {'Path': '/dev/sbnb/sbnb-vm-vm1', 'Rate': 1000},
+            {'Path': '/dev/sbnb/sbnb-data-models', 'Rate': 1000},
+        ]}
+
+    def test_invalid_io_bandwidth(self, limits_vm, qemu_vm):
+        with pytest.raises(qemu_vm.QemuVmError, match=r'Invalid io_max\.write_bps'):
+            limits_vm(io_max={'write_bps': 'fast'}).build_resource_limits()
+
+
+class TestContainerResources:
+
+    def test_round_trip(self, limits_vm, fake_container):
+        vm = limits_vm(cpu_shares=512, cpu_quota=4.0, mem_limit='16G', io_weight=100,
+                       io_max={'read_bps': '200M', 'write_iops': 1000})
+        container = run_container(fake_container, vm.build_resource_limits())
+        assert vm.container_resources(container) == {
+            'cpu_shares': 512,
+            'cpu_quota': 4.0,
+            'mem_limit': 16 * 1024 * MB,
+            'io_weight': 100,
+            'io_max': {'device': '/dev/nvme0n1', 'read_bps': 200 * MB, 'write_iops': 1000},
+        }
+
+    def test_unlimited_container(self, limits_vm, fake_container):
+        vm = limits_vm()
+        container = run_container(fake_container, vm.build_resource_limits())
+        # Docker reports unset limits as 0 or null
+        container.attrs['HostConfig'].update({'Memory': 0, 'NanoCpus': 0, 'BlkioDeviceReadBps': None})
+        assert vm.container_resources(container) == {}
+
+
+class TestBlockDeviceForPath:
+
+    def sysfs(self, tmp_path, path, device, partition=None):
+        """Link /sys/dev/block/<major:minor> of path's device like the kernel does"""
+        st = os.stat(path)
+        dev_dir = tmp_path / 'sys' / 'devices' / 'pci0000:00' / 'block' / device
+        if partition:
+            dev_dir = dev_dir / partition
+        dev_dir.mkdir(parents=True)
+        if partition:
+            (dev_dir / 'partition').write_text('1\n')
+        links = tmp_path / 'sys' / 'dev' / 'block'
+        links.mkdir(parents=True)
+        (links / f"{os.major(st.st_dev)}:{os.minor(st.st_dev)}").symlink_to(dev_dir)
+        return str(tmp_path / 'sys')
+
+    def test_partition_resolves_to_its_disk(self, qemu_vm, tmp_path, storage):
+        sysfs = self.sysfs(tmp_path, storage, 'nvme0n1', partition='nvme0n1p2')
+        assert qemu_vm.block_device_for_path(storage, sysfs) == '/dev/nvme0n1'
+
+    def test_whole_device(self, qemu_vm, tmp_path, storage):
+        sysfs = self.sysfs(tmp_path, storage, 'dm-3')
+        assert qemu_vm.block_device_for_path(storage, sysfs) == '/dev/dm-3'
+
+    def test_missing_path(self, qemu_vm, tmp_path):
+        with pytest.raises(OSError):
+            qemu_vm.block_device_for_path(str(tmp_path / 'missing'), str(tmp_path))
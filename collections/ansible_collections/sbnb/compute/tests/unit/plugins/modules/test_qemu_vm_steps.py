@@ -0,0 +1,135 @@
+# run_step_graph, the dependency graph behind prepare_assets
+#
+# Parallel runs of whole step graphs are covered in test_qemu_vm_concurrency.py.
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import threading
+import time
+
+import pytest
+
+
+class Recorder:
+    """Step functions that log their start and end"""
+
+    def __init__(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    def step(self, name, result=None, error=None, seconds=0.0):
+        def fn():
+            with self.lock:
+                self.events.append(('start', name))
+            time.sleep(seconds)
+            with self.lock:
+                self.events.append(('end', name))
+            if error:
+                raise error
+            return result
+        return fn
+
+    def started(self):
+        return [name for event, name in self.events if event == 'start']
+
+    def position(self, event, name):
+        return self.events.index((event, name))
+
+
+def test_dependencies_finish_before_dependents_start(qemu_vm):
+    rec = Recorder()
+    steps = {
+        'boot_image': (('download', 'vm_directory'), rec.step('boot_image', 'boot')),
+        'download': ((), rec.step('download', 'image', seconds=0.05)),
+        'vm_directory': ((), rec.step('vm_directory')),
+        'cloud_init': (('vm_directory',), rec.step('cloud_init', 'seed')),
+    }
+    results, timings, errors = qemu_vm.run_step_graph(steps)
+
+    assert errors == {}
+    assert results == {'boot_image': 'boot', 'download': 'image', 'vm_directory': None, 'cloud_init': 'seed'}
+    assert sorted(timings) == sorted(steps)
+    assert timings['download'] >= 0.05
+    for name, (deps, _fn) in steps.items():
+        for dep in deps:
+            assert rec.position('end', dep) < rec.position('start', name)
+
+
+def test_independent_steps_overlap(qemu_vm):
+    rec = Recorder()
+    both = threading.Barrier(2)
+
+    def meet(name):
+        def fn():
+            both.wait(5)
+            return name
+        return fn
+
+    results, timings, errors = qemu_vm.run_step_graph({
+        'download': ((), meet('download')),
+        'gpu_passthrough': ((), meet('gpu_passthrough')),
+        'boot_image': (('download',), rec.step('boot_image')),
+    }, max_workers=2)
+    # A serial run would break the barrier
+    assert errors == {}
+    assert results['download'] == 'download'
+
+
+def test_failure_skips_dependents_only(qemu_vm):
+    rec = Recorder()
+    results, timings, errors = qemu_vm.run_step_graph({
+        'download': ((), rec.step('download', error=qemu_vm.QemuVmError('Failed to download image: 404'))),
+        'tune_image': (('download',), rec.step('tune_image')),
+        'boot_image': (('vm_directory', 'tune_image'), rec.step('boot_image')),
+        'vm_directory': ((), rec.step('vm_directory', 'dir')),
+        'cloud_init': (('vm_directory',), rec.step('cloud_init', 'seed')),
+    })
+
+    assert errors == {
+        'download': 'Failed to download image: 404',
+        'tune_image': 'skipped, download failed',
+        'boot_image': 'skipped, tune_image failed',
+    }
+    assert sorted(rec.started()) == ['cloud_init', 'download', 'vm_directory']
+    assert results == {'vm_directory': 'dir', 'cloud_init': 'seed'}
+    # Failed steps report their time, skipped ones have none
+    assert 'download' in timings and 'tune_image' not in timings
+
+
+def test_every_failure_is_reported(qemu_vm):
+    rec = Recorder()
+    results, timings, errors = qemu_vm.run_step_graph({
+        'gpu_passthrough': ((), rec.step('gpu_passthrough', error=qemu_vm.QemuVmError('need 2, 1 free'))),
+        'data_disk': ((), rec.step('data_disk', error=OSError(28, 'No space left on device'))),
+        'shared_dirs': ((), rec.step('shared_dirs', error=KeyError())),
+    })
+    assert errors == {
+        'gpu_passthrough': 'need 2, 1 free',
+        'data_disk': '[Errno 28] No space left on device',
+        'shared_dirs': 'KeyError',
+    }
+    assert results == {}
+
+
+def test_unknown_dependency(qemu_vm):
+    rec = Recorder()
+    with pytest.raises(ValueError, match='step boot_image depends on unknown steps: downlaod'):
+        qemu_vm.run_step_graph({
+            'download': ((), rec.step('download')),
+            'boot_image': (('downlaod',), rec.step('boot_image')),
+        })
+    assert rec.events == []
+
+
+def test_dependency_cycle(qemu_vm):
+    rec = Recorder()
+    results, timings, errors = qemu_vm.run_step_graph({
+        'a': (('b',), rec.step('a')),
+        'b': (('a',), rec.step('b')),
+        'c': (('a',), rec.step('c')),
+        'd': ((), rec.step('d', 'ran', seconds=0.05)),
+    })
+    assert errors == {name: 'skipped, dependency cycle' for name in 'abc'}
+    assert results == {'d': 'ran'}
+    assert rec.started() == ['d']